@@ -0,0 +1,61 @@
+"""Commit throughput of the two-phase commit against the direct commit loop.
+
+Runs the same synthetic workload (see `benchmark.workload`) with each commit
+protocol, with no log and with the commits of each site logged to a
+temporary directory, and prints the commits per second. The two-phase commit
+asks every site a transaction accessed for its vote at `end`, then sends the
+decision to the sites that took part in the transaction.
+
+Usage:
+    python -m benchmark.commit [--transactions N] [--clients C] [--read-ratio R]
+"""
+import argparse
+import shutil
+import tempfile
+
+from benchmark.workload import Workload, build_parser
+from transaction.commit import COMMIT_PROTOCOLS
+
+
+def run_workload(arguments, protocol: str, log_dir: str = None) -> dict:
+    workload_arguments = build_parser().parse_args([
+        '--transactions', str(arguments.transactions),
+        '--clients', str(arguments.clients),
+        '--operations', str(arguments.operations),
+        '--read-ratio', str(arguments.read_ratio),
+        '--fail-rate', str(arguments.fail_rate),
+        '--seed', str(arguments.seed),
+        '--commit', protocol,
+    ])
+    workload_arguments.log_dir = log_dir
+    return Workload(workload_arguments).run()
+
+
+def main(arguments):
+    print('transactions: {}, clients: {}, operations: {}, read ratio: {}'.format(
+        arguments.transactions, arguments.clients, arguments.operations, arguments.read_ratio))
+    for is_logged in (False, True):
+        for protocol in COMMIT_PROTOCOLS:
+            directory = tempfile.mkdtemp() if is_logged else None
+            try:
+                result = run_workload(arguments, protocol, directory)
+            finally:
+                if directory is not None:
+                    shutil.rmtree(directory)
+            rounds = result['decision_rounds']
+            print('{:>20}: {:.0f} commits/s, {} commits, {} aborts{}'.format(
+                '{}{}'.format(protocol, ', logged' if is_logged else ''),
+                result['commits'] / result['seconds'], result['commits'], result['aborts'],
+                ', {} decision rounds, {} decide requests'.format(rounds, result['decision_messages'])
+                if rounds is not None else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the commit protocols.')
+    parser.add_argument('--transactions', type=int, default=3000, help='number of transactions to run')
+    parser.add_argument('--clients', type=int, default=20, help='number of concurrent closed-loop clients')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.5, help='fraction of the operations that are reads')
+    parser.add_argument('--fail-rate', type=float, default=0.001, help='probability that a site fails at each tick')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    main(parser.parse_args())
@@ -0,0 +1,105 @@
+"""Per-tick cost of deadlock detection.
+
+Compares the incremental wait-for graph kept by the lock managers with the
+original approach that rebuilds the blocking graph from every up site and
+searches it for cycles on each tick.
+
+Also times the maintenance of the wait-for edges on one hot variable whose
+queue is full of writers: queuing a writer, aborting a waiting writer and
+granting the lock to the next one only update the edges they affect, while
+regenerating the edges of the variable costs O(q^2) for q queued locks.
+
+Usage:
+    python -m benchmark.deadlock [--transactions N] [--ticks K] [--writers Q [Q ...]]
+"""
+import argparse
+import contextlib
+import os
+import time
+
+from data.lock import LockManager, WriteLock
+from transaction.deadlock_detector import WaitForGraph, detect, generate_blocking_graph
+from transaction.manager import TransactionManager
+
+
+def build_manager(transaction_count: int) -> TransactionManager:
+    """
+    Create a manager whose transactions are all waiting: T1 holds the write lock
+    of x2 on every site, and every other transaction waits to read x2.
+    """
+    manager = TransactionManager()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        manager.process('begin(T1)')
+        manager.process('W(T1,x2,0)')
+        for i in range(2, transaction_count + 1):
+            manager.process('begin(T{})'.format(i))
+            manager.process('R(T{},x2)'.format(i))
+    return manager
+
+
+def time_hot_writers(writers: int, changes: int) -> tuple:
+    """
+    Queue writers behind T0's write lock of x2, then time per lock change
+    queuing them, aborting and re-queuing a writer in the middle of the queue,
+    and granting the lock to the next writer, against regenerating the edges.
+    """
+    lock_manager = LockManager(2, WaitForGraph())
+    lock_manager.set_current_lock(WriteLock(0, 2))
+    start = time.perf_counter()
+    for tid in range(1, writers + 1):
+        lock_manager.add_lock_to_queue(WriteLock(tid, 2))
+    queue = (time.perf_counter() - start) / writers
+
+    start = time.perf_counter()
+    for i in range(changes):
+        tid = writers // 2 + i
+        lock_manager.remove_lock_from_queue(tid)
+        lock_manager.add_lock_to_queue(WriteLock(tid, 2))
+    abort = (time.perf_counter() - start) / changes
+
+    start = time.perf_counter()
+    for _ in range(changes):
+        lock_manager.release_current_lock(lock_manager.current_lock.tid)
+        lock_manager.grant_queued_locks()
+    grant = (time.perf_counter() - start) / changes
+
+    rebuild = time_per_tick(lock_manager.generate_blocking_edges, 1)
+    return queue, abort, grant, rebuild
+
+
+def time_per_tick(func, ticks: int) -> float:
+    start = time.perf_counter()
+    for _ in range(ticks):
+        func()
+    return (time.perf_counter() - start) / ticks
+
+
+def main(arguments):
+    manager = build_manager(arguments.transactions)
+    # The first incremental check has to look at the edges inserted while
+    # building the workload, the following ticks see no lock changes.
+    first_check = time_per_tick(manager.detect_deadlock, 1)
+    incremental = time_per_tick(manager.detect_deadlock, arguments.ticks)
+    rebuild = time_per_tick(lambda: detect(manager.transactions, generate_blocking_graph(manager.sites)),
+                            arguments.ticks)
+    edges = sum(len(x) for x in manager.wait_for_graph.graph.values())
+    print('transactions: {}, wait-for edges: {}'.format(arguments.transactions, edges))
+    print('rebuild + detect:         {:.3f} ms/tick'.format(rebuild * 1000))
+    print('incremental, new edges:   {:.3f} ms/tick'.format(first_check * 1000))
+    print('incremental, no changes:  {:.6f} ms/tick'.format(incremental * 1000))
+
+    print('hot writers, per lock change:')
+    for writers in arguments.writers:
+        queue, abort, grant, rebuild = time_hot_writers(writers, arguments.changes)
+        print('{:>6} queued: queue {:.1f} us, abort {:.1f} us, grant {:.1f} us, regenerate {:.3f} ms'.format(
+            writers, queue * 1e6, abort * 1e6, grant * 1e6, rebuild * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark deadlock detection per tick.')
+    parser.add_argument('--transactions', type=int, default=300, help='number of concurrent transactions')
+    parser.add_argument('--ticks', type=int, default=20, help='number of measured ticks')
+    parser.add_argument('--writers', type=int, nargs='+', default=[250, 500, 1000, 2000],
+                        help='numbers of writers queued on the hot variable')
+    parser.add_argument('--changes', type=int, default=50, help='number of measured aborts and grants')
+    main(parser.parse_args())
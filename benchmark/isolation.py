@@ -0,0 +1,62 @@
+"""Throughput and abort rate of snapshot isolation against two-phase locking.
+
+Runs the synthetic workload (see `benchmark.workload`) with each isolation of
+the read/write transactions, on a read-heavy workload and on workloads where
+a few variables get most of the operations, and prints the commits per
+second and the share of the transactions that aborted, by cause. Under
+two-phase locking the transactions wait for locks and abort in deadlocks,
+under snapshot isolation they never wait for each other, and the first
+committer wins when two of them write the same variable.
+
+Usage:
+    python -m benchmark.isolation [--transactions N] [--clients C]
+"""
+import argparse
+
+from benchmark.workload import Workload, build_parser
+from transaction.manager import ISOLATION_LEVELS
+
+# name -> (read ratio, zipf skew) of the compared workloads
+WORKLOADS = {
+    'read-heavy': (0.9, 0.8),
+    'skewed': (0.7, 1.2),
+    'read-heavy, skewed': (0.9, 1.2),
+    'write-heavy': (0.3, 0.8),
+}
+
+
+def run_workload(arguments, isolation: str, read_ratio: float, zipf: float) -> dict:
+    workload_arguments = build_parser().parse_args([
+        '--transactions', str(arguments.transactions),
+        '--clients', str(arguments.clients),
+        '--operations', str(arguments.operations),
+        '--read-ratio', str(read_ratio),
+        '--zipf', str(zipf),
+        '--fail-rate', str(arguments.fail_rate),
+        '--seed', str(arguments.seed),
+        '--isolation', isolation,
+    ])
+    return Workload(workload_arguments).run()
+
+
+def main(arguments):
+    print('transactions: {}, clients: {}, operations: {}'.format(
+        arguments.transactions, arguments.clients, arguments.operations))
+    for name, (read_ratio, zipf) in WORKLOADS.items():
+        print('{} (read ratio {}, zipf {}):'.format(name, read_ratio, zipf))
+        for isolation in ISOLATION_LEVELS:
+            result = run_workload(arguments, isolation, read_ratio, zipf)
+            finished = result['transactions_finished'] or 1
+            print('{:>10}: {:.0f} commits/s, {:.1%} aborted ({} deadlock, {} write conflict, {} site failure)'.format(
+                isolation, result['commits'] / result['seconds'], result['aborts'] / finished,
+                result['deadlock_aborts'], result['write_conflict_aborts'], result['site_failure_aborts']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark snapshot isolation against two-phase locking.')
+    parser.add_argument('--transactions', type=int, default=3000, help='number of transactions to run')
+    parser.add_argument('--clients', type=int, default=20, help='number of concurrent closed-loop clients')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--fail-rate', type=float, default=0.001, help='probability that a site fails at each tick')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    main(parser.parse_args())
@@ -0,0 +1,51 @@
+"""Lock grant and release under high read sharing.
+
+Many transactions share the read lock of one hot variable, while a writer
+waits in the queue behind them, with the wait-for graph kept up to date.
+Measures the cost of granting the shared read lock to every reader,
+checking that each one holds it, releasing them one by one and granting
+the lock to the writer.
+
+Usage:
+    python -m benchmark.locks [--readers N] [--rounds K]
+"""
+import argparse
+import time
+
+from data.lock import LockManager, ReadLock, WriteLock
+from transaction.deadlock_detector import WaitForGraph
+
+
+def share_and_release(readers: int) -> None:
+    wait_for_graph = WaitForGraph()
+    lock_manager = LockManager(2, wait_for_graph)
+    lock_manager.set_current_lock(ReadLock(0, 2))
+    for tid in range(1, readers):
+        lock_manager.share_current_lock(tid)
+    # The writer waits for every reader.
+    writer = readers
+    lock_manager.add_lock_to_queue(WriteLock(writer, 2))
+    for tid in range(readers):
+        assert tid in lock_manager.shared_read_lock
+    for tid in range(readers):
+        lock_manager.release_current_lock(tid)
+    assert lock_manager.current_lock is None
+    lock_manager.grant_queued_locks()
+    assert lock_manager.current_lock.tid == writer and not wait_for_graph.graph
+
+
+def main(arguments):
+    start = time.perf_counter()
+    for _ in range(arguments.rounds):
+        share_and_release(arguments.readers)
+    elapsed = (time.perf_counter() - start) / arguments.rounds
+    print('readers: {}'.format(arguments.readers))
+    print('grant + check + release, one writer queued: {:.3f} ms/round, {:.3f} us/reader'.format(
+        elapsed * 1000, elapsed / arguments.readers * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark shared read locks.')
+    parser.add_argument('--readers', type=int, default=1000, help='number of transactions sharing the read lock')
+    parser.add_argument('--rounds', type=int, default=20, help='number of measured rounds')
+    main(parser.parse_args())
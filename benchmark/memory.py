@@ -0,0 +1,83 @@
+"""Memory used by variable versions and queued locks.
+
+Allocates a large number of committed versions on one variable and of
+queued locks on one lock manager, and reports the bytes used per object,
+compared with the same objects backed by a `__dict__`.
+
+Usage:
+    python -m benchmark.memory [--objects N]
+"""
+import argparse
+import gc
+import tracemalloc
+
+from data.lock import LockManager, LockType, ReadLock
+from data.value import CommitValue
+from data.variable import Variable
+
+
+class DictCommitValue:
+    """A commit value without `__slots__`, as a baseline."""
+    def __init__(self, v, commit_time: int):
+        self.value = v
+        self.commit_time = commit_time
+
+
+class DictReadLock:
+    """A read lock without `__slots__`, as a baseline."""
+    def __init__(self, tid: int, vid: int):
+        self.tid = tid
+        self.vid = vid
+        self.lock_type = LockType.R
+
+
+def measure(build) -> float:
+    """Return the number of bytes allocated by `build`, which must return the built objects.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return after - before
+
+
+def build_versions(count: int, value_class):
+    def build():
+        v = Variable(2, CommitValue(20, 0), True)
+        for i in range(1, count + 1):
+            # Values are small ints, which are shared, like the values of a real workload.
+            v.add_commit_value(value_class(i % 256, i))
+        return v
+    return build
+
+
+def build_queued_locks(count: int, lock_class):
+    def build():
+        lock_manager = LockManager(2)
+        # Queue the locks directly, add_lock_to_queue would check for duplicates.
+        for tid in range(count):
+            lock_manager.lock_queue.append(lock_class(tid, 2))
+        return lock_manager
+    return build
+
+
+def main(arguments):
+    count = arguments.objects
+    rows = [
+        ('variable version, __slots__', measure(build_versions(count, CommitValue))),
+        ('variable version, __dict__', measure(build_versions(count, DictCommitValue))),
+        ('queued lock, __slots__', measure(build_queued_locks(count, ReadLock))),
+        ('queued lock, __dict__', measure(build_queued_locks(count, DictReadLock))),
+    ]
+    print('objects: {}'.format(count))
+    for name, total in rows:
+        print('{:<30} {:8.1f} bytes/object'.format(name, total / count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the memory of versions and locks.')
+    parser.add_argument('--objects', type=int, default=1000000, help='number of objects of each kind')
+    main(parser.parse_args())
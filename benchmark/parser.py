@@ -0,0 +1,90 @@
+"""Parse throughput on large traces.
+
+Writes a trace of random commands to a temporary file, then compares the
+original line parser (split on `//`, strip, `re.findall(r'\\w+')`, then the
+name translation) with the streaming `Parser.parse_file`.
+
+Usage:
+    python -m benchmark.parser [--lines N] [--transactions T]
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+from data.names import NameTable
+from transaction.parser import Parser
+
+COMMANDS = {'begin', 'end', 'W', 'R', 'dump', 'beginRO', 'fail', 'recover'}
+
+
+def write_trace(path: str, line_count: int, transaction_count: int) -> None:
+    rng = random.Random(0)
+    with open(path, 'w') as f:
+        for i in range(line_count):
+            tid = rng.randrange(1, transaction_count + 1)
+            choice = rng.random()
+            if choice < 0.4:
+                f.write('R(T{}, x{})\n'.format(tid, rng.randrange(1, 21)))
+            elif choice < 0.8:
+                f.write('W(T{}, x{}, {})\n'.format(tid, rng.randrange(1, 21), i))
+            elif choice < 0.9:
+                f.write('begin(T{})\n'.format(tid))
+            elif choice < 0.98:
+                f.write('end(T{})   // comment\n'.format(tid))
+            else:
+                f.write('fail({})\n'.format(rng.randrange(1, 11)))
+
+
+def parse_original(path: str) -> int:
+    """The parser before the typed commands, counting the parsed lines.
+    """
+    names = NameTable()
+    count = 0
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('//')[0].strip()
+            if line != '':
+                res = re.findall(r'\w+', line)
+                if res[0] not in COMMANDS:
+                    raise ValueError(res[0])
+                if res[0] in ('fail', 'recover'):
+                    res[1:] = [int(x) for x in res[1:]]
+                elif len(res) > 1:
+                    res[1] = names.tid(res[1])
+                    if len(res) > 2:
+                        res[2] = names.vid(res[2])
+                count += 1
+    return count
+
+
+def parse_streaming(path: str) -> int:
+    count = 0
+    for _ in Parser().parse_file(path):
+        count += 1
+    return count
+
+
+def main(arguments):
+    fd, path = tempfile.mkstemp(suffix='.trace')
+    os.close(fd)
+    try:
+        write_trace(path, arguments.lines, arguments.transactions)
+        print('lines: {}, file size: {:.1f} MB'.format(arguments.lines, os.path.getsize(path) / 1e6))
+        for name, parse in (('original', parse_original), ('streaming', parse_streaming)):
+            start = time.perf_counter()
+            count = parse(path)
+            elapsed = time.perf_counter() - start
+            assert count == arguments.lines
+            print('{:>9}: {:.2f} s, {:.0f} lines/s'.format(name, elapsed, count / elapsed))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark command parsing.')
+    parser.add_argument('--lines', type=int, default=2000000, help='number of lines in the trace')
+    parser.add_argument('--transactions', type=int, default=1000, help='number of distinct transactions')
+    main(parser.parse_args())
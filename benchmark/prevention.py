@@ -0,0 +1,57 @@
+"""Throughput and abort rate of the deadlock prevention policies against the detection.
+
+Runs the synthetic workload (see `benchmark.workload`) with the deadlocks
+detected in the wait-for graph, and prevented with wait-die and wound-wait,
+with a growing skew of the variable popularity, and prints the commits per
+second and the share of the transactions aborted by the deadlock handling.
+The prevention policies abort some transactions that would never deadlock,
+but they don't maintain the wait-for graph nor search it for cycles.
+
+Usage:
+    python -m benchmark.prevention [--transactions N] [--clients C] [--read-ratio R]
+"""
+import argparse
+
+from benchmark.workload import Workload, build_parser
+from transaction.prevention import DEADLOCK_POLICIES
+
+
+def run_workload(arguments, policy: str, zipf: float) -> dict:
+    workload_arguments = build_parser().parse_args([
+        '--transactions', str(arguments.transactions),
+        '--clients', str(arguments.clients),
+        '--operations', str(arguments.operations),
+        '--read-ratio', str(arguments.read_ratio),
+        '--zipf', str(zipf),
+        '--fail-rate', str(arguments.fail_rate),
+        '--seed', str(arguments.seed),
+        '--deadlock', policy,
+    ])
+    return Workload(workload_arguments).run()
+
+
+def main(arguments):
+    print('transactions: {}, clients: {}, operations: {}, read ratio: {}'.format(
+        arguments.transactions, arguments.clients, arguments.operations, arguments.read_ratio))
+    for zipf in arguments.zipf:
+        print('zipf {}:'.format(zipf))
+        for policy in DEADLOCK_POLICIES:
+            result = run_workload(arguments, policy, zipf)
+            finished = result['transactions_finished'] or 1
+            print('{:>12}: {:.0f} commits/s, {:.0f} client commands/s, {:.1%} aborted by the deadlock handling, '
+                  '{:.1%} in all'.format(policy, result['commits'] / result['seconds'],
+                                         result['commands_per_second'], result['deadlock_aborts'] / finished,
+                                         result['aborts'] / finished))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the deadlock prevention policies against the detection.')
+    parser.add_argument('--transactions', type=int, default=3000, help='number of transactions to run')
+    parser.add_argument('--clients', type=int, default=20, help='number of concurrent closed-loop clients')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.7, help='fraction of the operations that are reads')
+    parser.add_argument('--zipf', type=float, nargs='+', default=[0.0, 0.8, 1.2],
+                        help='skews of the variable popularity to compare')
+    parser.add_argument('--fail-rate', type=float, default=0.001, help='probability that a site fails at each tick')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    main(parser.parse_args())
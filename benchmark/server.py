@@ -0,0 +1,179 @@
+"""Throughput and latency of the transaction server under many concurrent clients.
+
+Every client opens its own connection and runs transactions one after
+another: it sends a command, waits for its result (the read, the write, the
+commit or an abort), then sends the next one. The server runs in the same
+process on a local TCP port or Unix socket, unless `--address` points to a
+server started with `python main.py --serve ADDRESS --output json`.
+
+Usage:
+    python -m benchmark.server [--clients C] [--transactions N] [--unix] [--address ADDRESS]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmark.workload import percentile
+from server import TransactionServer, parse_address
+
+# The events that complete each kind of command, an abort or an error completes all of them.
+COMPLETIONS = {
+    'begin': ('begin',),
+    'R': ('read',),
+    'W': ('write',),
+    'end': ('commit',),
+}
+
+
+class LoadClient:
+    """A client that runs its share of the transactions over one connection.
+    """
+    def __init__(self, number: int, arguments, latencies: dict) -> None:
+        self.number = number
+        self.arguments = arguments
+        self.rng = random.Random(arguments.seed * 1000 + number)
+        self.latencies = latencies  # kind of command -> list of seconds
+        self.name = None  # name of the running transaction
+        self.waiting = None  # (events that complete the command, future)
+        self.is_aborted = False  # the running transaction was aborted between two of its commands
+        self.commits = 0
+        self.aborts = 0
+        self.commands = 0
+
+    async def run(self, host: str, port: int, path: str, transactions: int) -> None:
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        receiving = asyncio.ensure_future(self.receive(reader))
+        try:
+            for i in range(transactions):
+                await self.run_transaction(writer, 'C{}_{}'.format(self.number, i))
+            writer.write(b'exit\n')
+            await writer.drain()
+        finally:
+            receiving.cancel()
+            writer.close()
+
+    async def run_transaction(self, writer, name: str) -> None:
+        self.name = name
+        self.is_aborted = False
+        if await self.send(writer, 'begin', 'begin({})'.format(name)) != 'begin':
+            return
+        for _ in range(self.arguments.operations):
+            vid = self.rng.randint(1, self.arguments.variables)
+            if self.rng.random() < self.arguments.read_ratio:
+                outcome = await self.send(writer, 'R', 'R({}, x{})'.format(name, vid))
+            else:
+                outcome = await self.send(writer, 'W', 'W({}, x{}, {})'.format(name, vid, self.rng.randrange(1000)))
+            if outcome == 'abort' or outcome == 'error':
+                self.aborts += 1
+                return
+        if await self.send(writer, 'end', 'end({})'.format(name)) != 'commit':
+            self.aborts += 1
+        else:
+            self.commits += 1
+
+    async def send(self, writer, kind: str, line: str) -> str:
+        """Send a command and wait for its result, return the name of the event that completed it.
+        """
+        if self.is_aborted:
+            return 'abort'
+        future = asyncio.get_event_loop().create_future()
+        self.waiting = (COMPLETIONS[kind], future)
+        start = time.perf_counter()
+        writer.write(line.encode() + b'\n')
+        await writer.drain()
+        outcome = await future
+        self.latencies[kind].append(time.perf_counter() - start)
+        self.commands += 1
+        return outcome
+
+    async def receive(self, reader) -> None:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            event = json.loads(line)
+            name = event['event']
+            if event.get('tid') != self.name:
+                continue
+            if self.waiting is None:
+                # A deadlock can abort a transaction that doesn't wait at the moment, because of a lock it
+                # still has in the queue of another copy, the next command of the client is not sent.
+                if name == 'abort':
+                    self.is_aborted = True
+                continue
+            events, future = self.waiting
+            if name in events or name == 'abort' or name == 'error':
+                self.waiting = None
+                future.set_result(name)
+
+
+async def run(arguments) -> dict:
+    server = None
+    directory = None
+    if arguments.address:
+        host, port, path = parse_address(arguments.address)
+    else:
+        server = TransactionServer(mode='json')
+        if arguments.unix:
+            directory = tempfile.mkdtemp()
+            host, port, path = None, None, os.path.join(directory, 'server.sock')
+        else:
+            host, port, path = '127.0.0.1', 0, None
+        await server.start(host, port, path)
+        if path is None:
+            port = server.addresses()[0][1]
+
+    latencies = defaultdict(list)
+    clients = [LoadClient(i, arguments, latencies) for i in range(arguments.clients)]
+    per_client = arguments.transactions // arguments.clients
+    start = time.perf_counter()
+    await asyncio.gather(*(client.run(host, port, path, per_client) for client in clients))
+    seconds = time.perf_counter() - start
+
+    if server is not None:
+        server.close()
+    if directory is not None:
+        os.rmdir(directory)
+
+    commands = sum(client.commands for client in clients)
+    commits = sum(client.commits for client in clients)
+    return {
+        'config': vars(arguments),
+        'seconds': seconds,
+        'commands_per_second': commands / seconds,
+        'commits_per_second': commits / seconds,
+        'commits': commits,
+        'aborts': sum(client.aborts for client in clients),
+        'latency_ms': {kind: {
+            'count': len(values),
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+            'max': values[-1] * 1000,
+        } for kind, values in ((kind, sorted(values)) for kind, values in latencies.items())},
+    }
+
+
+def main(arguments):
+    print(json.dumps(asyncio.run(run(arguments)), indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the transaction server with concurrent clients.')
+    parser.add_argument('--clients', type=int, default=50, help='number of concurrent client connections')
+    parser.add_argument('--transactions', type=int, default=5000, help='number of transactions of all the clients')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.7, help='fraction of the operations that are reads')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables the clients use')
+    parser.add_argument('--unix', action='store_true', help='serve on a Unix socket instead of a local TCP port')
+    parser.add_argument('--address', help='host:port or Unix socket path of a running server, which must output JSON')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    main(parser.parse_args())
@@ -0,0 +1,386 @@
+"""Discrete-event simulation of the clients of the engine, delayed by the latency of the sites.
+
+The engine itself has no notion of time, every command is a tick. Here the
+commands are messages in simulated time, kept in a priority queue of events:
+transactions arrive as a Poisson process, every one of them is a session that
+sends its commands one at a time to the transaction manager, and waits for the
+result before sending the next one.
+
+A command reaches the transaction manager after the client delay, and is
+processed in its own tick, in the order of arrival. This is a client-side
+delay model: the engine doesn't know about the latency and doesn't wait for
+any message, it takes and releases the locks and writes the copies at once
+when it processes the command, as in any other run. Only the result is held
+back, and reaches the client after the messages with the sites the command
+would have needed:
+    * a read tries the copies one after another, one round trip each,
+    * a write asks for the locks of all the copies, then writes them, two rounds,
+    * a commit or an abort is one round with the sites the transaction visited,
+plus the client delay. The one-way delay of each link between the transaction
+manager and a site is `--delay`, or the value given to the site by `--link`,
+with a uniform jitter. Since a client sends its next command, and its end,
+only once it got the previous result, the latency stretches the life of the
+transactions and how long they hold their locks, which shows in the waits,
+the deadlocks and the throughput. The locks are still released as soon as the
+commit or the abort is processed, not after the messages with the sites.
+
+Sites fail at random and recover after a downtime. A replicated variable
+can't be read at a recovered site until it is written again, and the reads
+of it wait until then, so the runs with failures have a longer tail.
+
+Deadlocks are solved right before and after each tick rather than at its
+start, so that a command is never processed after the detection of its own
+tick aborted its transaction. The commands of aborted transactions, which
+were on their way when the abort happened, are dropped.
+
+Usage:
+    python -m benchmark.simulation [--arrival-rate R] [--duration S] [--delay MS] [--link SID=MS] ...
+"""
+import argparse
+import heapq
+import json
+import random
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+
+from benchmark.workload import percentile
+from data.topology import Topology
+from output import Sink
+from transaction.manager import TransactionManager
+from transaction.parser import Command, Opcode
+
+
+class Session:
+    """A transaction and the client that runs it, which has at most one command on its way.
+    """
+    __slots__ = ('name', 'tid', 'is_ro', 'remaining', 'arrival_time', 'send_time', 'kind', 'visited_sites',
+                 'tried_sites', 'tried_tick', 'is_finished')
+
+    def __init__(self, name: str, tid: int, is_ro: bool, operations: int, arrival_time: float) -> None:
+        self.name = name
+        self.tid = tid
+        self.is_ro = is_ro
+        self.remaining = operations  # operations left to send
+        self.arrival_time = arrival_time
+        self.send_time = None  # when the command on its way was sent
+        self.kind = None  # kind of the command on its way: begin, R, W or end
+        self.visited_sites = set()  # sites read or written, which take part in the commit
+        self.tried_sites = []  # sites whose copy couldn't be read in the tick of tried_tick
+        self.tried_tick = -1
+        self.is_finished = False  # whether the transaction committed or aborted at the transaction manager
+
+
+class SimulationSink(Sink):
+    """Turn the events of the engine into the results sent back to the sessions.
+    """
+    def __init__(self, simulation) -> None:
+        self.simulation = simulation
+
+    def emit(self, event: str, template: str, **fields) -> None:
+        simulation = self.simulation
+        if event == 'read':
+            simulation.read_done(fields['tid'], fields['sid'])
+        elif event == 'read_failed':
+            if 'sid' in fields:
+                simulation.read_failed(fields['tid'], fields['sid'])
+        elif event == 'write':
+            simulation.write_done(fields['tid'], fields['sites'])
+        elif event == 'begin' or event == 'begin_ro':
+            simulation.begin_done(fields['tid'])
+        elif event == 'commit':
+            simulation.transaction_done(fields['tid'], True, None)
+        elif event == 'abort':
+            simulation.transaction_done(fields['tid'], False, fields['reason'])
+        elif event == 'deadlock':
+            simulation.deadlocks += 1
+
+
+class Simulation:
+    def __init__(self, arguments) -> None:
+        self.arguments = arguments
+        self.rng = random.Random(arguments.seed)
+        self.topology = Topology(arguments.sites, arguments.variables)
+        self.manager = TransactionManager(self.topology, SimulationSink(self))
+        self.names = self.manager.names
+
+        # One-way delay of the link between the transaction manager and each site, in milliseconds.
+        self.link_delays = {sid: arguments.delay for sid in self.topology.site_ids()}
+        for link in arguments.link or ():
+            sid, delay = link.split('=')
+            self.link_delays[int(sid)] = float(delay)
+
+        self.hot_variables = list(range(1, arguments.variables + 1))
+        self.rng.shuffle(self.hot_variables)
+        self.cumulative_weights = list(accumulate(1 / (rank ** arguments.zipf)
+                                                  for rank in range(1, arguments.variables + 1)))
+
+        self.now = 0.0  # simulated time in milliseconds
+        self.events = []  # heap of (time, seq, handler, args)
+        self.next_seq = 0
+        self.manager_free_time = 0.0  # when the transaction manager is done with the commands it got
+        self.sessions = {}  # name of the transaction -> session, until the client knows it ended
+        self.down_sites = set()
+        self.processed_events = 0
+
+        self.arrivals = 0
+        self.commits = 0
+        self.deadlock_aborts = 0
+        self.failure_aborts = 0
+        self.deadlocks = 0
+        self.failures = 0
+        self.latencies = defaultdict(list)  # kind of command -> milliseconds from sending it to its result
+        self.transaction_latencies = []  # milliseconds from the arrival of a committed transaction to its commit
+
+    def schedule(self, delay: float, handler, *args) -> None:
+        heapq.heappush(self.events, (self.now + delay, self.next_seq, handler, args))
+        self.next_seq += 1
+
+    def jitter(self, delay: float) -> float:
+        return delay * (1 + self.arguments.jitter * (2 * self.rng.random() - 1))
+
+    def round_trip(self, sid: int) -> float:
+        delay = self.link_delays[sid]
+        return self.jitter(delay) + self.jitter(delay)
+
+    def choose_variable(self) -> int:
+        x = self.rng.random() * self.cumulative_weights[-1]
+        return self.hot_variables[bisect_left(self.cumulative_weights, x)]
+
+    def run(self) -> dict:
+        arguments = self.arguments
+        end_time = arguments.duration * 1000
+        self.schedule(self.rng.expovariate(arguments.arrival_rate / 1000), self.arrive)
+        if arguments.fail_rate > 0:
+            self.schedule(self.rng.expovariate(arguments.fail_rate / 1000), self.fail_site)
+
+        start = time.perf_counter()
+        while self.events:
+            event_time, _, handler, args = heapq.heappop(self.events)
+            if event_time > end_time + arguments.drain * 1000:
+                break
+            self.now = event_time
+            handler(*args)
+            self.processed_events += 1
+            if not self.sessions and self.now >= end_time:
+                break
+        seconds = time.perf_counter() - start
+
+        simulated_seconds = self.now / 1000
+        finished = self.commits + self.deadlock_aborts + self.failure_aborts
+        return {
+            'config': vars(arguments),
+            'simulated_seconds': simulated_seconds,
+            'seconds': seconds,
+            'events': self.processed_events,
+            'ticks': self.manager.timestamp,
+            'arrivals': self.arrivals,
+            'commits': self.commits,
+            'aborts': self.deadlock_aborts + self.failure_aborts,
+            'deadlock_aborts': self.deadlock_aborts,
+            'site_failure_aborts': self.failure_aborts,
+            'unfinished': len(self.sessions),
+            'deadlocks': self.deadlocks,
+            'site_failures': self.failures,
+            'commits_per_second': self.commits / simulated_seconds if simulated_seconds else 0,
+            'commit_ratio': self.commits / finished if finished else 0,
+            'transaction_latency_ms': summarize(self.transaction_latencies),
+            'latency_ms': {kind: summarize(values) for kind, values in self.latencies.items()},
+        }
+
+    def arrive(self) -> None:
+        """A new transaction arrives and sends its begin, the next arrival is scheduled until the end.
+        """
+        arguments = self.arguments
+        self.arrivals += 1
+        name = 'T{}'.format(self.arrivals)
+        session = Session(name, self.names.tid(name), self.rng.random() < arguments.read_only,
+                          arguments.operations, self.now)
+        self.sessions[name] = session
+        self.send(session, 'begin', Command(Opcode.BEGIN_RO if session.is_ro else Opcode.BEGIN, session.tid,
+                                            None, None))
+        delay = self.rng.expovariate(arguments.arrival_rate / 1000)
+        if self.now + delay <= arguments.duration * 1000:
+            self.schedule(delay, self.arrive)
+
+    def send(self, session: Session, kind: str, command: Command) -> None:
+        session.send_time = self.now
+        session.kind = kind
+        self.schedule(self.jitter(self.arguments.client_delay), self.receive, session, command)
+
+    def receive(self, session: Session, command: Command) -> None:
+        """A command reached the transaction manager, which processes the commands in the order they arrive.
+        """
+        start_time = max(self.now, self.manager_free_time)
+        self.manager_free_time = start_time + self.arguments.service_time
+        self.schedule(self.manager_free_time - self.now, self.process, session, command)
+
+    def process(self, session, command: Command) -> None:
+        """Run a command in its own tick, the deadlocks are solved before and after it.
+        """
+        self.solve_deadlocks()
+        if session is not None and session.is_finished:
+            # The transaction was aborted while the command was on its way.
+            return
+        self.manager.tick(command)
+        self.solve_deadlocks()
+
+    def solve_deadlocks(self) -> None:
+        """Abort the victims of the deadlocks, until running the woken operations makes no new one.
+        """
+        while self.manager.detect_deadlock():
+            self.manager.execute_operations()
+
+    def respond(self, session: Session, delay: float, outcome: str) -> None:
+        self.schedule(delay + self.jitter(self.arguments.client_delay), self.result, session, outcome)
+
+    def result(self, session: Session, outcome: str) -> None:
+        """The result of a command reached the client, which sends the next one after thinking.
+        """
+        if outcome == 'commit' or outcome == 'abort':
+            if self.sessions.pop(session.name, None) is None:
+                return
+            if outcome == 'commit':
+                self.transaction_latencies.append(self.now - session.arrival_time)
+                self.latencies['end'].append(self.now - session.send_time)
+            return
+        if session.name not in self.sessions or session.is_finished:
+            # The transaction was aborted after this result was sent.
+            return
+        self.latencies[session.kind].append(self.now - session.send_time)
+        self.schedule(self.arguments.think_time, self.next_command, session)
+
+    def next_command(self, session: Session) -> None:
+        if session.is_finished:
+            return
+        if session.remaining == 0:
+            self.send(session, 'end', Command(Opcode.END, session.tid, None, None))
+            return
+        session.remaining -= 1
+        if session.is_ro or self.rng.random() < self.arguments.read_ratio:
+            self.send(session, 'R', Command(Opcode.R, session.tid, self.choose_variable(), None))
+        else:
+            self.send(session, 'W', Command(Opcode.W, session.tid, self.choose_variable(), self.rng.randrange(1 << 20)))
+
+    def session(self, name: str) -> Session:
+        session = self.sessions.get(name)
+        return session if session is not None and not session.is_finished else None
+
+    def begin_done(self, name: str) -> None:
+        session = self.session(name)
+        if session is not None:
+            self.respond(session, 0, 'begin')
+
+    def read_failed(self, name: str, sid: int) -> None:
+        session = self.session(name)
+        if session is not None:
+            if session.tried_tick != self.manager.timestamp:
+                session.tried_sites = []
+                session.tried_tick = self.manager.timestamp
+            session.tried_sites.append(sid)
+
+    def read_done(self, name: str, sid: int) -> None:
+        session = self.session(name)
+        if session is None:
+            return
+        sites = [sid]
+        if session.tried_tick == self.manager.timestamp:
+            sites = session.tried_sites + sites
+        session.tried_sites = []
+        if not session.is_ro:
+            session.visited_sites.add(sid)
+        self.respond(session, sum(self.round_trip(x) for x in sites), 'R')
+
+    def write_done(self, name: str, sites: list) -> None:
+        session = self.session(name)
+        if session is None:
+            return
+        session.visited_sites.update(sites)
+        self.respond(session, max(self.round_trip(x) for x in sites) + max(self.round_trip(x) for x in sites), 'W')
+
+    def transaction_done(self, name: str, is_committed: bool, reason: str) -> None:
+        session = self.session(name)
+        if session is None:
+            return
+        session.is_finished = True
+        if is_committed:
+            self.commits += 1
+        elif reason == 'Deadlock':
+            self.deadlock_aborts += 1
+        else:
+            self.failure_aborts += 1
+        delay = max((self.round_trip(x) for x in session.visited_sites), default=0)
+        self.respond(session, delay, 'commit' if is_committed else 'abort')
+
+    def fail_site(self) -> None:
+        """Fail a random site that is up, it recovers after the downtime. One site is always kept up.
+        """
+        arguments = self.arguments
+        up_sites = [sid for sid in self.topology.site_ids() if sid not in self.down_sites]
+        if len(up_sites) > 1:
+            sid = self.rng.choice(up_sites)
+            self.down_sites.add(sid)
+            self.failures += 1
+            self.process(None, Command(Opcode.FAIL, None, None, sid))
+            self.schedule(arguments.downtime * 1000, self.recover_site, sid)
+        if self.now <= arguments.duration * 1000:
+            self.schedule(self.rng.expovariate(arguments.fail_rate / 1000), self.fail_site)
+
+    def recover_site(self, sid: int) -> None:
+        self.down_sites.discard(sid)
+        self.process(None, Command(Opcode.RECOVER, None, None, sid))
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': values[-1] if values else None,
+    }
+
+
+def main(arguments):
+    result = Simulation(arguments).run()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            f.write(text + '\n')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Simulate the clients of the engine with network latency and report the metrics.')
+    parser.add_argument('--arrival-rate', type=float, default=200, help='transactions arriving per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of simulated time with arrivals')
+    parser.add_argument('--drain', type=float, default=10,
+                        help='seconds of simulated time after the arrivals stop, for the running transactions')
+    parser.add_argument('--delay', type=float, default=1.0,
+                        help='one-way delay in milliseconds between the transaction manager and each site')
+    parser.add_argument('--link', action='append', metavar='SID=MS',
+                        help='one-way delay of the link with a site, can be given for several sites')
+    parser.add_argument('--client-delay', type=float, default=0.5,
+                        help='one-way delay in milliseconds between the clients and the transaction manager')
+    parser.add_argument('--jitter', type=float, default=0.1, help='relative uniform jitter of every delay')
+    parser.add_argument('--service-time', type=float, default=0.02,
+                        help='milliseconds the transaction manager takes to process a command')
+    parser.add_argument('--think-time', type=float, default=0, help='milliseconds between a result and the next command')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.7, help='fraction of the operations that are reads')
+    parser.add_argument('--read-only', type=float, default=0.1, help='fraction of read-only transactions')
+    parser.add_argument('--zipf', type=float, default=0.8, help='skew of the variable popularity, 0 is uniform')
+    parser.add_argument('--fail-rate', type=float, default=0, help='site failures per second')
+    parser.add_argument('--downtime', type=float, default=1, help='seconds before a failed site recovers')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    return parser
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
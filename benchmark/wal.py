@@ -0,0 +1,81 @@
+"""Write-ahead log commit throughput and recovery time.
+
+Commits single-variable transactions on one site, with no log and with the
+log synced every `k` commits (the group commit of a tick), then measures
+how long rebuilding the site from the log takes as the log grows.
+
+Usage:
+    python -m benchmark.wal [--commits N] [--variables M]
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from data.manager import DataManager
+from data.topology import Topology
+from data.wal import GroupCommit, WriteAheadLog
+from output import NullSink
+
+
+def commit_many(site: DataManager, commits: int, variables: int, group_commit: GroupCommit = None,
+                sync_every: int = 1) -> None:
+    for i in range(1, commits + 1):
+        vid = 2 * (i % variables) + 2
+        site.write(0, vid, i)
+        site.commit(0, i)
+        if group_commit is not None and i % sync_every == 0:
+            group_commit.sync()
+    if group_commit is not None:
+        group_commit.sync()
+
+
+def main(arguments):
+    topology = Topology(1, 2 * arguments.variables)
+    commits = arguments.commits
+
+    start = time.perf_counter()
+    commit_many(DataManager(1, topology, output=NullSink()), commits, arguments.variables)
+    elapsed = time.perf_counter() - start
+    print('commits: {}, variables: {}'.format(commits, arguments.variables))
+    print('{:>22}: {:.0f} commits/s'.format('no log', commits / elapsed))
+
+    for sync_every in (1, 16, 256):
+        directory = tempfile.mkdtemp()
+        try:
+            group_commit = GroupCommit()
+            wal = WriteAheadLog(directory, 1, group_commit, group_size=sync_every, checkpoint_interval=commits + 1)
+            site = DataManager(1, topology, output=NullSink(), wal=wal)
+            start = time.perf_counter()
+            commit_many(site, commits, arguments.variables, group_commit, sync_every)
+            elapsed = time.perf_counter() - start
+            print('{:>22}: {:.0f} commits/s'.format('sync every {} commits'.format(sync_every), commits / elapsed))
+        finally:
+            shutil.rmtree(directory)
+
+    print('recovery time by log size:')
+    for records in (commits // 100, commits // 10, commits):
+        directory = tempfile.mkdtemp()
+        try:
+            group_commit = GroupCommit()
+            site = DataManager(1, topology, output=NullSink(),
+                               wal=WriteAheadLog(directory, 1, group_commit, checkpoint_interval=records + 1))
+            commit_many(site, records, arguments.variables, group_commit, 256)
+            start = time.perf_counter()
+            site.restore()
+            elapsed = time.perf_counter() - start
+            site.checkpoint()
+            start = time.perf_counter()
+            site.restore()
+            checkpoint_elapsed = time.perf_counter() - start
+            print('{:>10} records: {:.3f} s from the log, {:.3f} s from a checkpoint'.format(
+                records, elapsed, checkpoint_elapsed))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the write-ahead log.')
+    parser.add_argument('--commits', type=int, default=20000, help='number of committed transactions')
+    parser.add_argument('--variables', type=int, default=100, help='number of written variables')
+    main(parser.parse_args())
@@ -0,0 +1,348 @@
+"""Synthetic workload generator and benchmark of the whole engine.
+
+Closed-loop clients run transactions one after another: each client submits
+its next command only when the previous one completed. Transactions have a
+fixed number of operations, reads and writes are mixed by the read ratio,
+a fraction of the transactions are read-only, and the variables are chosen
+with a Zipfian skew. Sites fail at random and recover after a downtime.
+
+A replicated variable can't be read at a recovered site until it is written
+again, so after a few failures the rarely written ones could not be read
+anywhere, and the clients reading them would wait forever. Like a recovery
+process, the workload runs a refresh transaction after each recovery, which
+writes all the replicated variables. Refresh transactions are not counted.
+A read-only transaction still waits forever if every copy of its variable
+failed after the version it has to read, so the run stops as stalled when
+no client could submit for a while.
+
+Every tick processes one command through `TransactionManager.process_batch`.
+When no client can submit, an idle tick is issued as the recovery of a site
+that is up, which does nothing but lets waiting operations and deadlock
+handling run. The deadlocks are detected, or prevented with
+`--deadlock wait-die` or `--deadlock wound-wait`. A command of a client whose
+transaction was aborted for a deadlock at the start of the same tick is
+skipped by the engine, and the client starts a new transaction afterwards.
+
+The metrics are printed, and written as JSON if `--json` is given: the
+commands of the clients per second, which leaves out the idle ticks, the
+site failures and recoveries and the commands of the refresh transactions,
+which are counted apart, commits and aborts, deadlocks, the latency in ticks
+from the submission of an operation to its completion, and the peak memory.
+With `--metrics`, a snapshot of the engine metrics is added to them, see
+`transaction.metrics`.
+
+Usage:
+    python -m benchmark.workload [--transactions N] [--clients C] [--zipf S] [--json FILE] ...
+"""
+import argparse
+import json
+import random
+import time
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate
+
+from data.topology import Topology
+from output import Sink
+from transaction.commit import COMMIT_PROTOCOLS
+from transaction.manager import ISOLATION_LEVELS, TransactionManager
+from transaction.metrics import Metrics
+from transaction.prevention import DEADLOCK_POLICIES
+from transaction.parser import Command, Opcode
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class Client:
+    """A closed-loop client, which runs one transaction at a time.
+    """
+    __slots__ = ('name', 'tid', 'is_ro', 'remaining', 'submit_tick', 'is_ready', 'writes')
+
+    def __init__(self) -> None:
+        self.name = None  # name of the current transaction, None if there's none
+        self.tid = None
+        self.is_ro = False
+        self.remaining = 0  # operations left in the current transaction
+        self.submit_tick = None  # tick of the operation waiting to complete, None if there's none
+        self.is_ready = True  # whether the client is in the queue of the ready clients
+        self.writes = None  # variables left to write by a refresh transaction, None for the other ones
+
+
+class WorkloadSink(Sink):
+    """Collect the outcome of the transactions from the events of the engine.
+    """
+    def __init__(self, workload) -> None:
+        self.workload = workload
+        self.commits = 0
+        self.deadlock_aborts = 0
+        self.failure_aborts = 0
+        self.conflict_aborts = 0
+        self.deadlocks = 0
+
+    def emit(self, event: str, template: str, **fields) -> None:
+        if event == 'read' or event == 'write':
+            self.workload.complete_operation(fields['tid'])
+        elif event == 'commit':
+            if self.workload.end_transaction(fields['tid'], True):
+                self.commits += 1
+        elif event == 'abort':
+            if not self.workload.end_transaction(fields['tid'], False):
+                return
+            if fields['reason'] == 'Deadlock' or fields['reason'] == 'Deadlock Prevention':
+                self.deadlock_aborts += 1
+            elif fields['reason'] == 'Write Conflict':
+                self.conflict_aborts += 1
+            else:
+                self.failure_aborts += 1
+        elif event == 'deadlock':
+            self.deadlocks += 1
+
+
+class Workload:
+    def __init__(self, arguments) -> None:
+        self.arguments = arguments
+        self.rng = random.Random(arguments.seed)
+        self.topology = Topology(arguments.sites, arguments.variables)
+        self.sink = WorkloadSink(self)
+        self.manager = TransactionManager(self.topology, self.sink, arguments.log_dir, arguments.processes,
+                                          arguments.commit, arguments.isolation, arguments.deadlock)
+        self.names = self.manager.names
+        if arguments.metrics:
+            Metrics(self.manager)
+
+        # Zipfian ranks are mapped to shuffled variables, so hot variables are both replicated and not.
+        self.hot_variables = list(range(1, arguments.variables + 1))
+        self.rng.shuffle(self.hot_variables)
+        self.cumulative_weights = list(accumulate(1 / (rank ** arguments.zipf)
+                                                  for rank in range(1, arguments.variables + 1)))
+
+        self.clients = [Client() for _ in range(arguments.clients)]
+        self.ready_clients = deque(self.clients)  # clients that can submit their next command
+        self.running = {}  # name of the running transaction -> client
+        self.begun = 0
+        self.finished = 0
+        self.latencies = []
+        self.down_sites = {}  # sid -> tick to recover
+        self.tick = 0
+        self.idle_ticks = 0  # number of ticks in a row without a command of a client
+        self.client_commands = 0
+        self.idle_commands = 0
+        self.site_commands = 0  # failures and recoveries of the sites
+        self.refresh_commands = 0
+
+        self.replicated_variables = [vid for vid in range(1, arguments.variables + 1)
+                                     if self.topology.is_replicated(vid)]
+        self.refresher = Client()  # runs the refresh transactions, it's not in the queue until one starts
+        self.refresher.is_ready = False
+        self.needs_refresh = False
+        self.refreshes = 0
+
+    def choose_variable(self) -> int:
+        x = self.rng.random() * self.cumulative_weights[-1]
+        return self.hot_variables[bisect_left(self.cumulative_weights, x)]
+
+    def set_ready(self, client: Client) -> None:
+        if not client.is_ready:
+            client.is_ready = True
+            self.ready_clients.append(client)
+
+    def complete_operation(self, name: str) -> None:
+        client = self.running.get(name)
+        if client is not None and client.submit_tick is not None:
+            if client is not self.refresher:
+                self.latencies.append(self.tick - client.submit_tick)
+            client.submit_tick = None
+            self.set_ready(client)
+
+    def end_transaction(self, name: str, is_committed: bool) -> bool:
+        """The transaction committed or aborted, possibly while its operation was waiting.
+
+        Return whether it is counted, which is the case of the transactions of the clients.
+        """
+        client = self.running.pop(name, None)
+        if client is None:
+            return False
+        client.name = client.tid = None
+        client.submit_tick = None
+        if client is self.refresher:
+            # An aborted refresh is run again.
+            client.writes = None
+            self.needs_refresh = self.needs_refresh or not is_committed
+            return False
+        self.finished += 1
+        self.set_ready(client)
+        return True
+
+    def next_command(self) -> Command:
+        arguments = self.arguments
+        self.idle_ticks += 1
+        for sid, recover_tick in self.down_sites.items():
+            if recover_tick <= self.tick:
+                del self.down_sites[sid]
+                self.needs_refresh = True
+                self.site_commands += 1
+                return Command(Opcode.RECOVER, None, None, sid)
+        if self.rng.random() < arguments.fail_rate and len(self.down_sites) < arguments.sites - 1:
+            sid = self.rng.choice([sid for sid in self.topology.site_ids() if sid not in self.down_sites])
+            self.down_sites[sid] = self.tick + arguments.downtime
+            self.site_commands += 1
+            return Command(Opcode.FAIL, None, None, sid)
+
+        if self.needs_refresh and self.refresher.name is None:
+            self.needs_refresh = False
+            self.refreshes += 1
+            client = self.refresher
+            client.name = 'R{}'.format(self.refreshes)
+            client.tid = self.names.tid(client.name)
+            client.writes = list(self.replicated_variables)
+            self.running[client.name] = client
+            self.set_ready(client)
+            self.refresh_commands += 1
+            return Command(Opcode.BEGIN, client.tid, None, None)
+
+        while self.ready_clients:
+            client = self.ready_clients.popleft()
+            client.is_ready = False
+            if client.name is None:
+                if self.begun >= arguments.transactions:
+                    continue
+                self.idle_ticks = 0
+                self.begun += 1
+                client.name = 'T{}'.format(self.begun)
+                client.tid = self.names.tid(client.name)
+                client.is_ro = self.rng.random() < arguments.read_only
+                client.remaining = arguments.operations
+                self.running[client.name] = client
+                self.set_ready(client)
+                self.client_commands += 1
+                return Command(Opcode.BEGIN_RO if client.is_ro else Opcode.BEGIN, client.tid, None, None)
+            # Otherwise, the client is ready again when its operation completes or its transaction ends.
+            if client.writes is not None:
+                self.refresh_commands += 1
+                if not client.writes:
+                    return Command(Opcode.END, client.tid, None, None)
+                client.submit_tick = self.tick
+                return Command(Opcode.W, client.tid, client.writes.pop(), self.rng.randrange(1 << 20))
+            self.idle_ticks = 0
+            self.client_commands += 1
+            if client.remaining == 0:
+                return Command(Opcode.END, client.tid, None, None)
+            client.remaining -= 1
+            client.submit_tick = self.tick
+            if client.is_ro or self.rng.random() < arguments.read_ratio:
+                return Command(Opcode.R, client.tid, self.choose_variable(), None)
+            return Command(Opcode.W, client.tid, self.choose_variable(), self.rng.randrange(1 << 20))
+
+        # Nobody can submit, so let the engine make progress with an idle tick.
+        return self.idle_command()
+
+    def idle_command(self) -> Command:
+        """Return a command that changes nothing: the recovery of a site that is up.
+        """
+        self.idle_commands += 1
+        sid = next(sid for sid in self.topology.site_ids() if sid not in self.down_sites)
+        return Command(Opcode.RECOVER, None, None, sid)
+
+    def commands(self):
+        while self.finished < self.arguments.transactions and self.tick < self.arguments.max_ticks and \
+                self.idle_ticks < self.arguments.stall_ticks:
+            command = self.next_command()
+            yield command
+            self.tick += 1
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+        self.manager.process_batch(self.commands())
+        seconds = time.perf_counter() - start
+        self.manager.close()
+
+        sink = self.sink
+        latencies = sorted(self.latencies)
+        aborts = sink.deadlock_aborts + sink.failure_aborts + sink.conflict_aborts
+        return {
+            'config': vars(self.arguments),
+            'ticks': self.tick,
+            'stalled': self.idle_ticks >= self.arguments.stall_ticks,
+            'seconds': seconds,
+            'client_commands': self.client_commands,
+            'commands_per_second': self.client_commands / seconds if seconds else 0,
+            'idle_ticks': self.idle_commands,
+            'site_failure_ticks': self.site_commands,
+            'refresh_ticks': self.refresh_commands,
+            'transactions_finished': self.finished,
+            'commits': sink.commits,
+            'aborts': aborts,
+            'deadlock_aborts': sink.deadlock_aborts,
+            'site_failure_aborts': sink.failure_aborts,
+            'write_conflict_aborts': sink.conflict_aborts,
+            'commit_ratio': sink.commits / self.finished if self.finished else 0,
+            'deadlocks': sink.deadlocks,
+            'refresh_transactions': self.refreshes,
+            'decision_rounds': self.manager.coordinator.rounds if self.manager.coordinator is not None else None,
+            'decision_messages': self.manager.coordinator.messages if self.manager.coordinator is not None else None,
+            'latency_ticks': {
+                'count': len(latencies),
+                'p50': percentile(latencies, 0.50),
+                'p95': percentile(latencies, 0.95),
+                'p99': percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+            },
+            'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+            'engine_metrics': self.manager.metrics.snapshot() if self.manager.metrics is not None else None,
+        }
+
+
+def percentile(values: list, p: float):
+    """Return the p-th quantile of the sorted values, None if there are none.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def main(arguments):
+    if arguments.processes and arguments.deadlock != 'detect':
+        raise SystemExit("The deadlock prevention can't be used with --processes.")
+    result = Workload(arguments).run()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if arguments.json:
+        with open(arguments.json, 'w') as f:
+            f.write(text + '\n')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Run a synthetic workload and report the metrics.')
+    parser.add_argument('--transactions', type=int, default=2000, help='number of transactions to run')
+    parser.add_argument('--clients', type=int, default=20, help='number of concurrent closed-loop clients')
+    parser.add_argument('--operations', type=int, default=4, help='number of reads and writes per transaction')
+    parser.add_argument('--read-ratio', type=float, default=0.7, help='fraction of the operations that are reads')
+    parser.add_argument('--read-only', type=float, default=0.1, help='fraction of read-only transactions')
+    parser.add_argument('--zipf', type=float, default=0.8, help='skew of the variable popularity, 0 is uniform')
+    parser.add_argument('--fail-rate', type=float, default=0.001, help='probability that a site fails at each tick')
+    parser.add_argument('--downtime', type=int, default=50, help='number of ticks before a failed site recovers')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables')
+    parser.add_argument('--max-ticks', type=int, default=1000000, help='stop after this number of ticks')
+    parser.add_argument('--stall-ticks', type=int, default=10000,
+                        help='stop if no client submitted a command during this number of ticks')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--metrics', action='store_true',
+                        help='time the hot methods of the engine and add a metrics snapshot to the results')
+    parser.add_argument('--processes', action='store_true', help='run every site in its own worker process')
+    parser.add_argument('--commit', choices=COMMIT_PROTOCOLS, default='direct',
+                        help='how the transactions are committed at the sites, direct by default')
+    parser.add_argument('--log-dir', metavar='DIR', help='log the commits of each site to this directory')
+    parser.add_argument('--isolation', choices=ISOLATION_LEVELS, default='2pl',
+                        help='isolation of the read/write transactions, two-phase locking by default')
+    parser.add_argument('--deadlock', choices=DEADLOCK_POLICIES, default='detect',
+                        help='detect the deadlocks, or prevent them with wait-die or wound-wait, detect by default')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    return parser
+
+
+if __name__ == '__main__':
+    main(build_parser().parse_args())
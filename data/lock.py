@@ -1,4 +1,4 @@
-from collections import deque
+from collections import OrderedDict
 from enum import Enum
 
 from errors import LockError
@@ -10,14 +10,19 @@ class LockType(Enum):
 
 
 class Lock:
-    def __init__(self, tid: str, vid: str, lock_type: LockType) -> None:
+    __slots__ = ('tid', 'vid', 'lock_type', 'seq')
+
+    def __init__(self, tid: int, vid: int, lock_type: LockType) -> None:
         self.tid = tid  # transaction id
         self.vid = vid  # variable id
         self.lock_type = lock_type  # either R or W
+        self.seq = 0  # position in the lock queue, set when the lock is queued
 
 
 class ReadLock(Lock):
-    def __init__(self, tid: str, vid: str) -> None:
+    __slots__ = ()
+
+    def __init__(self, tid: int, vid: int) -> None:
         super(ReadLock, self).__init__(tid, vid, LockType.R)
 
     def __repr__(self):
@@ -25,22 +30,103 @@ class ReadLock(Lock):
 
 
 class WriteLock(Lock):
-    def __init__(self, tid: str, vid: str) -> None:
+    __slots__ = ()
+
+    def __init__(self, tid: int, vid: int) -> None:
         super(WriteLock, self).__init__(tid, vid, LockType.W)
 
     def __repr__(self):
         return '(WriteLock {} {})'.format(self.tid, self.vid)
 
 
+class LockQueue:
+    """The FIFO queue of the blocked locks of a variable.
+
+    A transaction queues at most one lock of each type on a variable, so the
+    locks are kept in an ordered dict keyed by (tid, lock type), which keeps
+    the FIFO order and indexes the queued locks of each transaction. The
+    write locks are also kept in their own ordered dict keyed by tid, and
+    every queued lock gets an increasing sequence number, so whether a lock
+    is in front of another is known without scanning the queue. Finding,
+    adding and removing the locks of a transaction and finding the first
+    waiting writer are all O(1).
+    """
+
+    def __init__(self) -> None:
+        self.locks = OrderedDict()  # (tid, lock type) -> lock, in FIFO order
+        self.writers = OrderedDict()  # tid -> queued write lock, in FIFO order
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self.locks)
+
+    def __iter__(self):
+        return iter(self.locks.values())
+
+    def get(self, tid: int, lock_type: LockType):
+        return self.locks.get((tid, lock_type))
+
+    def has_lock(self, tid: int, lock_type: LockType) -> bool:
+        return (tid, lock_type) in self.locks
+
+    def has_transaction(self, tid: int) -> bool:
+        return (tid, LockType.R) in self.locks or (tid, LockType.W) in self.locks
+
+    def first(self):
+        return next(iter(self.locks.values()))
+
+    def first_writer(self):
+        return next(iter(self.writers.values()), None)
+
+    def transaction_seq(self, tid: int):
+        """Return the sequence number of the first lock the transaction has queued, None if there's none.
+        """
+        read_lock = self.locks.get((tid, LockType.R))
+        write_lock = self.writers.get(tid)
+        if read_lock is None:
+            return write_lock.seq if write_lock is not None else None
+        return read_lock.seq if write_lock is None else min(read_lock.seq, write_lock.seq)
+
+    def append(self, lock) -> None:
+        lock.seq = self.next_seq
+        self.next_seq += 1
+        self.locks[(lock.tid, lock.lock_type)] = lock
+        if lock.lock_type == LockType.W:
+            self.writers[lock.tid] = lock
+
+    def remove(self, lock) -> None:
+        del self.locks[(lock.tid, lock.lock_type)]
+        if lock.lock_type == LockType.W:
+            del self.writers[lock.tid]
+
+    def clear(self) -> None:
+        self.locks.clear()
+        self.writers.clear()
+
+
 class LockManager:
     """Manage locks for a certain variable.
+
+    The lock manager keeps the wait-for edges its locks cause in the shared
+    wait-for graph. Every change only updates the edges it affects: a queued
+    lock adds the edges to the holders of the current lock and to the
+    conflicting locks in front of it, a removed lock drops its own edges,
+    and a new or released holder only changes the edges to it.
     """
 
-    def __init__(self, vid: str) -> None:
+    def __init__(self, vid: int, wait_for_graph=None, scheduler=None, prevention=None) -> None:
         self.vid = vid
         self.current_lock = None
-        self.lock_queue = deque()
-        self.shared_read_lock = deque()  # Stores all the tid that are sharing the read lock, including current lock.
+        self.lock_queue = LockQueue()
+        # Stores all the tid that are sharing the read lock, including current lock. It is used as
+        # an insertion-ordered set (the values are unused), so that membership, adding and removing are O(1).
+        self.shared_read_lock = {}
+        self.wait_for_graph = wait_for_graph  # Shared wait-for graph that this lock manager keeps up to date.
+        # Edges (waiter, holder) this lock manager contributes to the graph -> number of pairs of locks causing it.
+        self.edge_counts = {}
+        self.scheduler = scheduler
+        self.waiting_operations = set()  # Blocked operations parked on this variable.
+        self.prevention = prevention  # Decides whether a blocked lock may wait, if the deadlocks are prevented.
 
     def promote_current_lock(self, write_lock: WriteLock) -> None:
         """Promote the current read lock to write lock if possible.
@@ -56,9 +142,11 @@ class LockManager:
                             "the read lock of variable {}, can't promote.".format(self.vid))
 
         # remove current read lock from the shared read lock set, then promote it to a write lock
-        self.shared_read_lock.remove(write_lock.tid)
+        self.update_holder_edges(self.remove_edge)
+        del self.shared_read_lock[write_lock.tid]
         self.current_lock = write_lock
-        print("After promotion, current lock: ", self.current_lock)
+        self.update_holder_edges(self.add_edge)
+        self.wake_waiting_operations()
 
     def clear(self):
         """
@@ -68,68 +156,267 @@ class LockManager:
         self.current_lock = None
         self.lock_queue.clear()
         self.shared_read_lock.clear()
+        if self.wait_for_graph is not None:
+            for waiter, holder in self.edge_counts:
+                self.wait_for_graph.remove_edge(waiter, holder)
+            self.edge_counts.clear()
+        self.wake_waiting_operations()
 
-    def share_current_lock(self, tid: str):
+    def share_current_lock(self, tid: int):
         """Share the current read lock with other transactions if possible.
         """
         if self.current_lock.lock_type == LockType.R and tid not in self.shared_read_lock:
-            self.shared_read_lock.append(tid)
+            self.shared_read_lock[tid] = None
+            # Only the queued write locks wait for the holders of a read lock.
+            if self.wait_for_graph is not None:
+                for lock in self.lock_queue.writers.values():
+                    if lock.tid != tid:
+                        self.add_edge(lock.tid, tid)
+            self.wake_waiting_operations()
         else:
             raise LockError(
                 ("ERROR[4]: Transaction {}'s current lock on variable {} is a "
                  "write lock, which can not be shared.".format(self.current_lock.tid, self.current_lock.vid))
             )
 
-    def release_current_lock(self, tid: str) -> None:
+    def release_current_lock(self, tid: int) -> None:
         """Release current lock, and update shared lock lists if needed.
         """
+        is_released = False
         if self.current_lock:
             if self.current_lock.lock_type == LockType.R:
                 if tid in self.shared_read_lock:
-                    self.shared_read_lock.remove(tid)
+                    if self.wait_for_graph is not None:
+                        for lock in self.lock_queue.writers.values():
+                            if lock.tid != tid:
+                                self.remove_edge(lock.tid, tid)
+                    del self.shared_read_lock[tid]
+                    is_released = True
                 if len(self.shared_read_lock) == 0:
                     self.current_lock = None
+                    is_released = True
             else:
                 if self.current_lock.tid == tid:
+                    self.update_holder_edges(self.remove_edge)
                     self.current_lock = None
+                    is_released = True
+        if is_released:
+            self.wake_waiting_operations()
 
     def add_lock_to_queue(self, lock) -> None:
         """Only blocked locks are added to the queue.
+
+        If the deadlocks are prevented, a lock whose transaction may not wait is
+        not queued. A queued transaction asks again every time it retries.
         """
-        for waited_lock in self.lock_queue:
-            if waited_lock.tid == lock.tid:
-                if waited_lock.lock_type == lock.lock_type or lock.lock_type == LockType.R:
-                    return
+        if self.prevention is not None and not self.prevention.can_wait(lock.tid, self.blocking_transactions(lock)):
+            return
+        # A transaction that already waits doesn't need another read lock, nor the same lock twice.
+        if self.lock_queue.has_lock(lock.tid, lock.lock_type) or \
+                (lock.lock_type == LockType.R and self.lock_queue.has_transaction(lock.tid)):
+            return
         self.lock_queue.append(lock)
+        self.update_lock_edges(lock, self.add_edge)
 
     def remove_lock_from_queue(self, tid) -> None:
         """Remove all the lock whose tid is equal to the given tid.
         """
-        self.lock_queue = deque([lock for lock in self.lock_queue if lock.tid != tid])
+        is_removed = False
+        for lock_type in (LockType.R, LockType.W):
+            lock = self.lock_queue.get(tid, lock_type)
+            if lock is not None:
+                self.dequeue(lock)
+                is_removed = True
+        if is_removed:
+            self.wake_waiting_operations()
+
+    def dequeue(self, lock) -> None:
+        """Remove a lock from the queue, with its wait-for edges.
+        """
+        self.update_lock_edges(lock, self.remove_edge)
+        self.lock_queue.remove(lock)
+
+    def blocking_transactions(self, lock) -> set:
+        """Return the transactions a blocked lock waits for: the holders of the current
+        lock and the transactions of the conflicting locks in front of it in the queue.
+        """
+        tids = set(self.current_holders(lock))
+        seq = self.lock_queue.transaction_seq(lock.tid)
+        for queued_lock in self.conflicting_candidates(lock):
+            if seq is not None and queued_lock.seq >= seq:
+                break
+            if is_conflict(queued_lock, lock):
+                tids.add(queued_lock.tid)
+        return tids
 
     def set_current_lock(self, lock):
+        self.update_holder_edges(self.remove_edge)
         if lock.lock_type == LockType.R:
-            self.shared_read_lock.append(lock.tid)
+            self.shared_read_lock[lock.tid] = None
         self.current_lock = lock
+        self.update_holder_edges(self.add_edge)
+        self.wake_waiting_operations()
+
+    def grant_queued_locks(self) -> bool:
+        """Grant the current lock to the first lock in queue, if the current lock has been released.
 
-    def has_write_lock(self):
-        """Check if there is a write lock waiting in queue.
+        According to the First-Come-First-Serve protocol, if the first lock is a
+        read lock, the read locks queued right after it share it until there is
+        a write lock. If the only holder of the read lock queued that write lock,
+        the read lock is promoted. Return whether it was promoted.
         """
-        for lock in self.lock_queue:
-            if lock.lock_type == LockType.W:
+        lock_queue = self.lock_queue
+        if self.current_lock or not lock_queue:
+            return False
+        first_waiting = lock_queue.first()
+        self.dequeue(first_waiting)
+        if first_waiting.lock_type == LockType.W:
+            self.set_current_lock(first_waiting)
+            return False
+
+        while lock_queue and lock_queue.first().lock_type == LockType.R:
+            next_lock = lock_queue.first()
+            self.dequeue(next_lock)
+            self.shared_read_lock[next_lock.tid] = None
+        self.set_current_lock(first_waiting)
+        if lock_queue:
+            next_lock = lock_queue.first()
+            if len(self.shared_read_lock) == 1 and next_lock.tid in self.shared_read_lock:
+                self.dequeue(next_lock)
+                self.promote_current_lock(WriteLock(next_lock.tid, self.vid))
                 return True
         return False
 
+    def has_write_lock(self, tid=None):
+        """Check if there is a write lock waiting in queue. If the given
+        transaction has queued a lock, only the write locks in front of it count.
+        """
+        first_writer = self.lock_queue.first_writer()
+        if first_writer is None:
+            return False
+        seq = self.lock_queue.transaction_seq(tid) if tid is not None else None
+        return seq is None or first_writer.seq < seq
+
     def has_other_write_lock(self, tid):
         """
         Check if there is a write lock waiting in queue apart from
-        that of the same transaction.
+        that of the same transaction. If the transaction has queued a
+        write lock, only the write locks in front of it count.
         """
+        first_writer = self.lock_queue.first_writer()
+        if first_writer is None:
+            return False
+        return first_writer.tid != tid
+
+    def wake_waiting_operations(self) -> None:
+        """Wake up the operations parked on this variable, for its locks have changed.
+        """
+        if self.scheduler is None:
+            return
+        for operation in list(self.waiting_operations):
+            self.scheduler.wake(operation)
+
+    def generate_blocking_edges(self) -> set:
+        """Generate the (waiter, holder) edges caused by this variable's locks.
+        """
+        edges = set()
+        if not self.current_lock or len(self.lock_queue) == 0:
+            return edges
+
+        # Generate lock graph for the current lock with other locks in queue.
+        current_lock = self.current_lock
         for lock in self.lock_queue:
-            if lock.lock_type == LockType.W:
-                if lock.tid != tid:
-                    return True
-        return False
+            # The current read lock keeps the tid of its first holder only, so a write lock queued
+            # by that transaction still conflicts with the other holders.
+            if is_conflict(current_lock, lock) or \
+                    (current_lock.lock_type == LockType.R and lock.lock_type == LockType.W):
+                # If current lock is a read lock, then all the other transactions
+                # that share the same read lock would be conflicted with the write
+                # lock in queue.
+                if current_lock.lock_type == LockType.R:
+                    for shared_lock_tid in [x for x in self.shared_read_lock
+                                            if not (x == lock.tid)]:
+                        edges.add((lock.tid, shared_lock_tid))
+                else:
+                    # If current lock is a write lock, then according our rule of adding locks
+                    # in queue, the blocked lock can only be the R/W locks of other transactions.
+                    # Therefore, add to blocking graph directly.
+                    edges.add((lock.tid, current_lock.tid))
+
+        # Generate lock graph for the locks in queue with each other.
+        queued_locks = list(self.lock_queue)
+        for i in range(len(queued_locks)):
+            lock1 = queued_locks[i]
+            for j in range(i):
+                lock2 = queued_locks[j]
+                if is_conflict(lock2, lock1):
+                    edges.add((lock1.tid, lock2.tid))
+        return edges
+
+    def current_holders(self, lock) -> list:
+        """Return the holders of the current lock a queued lock waits for.
+        """
+        current_lock = self.current_lock
+        if not current_lock:
+            return []
+        if current_lock.lock_type == LockType.W:
+            return [current_lock.tid] if current_lock.tid != lock.tid else []
+        if lock.lock_type == LockType.W:
+            return [tid for tid in self.shared_read_lock if tid != lock.tid]
+        return []
+
+    def conflicting_candidates(self, lock):
+        """Return the queued locks that may conflict with the given one, in FIFO order:
+        only the write locks conflict with a read lock.
+        """
+        if lock.lock_type == LockType.R:
+            return self.lock_queue.writers.values()
+        return self.lock_queue
+
+    def update_lock_edges(self, lock, update) -> None:
+        """Add or remove the edges of a queued lock, with `add_edge` or `remove_edge`:
+        the edges to the holders of the current lock, to the conflicting locks in
+        front of it and from the conflicting locks behind it.
+        """
+        if self.wait_for_graph is None:
+            return
+        tid = lock.tid
+        for holder in self.current_holders(lock):
+            update(tid, holder)
+        for queued_lock in self.conflicting_candidates(lock):
+            if is_conflict(queued_lock, lock):
+                if queued_lock.seq < lock.seq:
+                    update(tid, queued_lock.tid)
+                else:
+                    update(queued_lock.tid, tid)
+
+    def update_holder_edges(self, update) -> None:
+        """Add or remove the edges from the queued locks to the holders of the current lock,
+        before and after the current lock changes.
+        """
+        if self.wait_for_graph is None or not self.current_lock:
+            return
+        # Only the queued write locks wait for the holders of a read lock.
+        is_read_lock = self.current_lock.lock_type == LockType.R
+        for lock in self.lock_queue.writers.values() if is_read_lock else self.lock_queue:
+            for holder in self.current_holders(lock):
+                update(lock.tid, holder)
+
+    def add_edge(self, waiter, holder) -> None:
+        edge = (waiter, holder)
+        count = self.edge_counts.get(edge, 0)
+        self.edge_counts[edge] = count + 1
+        if count == 0:
+            self.wait_for_graph.add_edge(waiter, holder)
+
+    def remove_edge(self, waiter, holder) -> None:
+        edge = (waiter, holder)
+        count = self.edge_counts[edge]
+        if count == 1:
+            del self.edge_counts[edge]
+            self.wait_for_graph.remove_edge(waiter, holder)
+        else:
+            self.edge_counts[edge] = count - 1
 
 
 def is_conflict(lock1, lock2) -> bool:
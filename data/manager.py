@@ -1,77 +1,115 @@
+import sys
+from bisect import bisect_right
 from collections import defaultdict
 
-from data.lock import ReadLock, WriteLock, LockManager, LockType, is_conflict
-from data.value import CommitValue, TemporaryValue, ResultValue
+from data.lock import ReadLock, WriteLock, LockManager, LockType
+from data.names import NameTable
+from data.topology import Topology
+from data.value import CommitValue, TemporaryValue, ResultValue, FAILED_RESULT
 from data.variable import Variable
+from data.wal import WriteAheadLog
+from errors import DataError
+from output import Sink, TextSink, ValueListing
+
+
+class LazyTable(dict):
+    """A dict whose missing values are created on first access.
+    """
+    def __init__(self, factory) -> None:
+        super(LazyTable, self).__init__()
+        self.factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self.factory(key)
+        return value
 
 
 class DataManager:
     """Manage all the data in a site
     """
-    def __init__(self, sid: int) -> None:
+    def __init__(self, sid: int, topology: Topology = None, wait_for_graph=None, scheduler=None,
+                 names: NameTable = None, output: Sink = None, wal: WriteAheadLog = None, prevention=None) -> None:
         self.sid = sid  # site id
+        self.output = output if output is not None else TextSink()
+        self.topology = topology if topology is not None else Topology()
+        self.names = names if names is not None else NameTable()  # used to output the names of transactions
         self.is_up = True  # whether the site is down or not
-        self.data = defaultdict()  # all the variables stored in the site
-        self.lock_table = defaultdict()  # lock managers for each variable
+        # All the variables stored in the site and the lock managers for each variable.
+        # They are only allocated when the variable is accessed for the first time.
+        self.data = LazyTable(self.create_variable)
+        self.wait_for_graph = wait_for_graph
+        self.scheduler = scheduler
+        self.prevention = prevention  # the deadlock prevention policy, if the deadlocks are not detected
+        self.lock_table = LazyTable(self.create_lock_manager)
         self.fail_timestamp = []  # record all the fail time of this site
         self.recover_timestamp = []  # record all the recover time of this site
+        # Per-transaction indexes, so that commit and abort only visit what the transaction touched.
+        self.locked_variables = defaultdict(dict)  # tid -> vids whose locks are held or queued by tid
+        self.written_variables = defaultdict(dict)  # tid -> vids that have temporary values written by tid
+        self.multiversion_variables = set()  # vids that have more than one committed version
+        # The committed writes are logged if a write-ahead log is given, and the state saved in it is restored.
+        self.wal = wal
+        if self.wal is not None:
+            self.restore()
 
-        # initialize variables
-        for i in range(1, 21):
-            vid = 'x{}'.format(i)
-            init_val = i * 10
-            if i % 2 == 0:
-                # replicated value
-                self.data[vid] = Variable(
-                    vid=vid,
-                    init=CommitValue(init_val, 0),
-                    is_replicated=True
-                )
-                # create lock table
-                self.lock_table[vid] = LockManager(vid)
-            else:
-                if i % 10 + 1 == self.sid:
-                    # not replicated value
-                    self.data[vid] = Variable(
-                        vid=vid,
-                        init=CommitValue(init_val, 0),
-                        is_replicated=False
-                    )
-                # create lock table
-                self.lock_table[vid] = LockManager(vid)
-
-    def has_variable(self, vid: str) -> bool:
-        return True if vid in self.data else False
-
-    def snapshot_read(self, vid: str, timestamp: int) -> ResultValue:
+    def create_variable(self, vid: int) -> Variable:
+        """Allocate a variable held by this site with its initial value.
+
+        A variable that is allocated after the site recovers has not been
+        written since, so if it is replicated, it is not readable.
+        """
+        if not self.has_variable(vid):
+            raise DataError("Site {} doesn't have variable {}.".format(self.sid, self.names.vid_name(vid)))
+        v = Variable(
+            vid=vid,
+            init=CommitValue(self.topology.initial_value(vid), 0),
+            is_replicated=self.topology.is_replicated(vid)
+        )
+        if v.is_replicated and self.recover_timestamp:
+            v.is_readable = False
+        return v
+
+    def create_lock_manager(self, vid: int) -> LockManager:
+        return LockManager(vid, self.wait_for_graph, self.scheduler, self.prevention)
+
+    def has_variable(self, vid: int) -> bool:
+        return self.topology.has_variable(self.sid, vid)
+
+    def snapshot_read(self, vid: int, timestamp: int) -> ResultValue:
         """Return the snapshot value for read-only transactions.
         """
         v: Variable = self.data[vid]
         if not v.is_readable:
-            return ResultValue(None, False)
-        else:
-            for commit_value in v.commit_value_list:
-                if commit_value.commit_time <= timestamp:
-                    if v.is_replicated:
-                        # If the site wasn't up all the time between
-                        # the time when xi was committed and RO began,
-                        # then this RO can abort.
-                        for t in self.fail_timestamp:
-                            if commit_value < t <= timestamp:
-                                return ResultValue(None, False)
-                    return ResultValue(commit_value.value, True)
-            return ResultValue(None, False)
-
-    def read(self, tid: str, vid: str) -> ResultValue:
+            return FAILED_RESULT
+        commit_value = v.get_snapshot_value(timestamp)
+        if commit_value is None:
+            return FAILED_RESULT
+        if v.is_replicated and self.has_failed_between(commit_value.commit_time, timestamp):
+            # If the site wasn't up all the time between
+            # the time when xi was committed and RO began,
+            # then this RO can abort.
+            return FAILED_RESULT
+        return ResultValue(commit_value.value, True)
+
+    def has_failed_between(self, start: int, end: int) -> bool:
+        """Check if the site failed in the time interval (start, end].
+        """
+        i = bisect_right(self.fail_timestamp, start)
+        return i < len(self.fail_timestamp) and self.fail_timestamp[i] <= end
+
+    def read(self, tid: int, vid: int) -> ResultValue:
         """Return the value for normally-read transactions.
         """
         v: Variable = self.data[vid]
         if not v.is_readable:
-            print('{} failed to read {}.{} [Site just recovered, not readable]'.format(tid, vid, self.sid))
-            return ResultValue(None, False)
+            self.output.emit('read_failed', '{tid} failed to read {vid}.{sid} [{reason}]',
+                             tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=self.sid,
+                             reason='Site just recovered, not readable')
+            return FAILED_RESULT
         else:
             lock_manager: LockManager = self.lock_table[vid]
             current_lock = lock_manager.current_lock
+            self.locked_variables[tid][vid] = None
 
             # If there's no lock on the variable, set a read lock then read directly.
             if not current_lock:
@@ -86,14 +124,17 @@ class DataManager:
                 else:
                     # The transaction doesn't share the read lock, and there are other write
                     # locks waiting in front, so the read lock should wait in queue.
-                    if lock_manager.has_write_lock():
+                    if lock_manager.has_write_lock(tid):
                         lock_manager.add_lock_to_queue(ReadLock(tid, vid))
-                        print('{} failed to read {}.{} [Exist write locks waiting in front]'.format(tid, vid, self.sid))
-                        return ResultValue(None, False)
+                        self.output.emit('read_failed', '{tid} failed to read {vid}.{sid} [{reason}]',
+                                         tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=self.sid,
+                                         reason='Exist write locks waiting in front')
+                        return FAILED_RESULT
                     else:
                         # There is no other write locks waiting, then share the current read lock
-                        # and return the read value.
+                        # and return the read value. The read lock queued by an earlier try is dropped.
                         lock_manager.share_current_lock(tid)
+                        lock_manager.remove_lock_from_queue(tid)
                         return ResultValue(v.get_last_commit_value(), True)
 
             # There is a write lock on the variable.
@@ -104,16 +145,19 @@ class DataManager:
                     return ResultValue(v.get_temporary_value(), True)
                 else:
                     lock_manager.add_lock_to_queue(ReadLock(tid, vid))
-                    print('{} failed to read {}.{} [Lock conflict]'.format(tid, vid, self.sid))
-                    return ResultValue(None, False)
+                    self.output.emit('read_failed', '{tid} failed to read {vid}.{sid} [{reason}]',
+                                     tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=self.sid,
+                                     reason='Lock conflict')
+                    return FAILED_RESULT
 
     def get_write_lock(self, tid, vid) -> bool:
         """
         To judge whether a transaction can get the write
         lock of the certain variable.
         """
-        lock_manager: LockManager = self.lock_table.get(vid)
+        lock_manager: LockManager = self.lock_table[vid]
         current_lock = lock_manager.current_lock
+        self.locked_variables[tid][vid] = None
         # print(tid, current_lock)
         # There is no lock on the variable currently,
         # so set the current lock to write lock and return True.
@@ -157,10 +201,12 @@ class DataManager:
         This method will only be called after getting the write lock successfully,
         so there are no extra checking steps.
         """
-        lock_manager: LockManager = self.lock_table.get(vid)
-        v: Variable = self.data.get(vid)
+        lock_manager: LockManager = self.lock_table[vid]
+        v: Variable = self.data[vid]
         assert lock_manager is not None and v is not None
         current_lock = lock_manager.current_lock
+        self.locked_variables[tid][vid] = None
+        self.written_variables[tid][vid] = None
         if current_lock:
             if current_lock.lock_type == LockType.R:
                 # If current lock is a read lock, then it must be of the same transaction,
@@ -169,6 +215,11 @@ class DataManager:
                        tid in lock_manager.shared_read_lock and \
                        not lock_manager.has_other_write_lock(tid)
                 lock_manager.promote_current_lock(WriteLock(tid, vid))
+                self.output.emit('promote', 'After promotion, current lock:  {lock}',
+                                 lock=self.names.lock_name(lock_manager.current_lock))
+                # The write lock the transaction queued while sharing the read lock is granted now,
+                # otherwise it would become the current lock again after the commit.
+                lock_manager.remove_lock_from_queue(tid)
                 v.temporary_value = TemporaryValue(value, tid)
             else:
                 # If current lock is a write lock, then it must of the same transaction.
@@ -178,14 +229,23 @@ class DataManager:
             lock_manager.set_current_lock(WriteLock(tid, vid))
             v.temporary_value = TemporaryValue(value, tid)
 
+    def committed_values(self) -> dict:
+        """Return the last committed value of each variable held by the site, in index order.
+        """
+        values = {}
+        for vid in self.topology.variables_at(self.sid):
+            values[vid] = self.data[vid].get_last_commit_value() if vid in self.data else self.topology.initial_value(vid)
+        return values
+
     def dump(self):
         """Show all the variables in the site.
         """
         site_status = 'up' if self.is_up else 'down'
-        output = 'site {} [{}] - '.format(self.sid, site_status)
-        for v in self.data.values():
-            output += '{}: {}, '.format(v.vid, v.get_last_commit_value())
-        print(output)
+        values = ValueListing()
+        for vid, value in self.committed_values().items():
+            values[self.names.vid_name(vid)] = value
+        self.output.emit('dump_site', 'site {sid} [{status}] - {values}', sid=self.sid, status=site_status,
+                         values=values)
 
     def abort(self, tid):
         """Abort certain transactino.
@@ -195,62 +255,194 @@ class DataManager:
             (2) All the operations of this transaction that are waiting in queue
                 will be dropped.
         """
-        for lock_manager in self.lock_table.values():
+        self.update_lock_table(self.discard_transaction(tid))
+
+    def discard_transaction(self, tid) -> dict:
+        """Release the locks of an aborted transaction and drop its temporary values,
+        return the vids whose lock managers have to be updated.
+        """
+        vids = self.locked_variables.pop(tid, {})
+        self.written_variables.pop(tid, None)
+        for vid in vids:
+            lock_manager = self.lock_table[vid]
             lock_manager.release_current_lock(tid)
             lock_manager.remove_lock_from_queue(tid)
-        self.update_lock_table()
+        return vids
 
-    def commit(self, tid, commit_time):
+    def commit(self, tid, commit_time, watermark=None):
         """Commit the given transaction.
 
         Side Effect:
             (1) If the transaction writes temporary value on the site,
                 then save it as the commit value.
             (2) Release all the locks that are required by the transaction.
+            (3) If a watermark is given, the versions of the written variables
+                that are older than it are garbage collected.
         """
-        # Release locks.
-        for lock_manager in self.lock_table.values():
+        self.update_lock_table(self.commit_transaction(tid, commit_time, watermark))
+
+    def commit_transaction(self, tid, commit_time, watermark=None) -> dict:
+        """Release the locks of a committed transaction and commit its temporary values,
+        return the vids whose lock managers have to be updated.
+        """
+        # Release locks, and drop the locks that are still queued.
+        vids = self.locked_variables.pop(tid, {})
+        for vid in vids:
+            lock_manager = self.lock_table[vid]
             lock_manager.release_current_lock(tid)
+            lock_manager.remove_lock_from_queue(tid)
 
         # Commit temporary values.
-        for v in self.data.values():
+        writes = []
+        for vid in self.written_variables.pop(tid, {}):
+            v: Variable = self.data[vid]
             if v.temporary_value is not None and v.temporary_value.tid == tid:
                 commit_value = v.temporary_value.value
+                writes.append((vid, commit_value))
                 v.add_commit_value(CommitValue(commit_value, commit_time))
                 v.temporary_value = None
                 v.is_readable = True
-        self.update_lock_table()
+                if watermark is not None:
+                    v.collect_garbage(watermark)
+                if len(v.commit_value_list) > 1:
+                    self.multiversion_variables.add(vid)
+        if self.wal is not None and writes:
+            self.wal.append(commit_time, writes)
+            if self.wal.needs_checkpoint():
+                self.checkpoint()
+        return vids
 
-    def update_lock_table(self):
+    @property
+    def incarnation(self) -> int:
+        """The number of failures of the site, the locks and temporary values of an older incarnation are lost.
+        """
+        return len(self.fail_timestamp)
+
+    def prepare(self, tid, incarnation: int) -> bool:
+        """Vote in the first phase of the two-phase commit of a transaction.
+
+        The site votes yes if it is up and hasn't failed since the transaction
+        first accessed it, in the given incarnation, so that it still holds the
+        locks and the temporary values of the transaction.
+        """
+        return self.is_up and self.incarnation == incarnation
+
+    def decide(self, decisions: list) -> None:
+        """Apply the decisions of a group of transactions in the second phase of the two-phase commit.
+
+        Every decision is (tid, commit time, watermark), the commit time is None
+        for an abort. The locks released by the whole group are granted once
+        afterwards, and the commit records go to the log together.
+        """
+        vids = {}
+        for tid, commit_time, watermark in decisions:
+            if commit_time is None:
+                vids.update(self.discard_transaction(tid))
+            else:
+                vids.update(self.commit_transaction(tid, commit_time, watermark))
+        self.update_lock_table(vids)
+
+    def update_lock_table(self, vids=None):
         """Update the lock table if current lock has been released.
 
         If current lock is released and there are other locks waiting in queue,
         the first lock in queue should be popped and become the current lock according
         to the First-Come-First-Serve protocol. If this lock is a read lock, then
         its followed read locks will share the same read lock until there is a
-        write lock
+        write lock.
+
+        Only the lock managers of the given vids are updated, or all of them if
+        no vids are given.
+        """
+        lock_managers = self.lock_table.values() if vids is None else [self.lock_table[vid] for vid in vids]
+        for lock_manager in [x for x in lock_managers if not x.current_lock]:
+            # If the current lock is a read lock, and the next lock is the write lock
+            # of the same transaction, then the current read lock is promoted.
+            if lock_manager.grant_queued_locks():
+                self.output.emit('promote', 'After promotion, current lock:  {lock}',
+                                 lock=self.names.lock_name(lock_manager.current_lock))
+
+    def collect_garbage(self, watermark: int) -> int:
+        """Drop the versions older than the watermark, return the number of dropped versions.
+        """
+        dropped = 0
+        for vid in list(self.multiversion_variables):
+            v: Variable = self.data[vid]
+            dropped += v.collect_garbage(watermark)
+            if len(v.commit_value_list) == 1:
+                self.multiversion_variables.discard(vid)
+        return dropped
+
+    def version_statistics(self) -> dict:
+        """Report the number of versions stored in the site and an estimate of their memory use.
+        """
+        versions = 0
+        memory = 0
+        for v in self.data.values():
+            versions += len(v.commit_value_list)
+            memory += sys.getsizeof(v.commit_value_list) + sys.getsizeof(v.commit_time_list)
+            memory += sum(sys.getsizeof(x) for x in v.commit_value_list)
+        return {
+            'variables': len(self.data),
+            'multiversion_variables': len(self.multiversion_variables),
+            'versions': versions,
+            'bytes': memory,
+        }
+
+    def last_commit_time(self) -> int:
+        """Return the time of the newest commit of the site, 0 if nothing was committed.
+        """
+        return max((v.commit_time_list[-1] for v in self.data.values()), default=0)
+
+    def close(self) -> None:
+        """Write the pending records of the write-ahead log and close it, if the site has one.
         """
-        for lock_manager in [x for x in self.lock_table.values() if not x.current_lock]:
-            if len(lock_manager.lock_queue) == 0:
-                continue
-            first_waiting = lock_manager.lock_queue.popleft()
-
-            lock_manager.set_current_lock(first_waiting)
-            if first_waiting.lock_type == LockType.R and lock_manager.lock_queue:
-                # If multiple read locks are blocked before a write lock, then
-                # pop these read locks out of the queue and make them share the read lock.
-                next_lock = lock_manager.lock_queue.popleft()
-                while next_lock.lock_type == LockType.R and lock_manager.lock_queue:
-                    lock_manager.shared_read_lock.add(next_lock.tid)
-                    next_lock = lock_manager.lock_queue.popleft()
-                lock_manager.lock_queue.appendleft(next_lock)
-
-                # If the current lock is a read lock, and the next lock is the write lock
-                # of the same transaction, then promote the current read lock.
-                if len(lock_manager.shared_read_lock) == 1 and \
-                        next_lock.tid == lock_manager.shared_read_lock[0]:
-                    lock_manager.promote_current_lock(WriteLock(next_lock.tid, lock_manager.vid))
-                    lock_manager.lock_queue.popleft()
+        if self.wal is not None:
+            self.wal.close()
+
+    def checkpoint(self) -> None:
+        """Save the committed versions of the written variables to the write-ahead log.
+        """
+        variables = ((vid, v.commit_value_list) for vid, v in self.data.items() if v.commit_time_list[-1] > 0)
+        self.wal.checkpoint(variables, self.last_commit_time())
+
+    def restore(self) -> None:
+        """Rebuild the committed state of the site from the last checkpoint and the log after it.
+
+        The variables and their versions are allocated again, so the temporary
+        values are lost, like the memory of a crashed site.
+        """
+        checkpoint, commits = self.wal.load()
+        self.data = LazyTable(self.create_variable)
+        self.multiversion_variables = set()
+        for vid, versions in checkpoint.items():
+            v: Variable = self.data[vid]
+            v.commit_value_list = versions
+            v.commit_time_list = [version.commit_time for version in versions]
+        for commit_time, writes in commits:
+            for vid, value in writes:
+                self.data[vid].add_commit_value(CommitValue(value, commit_time))
+        for vid, v in self.data.items():
+            if len(v.commit_value_list) > 1:
+                self.multiversion_variables.add(vid)
+
+    def stable_state(self) -> tuple:
+        """Return what the site keeps when it is down: the committed versions and the failure history.
+        """
+        return dict(self.data), set(self.multiversion_variables), list(self.fail_timestamp), \
+            list(self.recover_timestamp)
+
+    def load_stable_state(self, state: tuple) -> None:
+        """Restore the state returned by `stable_state`, like the memory of a restarted site.
+
+        The temporary values are dropped, and the locks are not part of the state.
+        """
+        data, self.multiversion_variables, self.fail_timestamp, self.recover_timestamp = state
+        self.data = LazyTable(self.create_variable)
+        for vid, v in data.items():
+            v.temporary_value = None
+            self.data[vid] = v
+        self.written_variables.clear()
 
     def fail(self, timestamp: int) -> None:
         """Fail the current site.
@@ -263,48 +455,30 @@ class DataManager:
         self.fail_timestamp.append(timestamp)
         for lock_manager in self.lock_table.values():
             lock_manager.clear()
+        self.locked_variables.clear()
 
     def recover(self, timestamp: int) -> None:
         """
         Record the recover timestamp, and set
         all the replicated variable's state to unreadable.
+        Operations waiting for the variables of this site are woken up.
+        If the site has a write-ahead log, its state is rebuilt from it first.
         """
         self.is_up = True
         self.recover_timestamp.append(timestamp)
+        if self.wal is not None:
+            self.restore()
         for v in self.data.values():
             if v.is_replicated:
                 v.is_readable = False
+        for lock_manager in self.lock_table.values():
+            lock_manager.wake_waiting_operations()
 
     def generate_blocking_graph(self) -> defaultdict:
         """Generate blocking graph for the current site.
         """
         blocking_graph = defaultdict(set)
         for lock_manager in self.lock_table.values():
-            if not lock_manager.current_lock or len(lock_manager.lock_queue) == 0:
-                continue
-
-            # Generate lock graph for the current lock with other locks in queue.
-            current_lock = lock_manager.current_lock
-            for lock in lock_manager.lock_queue:
-                if is_conflict(current_lock, lock):
-                    # If current lock is a read lock, then all the other transactions
-                    # that share the same read lock would be conflicted with the write
-                    # lock in queue.
-                    if current_lock.lock_type == LockType.R:
-                        for shared_lock_tid in [x for x in lock_manager.shared_read_lock
-                                                if not (x == lock.tid)]:
-                            blocking_graph[lock.tid].add(shared_lock_tid)
-                    else:
-                        # If current lock is a write lock, then according our rule of adding locks
-                        # in queue, the blocked lock can only be the R/W locks of other transactions.
-                        # Therefore, add to blocking graph directly.
-                        blocking_graph[lock.tid].add(current_lock.tid)
-
-            # Generate lock graph for the locks in queue with each other.
-            for i in range(len(lock_manager.lock_queue)):
-                lock1 = lock_manager.lock_queue[i]
-                for j in range(i):
-                    lock2 = lock_manager.lock_queue[j]
-                    if is_conflict(lock2, lock1):
-                        blocking_graph[lock1.tid].add(lock2.tid)
+            for waiter, holder in lock_manager.generate_blocking_edges():
+                blocking_graph[waiter].add(holder)
         return blocking_graph
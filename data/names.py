@@ -0,0 +1,39 @@
+from errors import ParseError
+
+
+class NameTable:
+    """Translate the names of transactions and variables to integer ids and back.
+
+    Names are only used in the input and the output. Inside the engine, transactions
+    are identified by dense integer ids given in the order they first appear, and
+    variables by their index, so `x7` is the variable 7.
+    """
+
+    def __init__(self) -> None:
+        self.tid_names = []  # tid -> name of the transaction
+        self.tids = {}  # name of the transaction -> tid
+
+    def tid(self, name: str) -> int:
+        """Return the id of the transaction, a new id is given if the name hasn't been seen.
+        """
+        tid = self.tids.get(name)
+        if tid is None:
+            tid = self.tids[name] = len(self.tid_names)
+            self.tid_names.append(name)
+        return tid
+
+    def tid_name(self, tid: int) -> str:
+        return self.tid_names[tid]
+
+    @staticmethod
+    def vid(name: str) -> int:
+        if len(name) < 2 or name[0] != 'x' or not name[1:].isdigit():
+            raise ParseError("Invalid variable {}, variables should be named x1, x2, ...".format(name))
+        return int(name[1:])
+
+    @staticmethod
+    def vid_name(vid: int) -> str:
+        return 'x{}'.format(vid)
+
+    def lock_name(self, lock) -> str:
+        return '({} {} {})'.format(type(lock).__name__, self.tid_name(lock.tid), self.vid_name(lock.vid))
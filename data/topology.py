@@ -0,0 +1,161 @@
+import hashlib
+from bisect import bisect_right
+
+from errors import DataError
+
+
+class ModuloReplication:
+    """The default replication of the course project.
+
+    The even indexed variables are at all sites, and each odd indexed variable
+    is at the site `1 + (index number mod site count)`.
+    """
+
+    def __init__(self, site_count: int) -> None:
+        self.site_count = site_count
+        self.all_sites = tuple(range(1, site_count + 1))
+        self.single_sites = [None] + [(sid,) for sid in self.all_sites]
+
+    def sites_of(self, index: int) -> tuple:
+        if index % 2 == 0:
+            return self.all_sites
+        return self.single_sites[index % self.site_count + 1]
+
+    def has_variable(self, sid: int, index: int) -> bool:
+        return index % 2 == 0 or index % self.site_count + 1 == sid
+
+
+class FullReplication:
+    """Every variable is at all sites.
+    """
+
+    def __init__(self, site_count: int) -> None:
+        self.all_sites = tuple(range(1, site_count + 1))
+
+    def sites_of(self, index: int) -> tuple:
+        return self.all_sites
+
+    def has_variable(self, sid: int, index: int) -> bool:
+        return True
+
+
+class FactorReplication:
+    """Each variable is at `k` consecutive sites, starting from the site `1 + (index mod site count)`.
+    """
+
+    def __init__(self, site_count: int, k: int) -> None:
+        if not 1 <= k <= site_count:
+            raise DataError("Replication factor should be in [1, {}], got {}.".format(site_count, k))
+        self.site_count = site_count
+        self.k = k
+        # The sites of a variable only depend on its first site, so share the tuples.
+        self.site_groups = [tuple((start + i) % site_count + 1 for i in range(k)) for start in range(site_count)]
+
+    def sites_of(self, index: int) -> tuple:
+        return self.site_groups[index % self.site_count]
+
+    def has_variable(self, sid: int, index: int) -> bool:
+        return (sid - 1 - index) % self.site_count < self.k
+
+
+class ConsistentHashReplication:
+    """Each variable is at the first `k` distinct sites following its hash on a hash ring.
+
+    Every site owns several virtual nodes on the ring, so that the variables are
+    evenly distributed, and adding a site only moves a small part of them.
+    """
+
+    def __init__(self, site_count: int, k: int, virtual_nodes: int = 16) -> None:
+        if not 1 <= k <= site_count:
+            raise DataError("Replication factor should be in [1, {}], got {}.".format(site_count, k))
+        self.k = k
+        ring = sorted((self.hash('site{}#{}'.format(sid, i)), sid)
+                      for sid in range(1, site_count + 1) for i in range(virtual_nodes))
+        self.ring_hashes = [h for h, _ in ring]
+        self.ring_sites = [sid for _, sid in ring]
+        # The ring walk hashes the name of the variable, so its sites are only computed once.
+        self.replicas = {}  # index -> sites of the variable
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def sites_of(self, index: int) -> tuple:
+        sites = self.replicas.get(index)
+        if sites is None:
+            sites = self.replicas[index] = self.walk_ring(index)
+        return sites
+
+    def walk_ring(self, index: int) -> tuple:
+        sites = []
+        position = bisect_right(self.ring_hashes, self.hash('x{}'.format(index)))
+        while len(sites) < self.k:
+            sid = self.ring_sites[position % len(self.ring_sites)]
+            if sid not in sites:
+                sites.append(sid)
+            position += 1
+        return tuple(sites)
+
+    def has_variable(self, sid: int, index: int) -> bool:
+        return sid in self.sites_of(index)
+
+
+REPLICATION_STRATEGIES = ('modulo', 'full', 'factor', 'hash')
+
+
+class Topology:
+    """The layout of the distributed database.
+
+    It decides how many sites and variables there are, and which sites
+    hold a copy of each variable. Variables are identified by their index
+    from 1 to M (named `x1` to `xM`), and each variable `xi` is initialized
+    to the value `10 * i`.
+    """
+
+    def __init__(self, site_count: int = 10, variable_count: int = 20,
+                 replication: str = 'modulo', replication_factor: int = 1) -> None:
+        if site_count < 1 or variable_count < 1:
+            raise DataError("There should be at least one site and one variable.")
+        self.site_count = site_count
+        self.variable_count = variable_count
+        self.replication_name = replication
+        self.replication_factor = replication_factor
+        if replication == 'modulo':
+            self.replication = ModuloReplication(site_count)
+        elif replication == 'full':
+            self.replication = FullReplication(site_count)
+        elif replication == 'factor':
+            self.replication = FactorReplication(site_count, replication_factor)
+        elif replication == 'hash':
+            self.replication = ConsistentHashReplication(site_count, replication_factor)
+        else:
+            raise DataError("Unknown replication {}, the valid ones are {}.".format(
+                replication, REPLICATION_STRATEGIES))
+
+    def site_ids(self) -> range:
+        return range(1, self.site_count + 1)
+
+    def has_vid(self, vid: int) -> bool:
+        return 1 <= vid <= self.variable_count
+
+    def sites_of(self, vid: int) -> tuple:
+        """Return the ids of the sites holding the variable.
+        """
+        return self.replication.sites_of(vid) if self.has_vid(vid) else ()
+
+    def has_variable(self, sid: int, vid: int) -> bool:
+        return self.has_vid(vid) and self.replication.has_variable(sid, vid)
+
+    def is_replicated(self, vid: int) -> bool:
+        return len(self.sites_of(vid)) > 1
+
+    @staticmethod
+    def initial_value(vid: int) -> int:
+        return vid * 10
+
+    def variables_at(self, sid: int):
+        """Yield the ids of the variables held by the site, in index order.
+        """
+        for vid in range(1, self.variable_count + 1):
+            if self.replication.has_variable(sid, vid):
+                yield vid
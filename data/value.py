@@ -1,21 +1,33 @@
 class Value:
+    __slots__ = ('value',)
+
     def __init__(self, v):
         self.value = v
 
 
 class TemporaryValue(Value):
+    __slots__ = ('tid',)
+
     def __init__(self, v, tid):
         super(TemporaryValue, self).__init__(v)
         self.tid = tid
 
 
 class CommitValue(Value):
+    __slots__ = ('commit_time',)
+
     def __init__(self, v, commit_time: int):
         super(CommitValue, self).__init__(v)
         self.commit_time = commit_time
 
 
 class ResultValue(Value):
+    __slots__ = ('is_success',)
+
     def __init__(self, v, is_success: bool):
         super(ResultValue, self).__init__(v)
         self.is_success = is_success
+
+
+# Failed reads carry no value, so they all share the same result instead of allocating a new one.
+FAILED_RESULT = ResultValue(None, False)
@@ -1,25 +1,47 @@
-from collections import deque
+from bisect import bisect_right
 
-from data.value import Value
+from data.value import CommitValue
 from errors import DataError
 
 
 class Variable:
-    def __init__(self, vid: str, init: Value, is_replicated: bool):
+    __slots__ = ('vid', 'commit_value_list', 'commit_time_list', 'temporary_value', 'is_replicated', 'is_readable')
+
+    def __init__(self, vid: int, init: CommitValue, is_replicated: bool):
         self.vid = vid
-        self.commit_value_list = deque([init])
+        # All the committed versions ordered by commit time, the newest one is the last.
+        self.commit_value_list = [init]
+        self.commit_time_list = [init.commit_time]  # commit times of the versions, used for bisect
         self.temporary_value = None
         self.is_replicated = is_replicated
         self.is_readable = True
 
     def get_last_commit_value(self):
         """Get the most recent commit value."""
-        res = self.commit_value_list.popleft()
-        self.commit_value_list.appendleft(res)
-        return res.value
+        return self.commit_value_list[-1].value
+
+    def add_commit_value(self, v: CommitValue):
+        self.commit_value_list.append(v)
+        self.commit_time_list.append(v.commit_time)
+
+    def get_snapshot_value(self, timestamp: int):
+        """Get the newest version committed at or before the given time, or None if there's no such version.
+        """
+        i = bisect_right(self.commit_time_list, timestamp)
+        return self.commit_value_list[i - 1] if i > 0 else None
+
+    def collect_garbage(self, watermark: int) -> int:
+        """Drop the versions that can't be read by any snapshot taken at or after the watermark.
 
-    def add_commit_value(self, v):
-        self.commit_value_list.appendleft(v)
+        The newest version committed at or before the watermark is kept, as well as all
+        the versions after it. Return the number of dropped versions.
+        """
+        i = bisect_right(self.commit_time_list, watermark) - 1
+        if i <= 0:
+            return 0
+        del self.commit_value_list[:i]
+        del self.commit_time_list[:i]
+        return i
 
     def get_temporary_value(self):
         """Get the temporary value if exists.
@@ -0,0 +1,155 @@
+import os
+import struct
+
+from data.value import CommitValue
+from errors import DataError
+
+COMMIT_HEADER = struct.Struct('<qI')  # commit time, number of writes
+WRITE = struct.Struct('<qq')  # vid, value
+CHECKPOINT_HEADER = struct.Struct('<qI')  # time of the newest commit in the checkpoint, number of variables
+VARIABLE_HEADER = struct.Struct('<qI')  # vid, number of versions
+VERSION = struct.Struct('<qq')  # value, commit time
+
+
+class GroupCommit:
+    """Make the commits of a tick durable together.
+
+    The logs that got new records register here, and `sync` flushes each
+    of them with a single fsync at the end of the tick, however many
+    transactions committed in it.
+    """
+    def __init__(self) -> None:
+        self.dirty_logs = {}  # logs with records that are not synced yet, used as an ordered set
+
+    def mark(self, log) -> None:
+        self.dirty_logs[log] = None
+
+    def sync(self) -> int:
+        """Flush all the dirty logs, return the number of synced logs.
+        """
+        count = len(self.dirty_logs)
+        for log in self.dirty_logs:
+            log.flush()
+        self.dirty_logs.clear()
+        return count
+
+
+class WriteAheadLog:
+    """The write-ahead log and the checkpoint of a site.
+
+    Every commit appends a record with its commit time and the written values.
+    Records are buffered until the group commit syncs them, or until there are
+    `group_size` of them. After `checkpoint_interval` records, the site writes
+    a checkpoint with the committed versions of its variables, and the log is
+    truncated. Values are stored as 64-bit integers.
+    """
+    def __init__(self, directory: str, sid: int, group_commit: GroupCommit = None,
+                 group_size: int = 256, checkpoint_interval: int = 4096) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, 'site{}.log'.format(sid))
+        self.checkpoint_path = os.path.join(directory, 'site{}.checkpoint'.format(sid))
+        self.group_commit = group_commit
+        self.group_size = group_size
+        self.checkpoint_interval = checkpoint_interval
+        self.pending = []  # encoded records that are not written yet
+        self.records = 0  # number of records since the last checkpoint
+        self.file = open(self.log_path, 'ab')
+
+    def append(self, commit_time: int, writes: list) -> None:
+        """Log the (vid, value) pairs committed at the given time.
+        """
+        try:
+            record = COMMIT_HEADER.pack(commit_time, len(writes)) + \
+                     b''.join(WRITE.pack(vid, value) for vid, value in writes)
+        except struct.error:
+            raise DataError("Only integer values can be logged, got {}.".format([value for _, value in writes]))
+        self.pending.append(record)
+        self.records += 1
+        if len(self.pending) >= self.group_size:
+            self.flush()
+        elif self.group_commit is not None:
+            self.group_commit.mark(self)
+
+    def flush(self) -> None:
+        """Write the pending records and fsync the log.
+        """
+        if not self.pending:
+            return
+        self.file.write(b''.join(self.pending))
+        self.pending.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def needs_checkpoint(self) -> bool:
+        return self.records >= self.checkpoint_interval
+
+    def checkpoint(self, variables, commit_time: int) -> None:
+        """Save the committed versions of the variables, then truncate the log.
+
+        `variables` yields (vid, list of CommitValue) pairs, and `commit_time`
+        is the time of the newest commit they contain. The checkpoint is written
+        to a temporary file first, so a crash leaves either the old or the new one.
+        """
+        chunks = []
+        count = 0
+        for vid, versions in variables:
+            chunks.append(VARIABLE_HEADER.pack(vid, len(versions)))
+            chunks.extend(VERSION.pack(version.value, version.commit_time) for version in versions)
+            count += 1
+        temporary_path = self.checkpoint_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(CHECKPOINT_HEADER.pack(commit_time, count))
+            f.write(b''.join(chunks))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.checkpoint_path)
+        # The pending records are in the checkpoint, so they are dropped with the log.
+        self.pending.clear()
+        self.file.truncate(0)
+        self.records = 0
+
+    def load(self):
+        """Read the checkpoint and the log.
+
+        Return a dict vid -> list of CommitValue of the checkpoint, and the list
+        of (commit time, [(vid, value), ...]) records logged after it. A record
+        that was cut by a crash is dropped from the log.
+        """
+        self.flush()
+        checkpoint = {}
+        checkpoint_time = -1
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'rb') as f:
+                data = f.read()
+            checkpoint_time, count = CHECKPOINT_HEADER.unpack_from(data, 0)
+            offset = CHECKPOINT_HEADER.size
+            for _ in range(count):
+                vid, version_count = VARIABLE_HEADER.unpack_from(data, offset)
+                offset += VARIABLE_HEADER.size
+                checkpoint[vid] = [CommitValue(value, version_time)
+                                   for value, version_time in VERSION.iter_unpack(
+                                       data[offset:offset + version_count * VERSION.size])]
+                offset += version_count * VERSION.size
+
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        commits = []
+        offset = 0
+        while offset + COMMIT_HEADER.size <= len(data):
+            commit_time, write_count = COMMIT_HEADER.unpack_from(data, offset)
+            end = offset + COMMIT_HEADER.size + write_count * WRITE.size
+            if end > len(data):
+                break
+            # A crash between writing the checkpoint and truncating the log leaves records
+            # that are already in the checkpoint.
+            if commit_time > checkpoint_time:
+                commits.append((commit_time, list(WRITE.iter_unpack(data[offset + COMMIT_HEADER.size:end]))))
+            offset = end
+        if offset < len(data):
+            self.file.truncate(offset)
+        self.records = len(commits)
+        return checkpoint, commits
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
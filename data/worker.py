@@ -0,0 +1,102 @@
+from data.lock import LockManager
+from data.manager import DataManager
+from data.names import NameTable
+from data.topology import Topology
+from data.wal import WriteAheadLog
+from errors import DataError, LockError, TransactionError
+from output import Sink
+
+
+class EffectLog(Sink):
+    """Record what a site in a worker process does to the objects of the transaction manager.
+
+    In a single process, the sites write to the output, update the shared
+    wait-for graph, wake the parked operations and mark their logs for the
+    group commit directly. In a worker process, these effects are recorded in
+    order and sent back with the reply, so that the transaction manager can
+    apply them as if the site had done it.
+    """
+    def __init__(self) -> None:
+        self.effects = []
+
+    def emit(self, event: str, template: str, **fields) -> None:
+        self.effects.append(('emit', event, template, fields))
+
+    def newline(self) -> None:
+        self.effects.append(('newline',))
+
+    def add_edge(self, waiter, holder) -> None:
+        self.effects.append(('add_edge', waiter, holder))
+
+    def remove_edge(self, waiter, holder) -> None:
+        self.effects.append(('remove_edge', waiter, holder))
+
+    def wake(self, vid: int) -> None:
+        self.effects.append(('wake', vid))
+
+    def mark(self, log) -> None:
+        self.effects.append(('mark',))
+
+    def take(self) -> list:
+        effects = self.effects
+        self.effects = []
+        return effects
+
+
+class WorkerLockManager(LockManager):
+    """A lock manager whose parked operations live in the transaction manager, only their variable is reported.
+    """
+    def wake_waiting_operations(self) -> None:
+        self.scheduler.wake(self.vid)
+
+
+class WorkerSite(DataManager):
+    """A site running in a worker process, see `run_site`.
+    """
+    def __init__(self, sid: int, topology: Topology, effect_log: EffectLog, log_dir: str = None) -> None:
+        wal = WriteAheadLog(log_dir, sid, effect_log) if log_dir else None
+        super(WorkerSite, self).__init__(sid, topology, effect_log, effect_log, NameTable(), effect_log, wal)
+
+    def create_lock_manager(self, vid: int) -> LockManager:
+        return WorkerLockManager(vid, self.wait_for_graph, self.scheduler)
+
+    def request_write_lock(self, tid: int, vid: int) -> tuple:
+        """Try to get the write lock, return whether it is granted and the current lock of the variable.
+        """
+        is_granted = self.get_write_lock(tid, vid)
+        return is_granted, self.lock_table[vid].current_lock
+
+    def flush_log(self) -> None:
+        self.wal.flush()
+
+
+def run_site(connection, sid: int, topology: Topology, log_dir: str = None, state: tuple = None) -> None:
+    """The main loop of a worker process.
+
+    Every message from the transaction manager is a batch of the new
+    transaction names and of (seq, method name, args) requests. The requests
+    are executed in order, and the reply holds (seq, is_error, result,
+    effects) for each of them. An empty batch stops the worker, after
+    replying with the stable state of the site.
+    """
+    effect_log = EffectLog()
+    site = WorkerSite(sid, topology, effect_log, log_dir)
+    if state is not None:
+        site.load_stable_state(state)
+        site.is_up = False
+    while True:
+        names, requests = connection.recv()
+        if not requests:
+            connection.send(site.stable_state())
+            break
+        site.names.tid_names.extend(names)
+        replies = []
+        for seq, method_name, args in requests:
+            try:
+                replies.append((seq, False, getattr(site, method_name)(*args), effect_log.take()))
+            except (DataError, LockError, TransactionError) as e:
+                # The errors don't keep their message in their arguments, so they are sent by type and message.
+                replies.append((seq, True, (type(e), e.message), effect_log.take()))
+        connection.send(replies)
+    site.close()
+    connection.close()
@@ -15,8 +15,12 @@ class DataError(Exception):
 
 
 class ParseError(Exception):
-    def __init__(self, message):
+    def __init__(self, message, line=None, column=None):
+        if line is not None:
+            message = "line {}, column {}: {}".format(line, column, message)
         self.message = message
+        self.line = line
+        self.column = column
 
     def __repr__(self):
         return "Parse Error: " + self.message
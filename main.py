@@ -1,22 +1,94 @@
 import argparse
+import asyncio
 import os
+import sys
 
-from transaction.manager import TransactionManager
+from data.topology import REPLICATION_STRATEGIES, Topology
+from output import OUTPUT_MODES, create_sink
+from runner import run_directory, summarize, write_results
+from server import serve
+from transaction.commit import COMMIT_PROTOCOLS
+from transaction.manager import ISOLATION_LEVELS, TransactionManager
+from transaction.metrics import Metrics
+from transaction.prevention import DEADLOCK_POLICIES
+from transaction.trace import TraceRecorder, replay
+
+
+def create_manager(arguments, topology: Topology, output, name: str, metrics_file=None) -> TransactionManager:
+    """Create a transaction manager, whose commands are recorded to `<record dir>/<name>.trace` if asked,
+    and whose metrics are written to the metrics file if there's one.
+    """
+    manager = TransactionManager(topology, output, arguments.log_dir, arguments.processes, arguments.commit,
+                                 arguments.isolation, arguments.deadlock)
+    if arguments.record:
+        os.makedirs(arguments.record, exist_ok=True)
+        TraceRecorder(os.path.join(arguments.record, name + '.trace'), manager)
+    if metrics_file:
+        Metrics(manager, metrics_file, arguments.metrics_interval, name)
+    return manager
+
+
+def finish_manager(manager: TransactionManager) -> None:
+    if manager.recorder is not None:
+        manager.recorder.finish(manager)
+    if manager.metrics is not None:
+        manager.metrics.close()
+    manager.close()
 
 
 def main(arguments):
     """Main function, used for getting inputs.
     """
+    topology = Topology(arguments.sites, arguments.variables, arguments.replication, arguments.replication_factor)
+    if arguments.processes and arguments.deadlock != 'detect':
+        print("The deadlock prevention reads the timestamps of the transactions, it can't be used with --processes.")
+        return False
+    if arguments.run:
+        if arguments.record or arguments.metrics:
+            print("--record and --metrics can't be used with --run, run the files one by one with --dir instead.")
+            return False
+        # Non-interactive batch mode, the files are run in parallel and checked against their expectations.
+        options = dict(log_dir=arguments.log_dir, processes=arguments.processes, commit_protocol=arguments.commit,
+                       isolation=arguments.isolation, deadlock=arguments.deadlock)
+        results = run_directory(arguments.run, topology, arguments.jobs, options)
+        if arguments.results:
+            write_results(results, arguments.results)
+        print(summarize(results))
+        return all(result.status in ('PASS', 'NONE') for result in results)
+    if arguments.replay:
+        # Non-interactive replay of a recorded trace, without output.
+        result = replay(arguments.replay)
+        print('Replayed {} commands in {:.3f}s, {:.0f} commands/s.'.format(
+            result.commands, result.seconds, result.commands / result.seconds if result.seconds else 0))
+        for mismatch in result.mismatches:
+            print(mismatch)
+        print('The final state matches the recording.' if not result.mismatches else
+              '{} mismatches with the recording.'.format(len(result.mismatches)))
+        return not result.mismatches
+    if arguments.serve:
+        # Many clients share one transaction manager, the results are sent back to each of them.
+        mode = 'json' if arguments.output == 'json' else 'text'
+        try:
+            asyncio.run(serve(arguments.serve, topology, mode, arguments.log_dir))
+        except KeyboardInterrupt:
+            pass
+        return True
+    if arguments.processes and arguments.metrics:
+        print("The engine metrics read the lock tables of the sites, they can't be used with --processes.")
+        return False
+    output_file = open(arguments.output_file, 'w') if arguments.output_file else None
+    output = create_sink(arguments.output, output_file, arguments.buffer_size)
+    metrics_file = open(arguments.metrics, 'w') if arguments.metrics else None
     if arguments.file and not (arguments.std or arguments.dir):
         while True:
-            manager = TransactionManager()
             print("Please input file path:")
             input_file = input('> ')
             try:
                 print("Getting inputs from {}".format(input_file))
-                with open(input_file, 'r') as f:
-                    for line in f:
-                        manager.process(line)
+                manager = create_manager(arguments, topology, output, os.path.basename(input_file), metrics_file)
+                manager.process_file(input_file)
+                finish_manager(manager)
+                output.flush()
                 is_continue = input('Continue[y/n]?')
                 while is_continue.lower() != 'y' and is_continue.lower() != 'n':
                     is_continue = input('Continue[y/n]?')
@@ -25,32 +97,40 @@ def main(arguments):
             except IOError:
                 print("Error, can not open " + input_file)
     elif arguments.std and not (arguments.file or arguments.dir):
-        manager = TransactionManager()
+        manager = create_manager(arguments, topology, output, 'stdin', metrics_file)
         print("Standard input, use 'exit' to exit.")
         while True:
             cmd = input('> ')
             if cmd != 'exit':
                 manager.process(cmd)
+                output.flush()
             else:
                 break
+        finish_manager(manager)
     elif arguments.dir and not (arguments.std or arguments.file):
         print("Please input the root directory: ")
         root_dir = input('> ')
         files = [os.path.join(root_dir, file_name) for file_name in os.listdir(root_dir)]
         for file in files:
-            manager = TransactionManager()
             try:
                 print("Getting inputs from {}".format(file))
-                with open(file, 'r') as f:
-                    for line in f:
-                        manager.process(line)
+                manager = create_manager(arguments, topology, output, os.path.basename(file), metrics_file)
+                manager.process_file(file)
+                finish_manager(manager)
+                output.flush()
                 print()
             except IOError:
                 print("Error, can not open " + file)
     else:
         print("You should choose one and only one input method at one time. "
               "The usage should be python main.py [--file] | [--std] | [--dir]")
+    output.close()
+    if output_file:
+        output_file.close()
+    if metrics_file:
+        metrics_file.close()
     print('Bye')
+    return True
 
 
 if __name__ == '__main__':
@@ -60,6 +140,45 @@ if __name__ == '__main__':
     parser.add_argument('--file', action='store_true', help='whether to get input from file')
     parser.add_argument('--std', action='store_true', help='whether to get input from standard input')
     parser.add_argument('--dir', action='store_true', help='whether to get input from a directory.')
+    parser.add_argument('--sites', type=int, default=10, help='number of sites, 10 by default')
+    parser.add_argument('--variables', type=int, default=20, help='number of variables, 20 by default')
+    parser.add_argument('--replication', choices=REPLICATION_STRATEGIES, default='modulo',
+                        help='how variables are replicated among sites, modulo by default')
+    parser.add_argument('--replication-factor', type=int, default=1,
+                        help='number of copies of each variable for the factor and hash replication')
+    parser.add_argument('--output', choices=OUTPUT_MODES, default='text',
+                        help='output the results as text, as JSON lines or not at all, text by default')
+    parser.add_argument('--output-file', help='write the results to this file instead of the standard output')
+    parser.add_argument('--buffer-size', type=int, default=0,
+                        help='number of output lines kept in memory before writing them, 0 by default')
+    parser.add_argument('--log-dir', metavar='DIR',
+                        help='log the commits of each site to this directory, and restore the sites from it')
+    parser.add_argument('--processes', action='store_true',
+                        help='run every site in its own worker process, the output is the same')
+    parser.add_argument('--commit', choices=COMMIT_PROTOCOLS, default='direct',
+                        help='commit the transactions directly at every site, or with a two-phase commit, direct by '
+                             'default')
+    parser.add_argument('--isolation', choices=ISOLATION_LEVELS, default='2pl',
+                        help='isolate the read/write transactions with two-phase locking or with snapshot isolation, '
+                             '2pl by default')
+    parser.add_argument('--deadlock', choices=DEADLOCK_POLICIES, default='detect',
+                        help='detect the deadlocks, or prevent them with wait-die or wound-wait, detect by default')
+    parser.add_argument('--record', metavar='DIR',
+                        help='record the commands of each run to a binary trace in this directory')
+    parser.add_argument('--replay', metavar='TRACE',
+                        help='replay a recorded trace as fast as possible, and check its final state')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write snapshots of the engine metrics to this file as JSON lines')
+    parser.add_argument('--metrics-interval', type=int, default=0, metavar='TICKS',
+                        help='write a metrics snapshot every TICKS ticks, only at the end of each run by default')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help='serve concurrent clients on host:port or on a Unix socket path, the results are sent '
+                             'back as text, or as JSON lines with --output json')
+    parser.add_argument('--run', metavar='DIR',
+                        help='run all the files of a directory in parallel without prompts, and check the dump '
+                             'expectations of the files')
+    parser.add_argument('--jobs', type=int, help='number of worker processes of --run, one per core by default')
+    parser.add_argument('--results', metavar='DIR', help='write the output of each file of --run to this directory')
 
     args = parser.parse_args()
-    main(args)
+    sys.exit(0 if main(args) else 1)
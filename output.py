@@ -0,0 +1,99 @@
+import json
+import sys
+
+
+class ValueListing(dict):
+    """Variable names mapped to their values, formatted as `x1: 10, x2: 20, ` in text output.
+    """
+    def __format__(self, format_spec):
+        return ''.join('{}: {}, '.format(name, value) for name, value in self.items())
+
+
+class Sink:
+    """Where the events of the transaction manager and the sites go.
+
+    Every event has a name, a text template and the fields to fill in the
+    template. The template is only formatted by the sinks that output text,
+    so the other sinks don't pay for the formatting.
+    """
+    def emit(self, event: str, template: str, **fields) -> None:
+        raise NotImplementedError
+
+    def newline(self) -> None:
+        """Output a blank line, which only separates the ticks in text output.
+        """
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class NullSink(Sink):
+    """Drop all the events, used for benchmarking.
+    """
+    def emit(self, event: str, template: str, **fields) -> None:
+        pass
+
+
+class StreamSink(Sink):
+    """Write lines to a stream, the standard output by default.
+
+    If `buffer_size` is positive, the lines are kept in memory and written
+    together once there are `buffer_size` of them, or when flushed.
+    """
+    def __init__(self, stream=None, buffer_size: int = 0) -> None:
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, line: str) -> None:
+        if self.buffer_size <= 0:
+            # Look up the standard output every time, so that it can be redirected.
+            (self.stream or sys.stdout).write(line + '\n')
+            return
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        stream = self.stream or sys.stdout
+        if self.buffer:
+            self.buffer.append('')
+            stream.write('\n'.join(self.buffer))
+            self.buffer = []
+        stream.flush()
+
+
+class TextSink(StreamSink):
+    """Output the events as text, the same as printing them.
+    """
+    def emit(self, event: str, template: str, **fields) -> None:
+        self.write(template.format(**fields))
+
+    def newline(self) -> None:
+        self.write('')
+
+
+class JsonLinesSink(StreamSink):
+    """Output every event as a JSON object on its own line.
+    """
+    def emit(self, event: str, template: str, **fields) -> None:
+        self.write(json.dumps(dict(event=event, **fields)))
+
+
+OUTPUT_MODES = ('text', 'json', 'null')
+
+
+def create_sink(mode: str = 'text', stream=None, buffer_size: int = 0) -> Sink:
+    """Create the sink of the given output mode.
+    """
+    if mode == 'text':
+        return TextSink(stream, buffer_size)
+    if mode == 'json':
+        return JsonLinesSink(stream, buffer_size)
+    if mode == 'null':
+        return NullSink()
+    raise ValueError("Unknown output mode {}, the valid ones are {}.".format(mode, OUTPUT_MODES))
@@ -0,0 +1,132 @@
+import io
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from data.topology import Topology
+from output import TextSink
+from transaction.manager import TransactionManager
+
+EXPECTATION_HEADER = '==='
+SITE_EXPECTATION = re.compile(r'x(\d+): (\S+) at (?:site (\d+)|(all sites))$')
+INITIAL_EXPECTATION = 'All other variables have their initial values.'
+
+# The outcome of running one file. `status` is one of PASS, FAIL, ERROR or
+# NONE (the file has no expectations), and `failures` explains the others.
+FileResult = namedtuple('FileResult', ['path', 'status', 'output', 'failures', 'seconds'])
+
+
+def read_expectations(path: str) -> list:
+    """Return the lines after the `=== output of dump` line of a test file.
+    """
+    expectations = []
+    is_hint = False
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if is_hint and line:
+                expectations.append(line)
+            elif line.startswith(EXPECTATION_HEADER):
+                is_hint = True
+    return expectations
+
+
+def check_expectations(manager: TransactionManager, expectations: list) -> list:
+    """Compare the final committed values of all sites with the expectations, return the mismatches.
+
+    The expectations are written like the ones in the `test` directory:
+    `x1: 101 at site 2`, `x2: 102 at all sites` and
+    `All other variables have their initial values.`
+    """
+    failures = []
+    values = {site.sid: site.committed_values() for site in manager.sites}
+    checked = set()  # (sid, vid) pairs covered by an expectation
+    for expectation in expectations:
+        if expectation == INITIAL_EXPECTATION:
+            for sid, site_values in values.items():
+                for vid, value in site_values.items():
+                    if (sid, vid) not in checked and value != manager.topology.initial_value(vid):
+                        failures.append('x{}.{} is {}, expected its initial value {}'.format(
+                            vid, sid, value, manager.topology.initial_value(vid)))
+            continue
+        match = SITE_EXPECTATION.match(expectation)
+        if match is None:
+            failures.append('Unknown expectation "{}"'.format(expectation))
+            continue
+        vid, expected, sid, _ = match.groups()
+        vid = int(vid)
+        sids = [int(sid)] if sid else manager.topology.sites_of(vid)
+        for sid in sids:
+            value = values[sid].get(vid)
+            checked.add((sid, vid))
+            if str(value) != expected:
+                failures.append('x{}.{} is {}, expected {}'.format(vid, sid, value, expected))
+    return failures
+
+
+def run_file(path: str, topology: Topology = None, options: dict = None) -> FileResult:
+    """Run one input file with a fresh transaction manager and capture its output.
+
+    The options are passed to the transaction manager. If they have a `log_dir`,
+    the file logs to its own subdirectory, so that the files don't restore each
+    other's commits.
+    """
+    options = dict(options or {})
+    if options.get('log_dir'):
+        options['log_dir'] = os.path.join(options['log_dir'], os.path.basename(path))
+    stream = io.StringIO()
+    start = time.perf_counter()
+    manager = None
+    try:
+        manager = TransactionManager(topology, TextSink(stream), **options)
+        manager.process_file(path)
+        seconds = time.perf_counter() - start
+        expectations = read_expectations(path)
+        if not expectations:
+            return FileResult(path, 'NONE', stream.getvalue(), [], seconds)
+        # The sites are checked before the manager is closed, they may run in worker processes.
+        failures = check_expectations(manager, expectations)
+        return FileResult(path, 'FAIL' if failures else 'PASS', stream.getvalue(), failures, seconds)
+    except Exception as e:
+        return FileResult(path, 'ERROR', stream.getvalue(), [repr(e)], time.perf_counter() - start)
+    finally:
+        if manager is not None:
+            manager.close()
+
+
+def run_directory(directory: str, topology: Topology = None, jobs: int = None, options: dict = None) -> list:
+    """Run all the files of a directory in a process pool of `jobs` workers, one per core by default.
+
+    The options are passed to the transaction manager of every file, see `run_file`.
+    The results are in the order of the file names.
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, name)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(run_file, paths, [topology] * len(paths), [options] * len(paths)))
+
+
+def write_results(results: list, output_dir: str) -> None:
+    """Write the captured output of each file to `<output_dir>/<file name>.out`.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for result in results:
+        with open(os.path.join(output_dir, os.path.basename(result.path) + '.out'), 'w') as f:
+            f.write(result.output)
+
+
+def summarize(results: list) -> str:
+    """Return the summary of the results, one line per file and the counts of each status.
+    """
+    lines = []
+    counts = {'PASS': 0, 'FAIL': 0, 'ERROR': 0, 'NONE': 0}
+    for result in results:
+        counts[result.status] += 1
+        lines.append('{:<5} {} ({:.3f}s)'.format(result.status, result.path, result.seconds))
+        for failure in result.failures:
+            lines.append('      ' + failure)
+    lines.append('{} files: {} passed, {} failed, {} errors, {} without expectations.'.format(
+        len(results), counts['PASS'], counts['FAIL'], counts['ERROR'], counts['NONE']))
+    return '\n'.join(lines)
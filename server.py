@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+
+from data.topology import Topology
+from errors import DataError, LockError, ParseError, TransactionError
+from output import Sink
+from transaction.manager import TransactionManager
+from transaction.parser import Command, Opcode, Parser
+
+
+class Session:
+    """A client connection, with its parser and the output waiting to be sent to it.
+    """
+    __slots__ = ('writer', 'parser', 'lines', 'is_closed')
+
+    def __init__(self, writer, parser: Parser) -> None:
+        self.writer = writer
+        self.parser = parser  # every client has its own line numbers and hints, but the names are shared
+        self.lines = []  # output lines produced since the last flush
+        self.is_closed = False
+
+    def flush(self) -> None:
+        if self.lines and not self.is_closed:
+            self.lines.append('')
+            self.writer.write('\n'.join(self.lines).encode())
+        self.lines = []
+
+
+class SessionSink(Sink):
+    """Route the events of the transaction manager to the client sessions.
+
+    The events of a transaction go to the session that began it, even if they
+    happen during the command of another session, like a waiting read that
+    succeeds because another transaction committed. The other events, like
+    dumps and site failures, go to the session whose command is processed.
+    """
+    def __init__(self, mode: str = 'json') -> None:
+        self.is_json = mode == 'json'
+        self.owners = {}  # transaction name -> session that began it
+        self.current = None  # session whose command is processed, None between commands
+        self.touched = set()  # sessions that got output since the last flush
+
+    def emit(self, event: str, template: str, **fields) -> None:
+        tid = fields.get('tid')
+        session = self.current
+        if tid is not None:
+            if event == 'begin' or event == 'begin_ro':
+                self.owners[tid] = session
+            elif event == 'commit' or event == 'abort':
+                session = self.owners.pop(tid, session)
+            else:
+                session = self.owners.get(tid, session)
+        if session is None or session.is_closed:
+            return
+        session.lines.append(json.dumps(dict(event=event, **fields)) if self.is_json else template.format(**fields))
+        self.touched.add(session)
+
+    def transactions_of(self, session: Session) -> list:
+        """Return the names of the active transactions a session began.
+        """
+        return [tid for tid, owner in self.owners.items() if owner is session]
+
+    def flush(self) -> None:
+        for session in self.touched:
+            session.flush()
+        self.touched.clear()
+
+
+class TransactionServer:
+    """Serve one transaction manager to many clients over TCP or a Unix socket.
+
+    Every client sends commands, one per line, in the input format. The commands
+    of all the connections are queued in the order they arrive, and each one
+    takes its own tick, so the engine behaves as if it read them from a single
+    file. The output is sent back as JSON lines (or text), see `SessionSink`.
+
+    When the queue is empty and some transactions started to wait, an idle tick
+    checks for deadlocks right away, so that clients waiting for their results
+    don't need another command to arrive first. When a client disconnects, the transactions
+    it began and didn't end are aborted, so that they don't hold their locks forever.
+    """
+    def __init__(self, topology: Topology = None, mode: str = 'json', log_dir: str = None) -> None:
+        self.sink = SessionSink(mode)
+        self.manager = TransactionManager(topology, self.sink, log_dir)
+        self.queue = None  # (session, command) to be processed, created in the event loop
+        self.server = None
+        self.path = None  # of the Unix socket, removed when the server is closed
+        self.processor = None  # task running the queued commands
+
+    async def start(self, host: str = None, port: int = None, path: str = None) -> None:
+        """Listen on the TCP address, or on the Unix socket if a path is given.
+        """
+        self.queue = asyncio.Queue()
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=path)
+            self.path = path
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        self.processor = asyncio.ensure_future(self.process())
+
+    def addresses(self) -> list:
+        return [socket.getsockname() for socket in self.server.sockets]
+
+    async def serve_forever(self) -> None:
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self) -> None:
+        self.server.close()
+        if self.path is not None:
+            # Otherwise the next server on the same path fails to bind it.
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+        if self.processor is not None:
+            self.processor.cancel()
+            self.processor = None
+        self.manager.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Read the commands of a client until it sends `exit` or disconnects.
+        """
+        session = Session(writer, Parser(self.manager.names))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode().strip()
+                if line == 'exit':
+                    break
+                try:
+                    command = session.parser.parse(line)
+                except ParseError as e:
+                    session.lines.append(self.error(e.message))
+                    session.flush()
+                    continue
+                if command:
+                    await self.queue.put((session, command))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            session.is_closed = True
+            writer.close()
+            # A None command aborts the transactions of the session, after its queued commands.
+            self.queue.put_nowait((session, None))
+
+    def error(self, message: str, tid: str = None) -> str:
+        if self.sink.is_json:
+            fields = {'event': 'error', 'message': message}
+            if tid is not None:
+                fields['tid'] = tid
+            return json.dumps(fields)
+        return 'Error: ' + message
+
+    async def process(self) -> None:
+        """Run the queued commands, one tick each, and send their output after every batch.
+        """
+        sink = self.sink
+        while True:
+            session, command = await self.queue.get()
+            self.tick(session, command)
+            while not self.queue.empty():
+                session, command = self.queue.get_nowait()
+                self.tick(session, command)
+            command = self.idle_command()
+            if command is not None:
+                self.tick(None, command)
+            sink.flush()
+
+    def idle_command(self):
+        """Return a command that changes nothing, the recovery of a site that is up, if the next tick
+        would check for deadlocks, so that they are solved at the start of a tick like in any other run.
+        Return None otherwise.
+        """
+        manager = self.manager
+        if manager.prevention is not None:
+            if not manager.prevention.victims:
+                return None
+        elif not manager.wait_for_graph.has_new_edge():
+            return None
+        for site in manager.sites:
+            if site.is_up:
+                return Command(Opcode.RECOVER, None, None, site.sid)
+        # Without any site up, nobody holds a lock to wait for.
+        return None
+
+    def tick(self, session, command) -> None:
+        self.sink.current = session
+        if command is None:
+            self.disconnect(session)
+            return
+        try:
+            self.manager.tick(command)
+        except (TransactionError, DataError, LockError) as e:
+            # A wrong command of a client must not stop the others.
+            self.report(session, command, e.message)
+        except Exception as e:
+            # Neither may a bug, the client gets the error and the server goes on.
+            self.report(session, command, 'Unexpected {}: {}'.format(type(e).__name__, e))
+
+    def report(self, session, command, message: str) -> None:
+        tid = self.manager.names.tid_name(command.tid) if command.tid is not None else None
+        if session is None:
+            # An idle tick, no client sent the command.
+            print(self.error(message, tid))
+            return
+        session.lines.append(self.error(message, tid))
+        self.sink.touched.add(session)
+
+    def disconnect(self, session: Session) -> None:
+        """Abort the transactions a disconnected session began and didn't end.
+        """
+        manager = self.manager
+        tids = [manager.names.tid(x) for x in self.sink.transactions_of(session)]
+        if manager.abort_transactions(tids, 'Client Disconnected'):
+            manager.execute_operations()
+
+
+def parse_address(address: str):
+    """Split `host:port` into the host and the port, or return the address as the path of a Unix socket.
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit():
+        return host or None, int(port), None
+    return None, None, address
+
+
+async def serve(address: str, topology: Topology = None, mode: str = 'json', log_dir: str = None) -> None:
+    host, port, path = parse_address(address)
+    server = TransactionServer(topology, mode, log_dir)
+    await server.start(host, port, path)
+    print('Serving on {}, one command per line, use \'exit\' to disconnect.'.format(
+        ', '.join(str(x) for x in server.addresses())))
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
@@ -0,0 +1,61 @@
+from typing import List
+
+# The ways the transaction manager ends the transactions at the sites.
+COMMIT_PROTOCOLS = ('direct', 'two-phase')
+
+
+class TwoPhaseCommit:
+    """The coordinator of the two-phase commit of the transactions.
+
+    In the first phase, `end` asks every site the transaction read or wrote to
+    prepare, and each one votes whether it can commit: a site that is down or
+    failed since the transaction first accessed it has lost the locks and the
+    temporary values of the transaction, and votes no. The transaction commits
+    only if all the votes are yes, otherwise it aborts.
+
+    In the second phase, the decision is sent to the participants of the
+    transaction: the sites it read or wrote, and the sites it asked for a lock,
+    as they may still have locks of the transaction in their queues. The
+    decisions made in the same step of a tick, like the deadlock victims of one
+    detection round, are grouped and sent in a single round, where every site
+    gets the decisions it takes part in together, grants the released locks
+    once and logs the commit records together. An `end` decides a single
+    transaction, so its decision is sent right away in its own round.
+    """
+    def __init__(self, sites: List) -> None:
+        self.sites = sites
+        # sid -> (tid, commit time or None for an abort, watermark) not sent yet to the site, in decision order
+        self.decisions = {}
+        self.rounds = 0  # number of decision rounds
+        self.messages = 0  # number of decide requests sent to the sites
+        self.votes = 0  # number of prepare requests
+        self.no_votes = 0
+
+    def prepare(self, transaction) -> bool:
+        """Ask the participants of the transaction to prepare, return whether all of them voted yes.
+        """
+        for sid, incarnation in transaction.visited_sites.items():
+            self.votes += 1
+            if not self.sites[sid - 1].prepare(transaction.tid, incarnation):
+                self.no_votes += 1
+                return False
+        return True
+
+    def decide(self, transaction, commit_time: int = None, watermark: int = None) -> None:
+        """Add the decision for a transaction to the current group, the commit time is None for an abort.
+        """
+        decision = (transaction.tid, commit_time, watermark)
+        for sid in transaction.lock_sites.union(transaction.visited_sites):
+            self.decisions.setdefault(sid, []).append(decision)
+
+    def flush(self) -> None:
+        """Send the decisions of the group to their participants, one request per site.
+        """
+        if not self.decisions:
+            return
+        decisions = self.decisions
+        self.decisions = {}
+        for sid in sorted(decisions):
+            self.sites[sid - 1].decide(decisions[sid])
+        self.messages += len(decisions)
+        self.rounds += 1
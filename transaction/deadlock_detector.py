@@ -4,6 +4,50 @@ from typing import List
 from data.manager import DataManager
 
 
+class WaitForGraph:
+    """A persistent wait-for graph among all the existing transactions.
+
+    The lock managers of every site push their edges into this graph whenever
+    their locks change, so the graph is always up to date and never has to be
+    rebuilt. The same edge may be caused by several variables (or sites), thus
+    every edge is reference counted and only disappears when its last cause is
+    released.
+
+    Removing edges can never create a cycle, so a cycle check is only needed
+    after new edges were inserted, and only among the transactions reachable
+    from the waiters of these new edges, as every cycle passes through one of them.
+    """
+
+    def __init__(self):
+        self.graph = {}  # waiter tid -> set of the tids it waits for
+        self.edge_count = defaultdict(int)  # (waiter, holder) -> number of lock managers causing the edge
+        self.new_edge_waiters = set()  # waiters of the edges inserted since the last clean check
+
+    def add_edge(self, waiter, holder) -> None:
+        self.edge_count[(waiter, holder)] += 1
+        if self.edge_count[(waiter, holder)] == 1:
+            self.graph.setdefault(waiter, set()).add(holder)
+            self.new_edge_waiters.add(waiter)
+
+    def remove_edge(self, waiter, holder) -> None:
+        self.edge_count[(waiter, holder)] -= 1
+        if self.edge_count[(waiter, holder)] == 0:
+            del self.edge_count[(waiter, holder)]
+            holders = self.graph[waiter]
+            holders.discard(holder)
+            if not holders:
+                del self.graph[waiter]
+                self.new_edge_waiters.discard(waiter)
+
+    def has_new_edge(self) -> bool:
+        return len(self.new_edge_waiters) > 0
+
+    def clear_new_edges(self) -> None:
+        """Mark the graph as checked, should only be called when it has no cycle.
+        """
+        self.new_edge_waiters.clear()
+
+
 def generate_blocking_graph(sites: List[DataManager]) -> defaultdict:
     """
     Collect blocking information from all up sites, and generate
@@ -17,37 +61,67 @@ def generate_blocking_graph(sites: List[DataManager]) -> defaultdict:
     return blocking_graph
 
 
-def has_cycle(start, end, visited, blocking_graph) -> bool:
-    """Use DFS to judge if there is a cycle in the blocking graph.
+def strongly_connected_components(blocking_graph, roots) -> List[list]:
+    """Find the strongly connected components reachable from the given roots.
 
-    Principle:
-        For all the arcs that starts from a node, if this node's parent
-        existed as the end of an arc, then there is a cycle in the graph.
+    This is an iterative version of Tarjan's algorithm, so that every node and
+    arc is visited only once, and long wait chains can't exceed the recursion limit.
     """
-    visited[start] = True
-    for adjacent_tid in blocking_graph[start]:
-        if adjacent_tid == end:
-            return True
-        if not visited[adjacent_tid]:
-            if has_cycle(adjacent_tid, end, visited, blocking_graph):
-                return True
-    return False
+    index = {}
+    low_link = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in roots:
+        if root in index:
+            continue
+        index[root] = low_link[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(blocking_graph.get(root, ())))]
+        while work:
+            tid, adjacent_tids = work[-1]
+            for adjacent_tid in adjacent_tids:
+                if adjacent_tid not in index:
+                    # Go deeper, the rest of the adjacent tids are visited when coming back.
+                    index[adjacent_tid] = low_link[adjacent_tid] = len(index)
+                    stack.append(adjacent_tid)
+                    on_stack.add(adjacent_tid)
+                    work.append((adjacent_tid, iter(blocking_graph.get(adjacent_tid, ()))))
+                    break
+                elif adjacent_tid in on_stack:
+                    low_link[tid] = min(low_link[tid], index[adjacent_tid])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[tid])
+                if low_link[tid] == index[tid]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == tid:
+                            break
+                    components.append(component)
+    return components
 
 
-def detect(transactions, blocking_graph):
+def detect(transactions, blocking_graph, roots=None) -> list:
     """
-    Find out if there is a cycle in the blocking graph. If so, then there exists
-    a deadlock, and this function will return the youngest transaction id. Otherwise,
-    return nothing.
+    Find out all the cycles in the blocking graph in one pass. Every strongly
+    connected component with more than one transaction is a deadlock, and the
+    youngest transaction of each one is chosen as the victim.
+
+    If `roots` is given, only the transactions reachable from them are checked.
+    The victims are returned from the youngest to the oldest.
     """
-    victim_timestamp = float('-inf')
-    victim_tid = None
-    # To avoid `RuntimeError: dictionary changed size during iteration`,
-    # we should use list() function or .copy() method.
-    for tid in list(blocking_graph.keys()):
-        visited = defaultdict(bool)
-        if has_cycle(tid, tid, visited, blocking_graph):
-            if transactions[tid].timestamp > victim_timestamp:
-                victim_timestamp = transactions[tid].timestamp
-                victim_tid = tid
-    return victim_tid
+    if roots is None:
+        roots = list(blocking_graph.keys())
+    victims = []
+    for component in strongly_connected_components(blocking_graph, roots):
+        if len(component) > 1:
+            victims.append(max(component, key=lambda tid: transactions[tid].timestamp))
+    victims.sort(key=lambda tid: transactions[tid].timestamp, reverse=True)
+    return victims
@@ -1,22 +1,92 @@
-from collections import deque
-
+from data.topology import Topology
+from data.wal import GroupCommit, WriteAheadLog
 from errors import TransactionError
+from output import NullSink, Sink, TextSink
+from transaction.commit import COMMIT_PROTOCOLS, TwoPhaseCommit
 from transaction.deadlock_detector import *
 from transaction.operation import OperationType, ReadOperation, WriteOperation
-from transaction.parser import Parser
+from transaction.parser import Command, Opcode, Parser
+from transaction.prevention import DEADLOCK_POLICIES, DeadlockPrevention
+from transaction.remote import SiteProcesses
+from transaction.routing import RoutingTable
+from transaction.scheduler import OperationScheduler
 from transaction.transaction import Transaction
 
+# How the read/write transactions are isolated: strict two-phase locking, or snapshot isolation.
+ISOLATION_LEVELS = ('2pl', 'snapshot')
+
 
 class TransactionManager:
-    def __init__(self):
+    def __init__(self, topology: Topology = None, output: Sink = None, log_dir: str = None, processes: bool = False,
+                 commit_protocol: str = 'direct', isolation: str = '2pl', deadlock: str = 'detect'):
+        if commit_protocol not in COMMIT_PROTOCOLS:
+            raise ValueError("Unknown commit protocol {}, the valid ones are {}.".format(
+                commit_protocol, COMMIT_PROTOCOLS))
+        if isolation not in ISOLATION_LEVELS:
+            raise ValueError("Unknown isolation {}, the valid ones are {}.".format(isolation, ISOLATION_LEVELS))
+        if deadlock not in DEADLOCK_POLICIES:
+            raise ValueError("Unknown deadlock handling {}, the valid ones are {}.".format(deadlock, DEADLOCK_POLICIES))
+        if processes and deadlock != 'detect':
+            # The workers only maintain the wait-for graph, the deadlocks would be neither prevented nor detected.
+            raise ValueError("The deadlock prevention reads the timestamps of the transactions, "
+                             "it can't be used with the sites in worker processes.")
         self.parser = Parser()
+        self.output = output if output is not None else TextSink()  # where the results and messages go
+        self.names = self.parser.names  # used to translate ids back to names in the output
+        self.topology = topology if topology is not None else Topology()
+        self.commit_protocol = commit_protocol
+        self.isolation = isolation
+        self.deadlock = deadlock
         self.transactions = defaultdict()
         self.timestamp = 0
-        self.operations = deque()
-
-        self.sites = []
-        for i in range(1, 11):
-            self.sites.append(DataManager(i))
+        self.scheduler = OperationScheduler()
+        self.snapshot_timestamps = {}  # tid -> timestamp of the active transactions reading snapshots, in begin order
+        # With snapshot isolation, the read/write transactions read snapshots and the first committer wins.
+        self.is_snapshot_isolation = isolation == 'snapshot'
+        self.write_times = {}  # vid -> time of the last commit that wrote it, under snapshot isolation
+        self.recorder = None  # records the accepted commands into a trace, see transaction.trace
+        self.metrics = None  # times the hot methods and reads the gauges, see transaction.metrics
+
+        self.wait_for_graph = WaitForGraph()
+        # If the deadlocks are prevented, the lock managers don't maintain the wait-for graph, see transaction.prevention.
+        self.prevention = DeadlockPrevention(deadlock, self.transactions) if deadlock != 'detect' else None
+        wait_for_graph = self.wait_for_graph if self.prevention is None else None
+        # tids aborted to solve or prevent a deadlock, whose client may still send commands, skipped until its end.
+        self.deadlock_victims = set()
+        # If a log directory is given, the sites log their commits there, and the logs are synced once per tick.
+        self.group_commit = GroupCommit() if log_dir else None
+        # If asked, every site runs in its own worker process, see transaction.remote.
+        self.processes = None
+        if processes:
+            self.processes = SiteProcesses(self.topology, self.names, self.output, self.wait_for_graph,
+                                           self.scheduler, self.group_commit, log_dir)
+            self.output = self.processes.sink
+            self.sites = self.processes.sites
+        else:
+            self.sites = []
+            for i in self.topology.site_ids():
+                wal = WriteAheadLog(log_dir, i, self.group_commit) if log_dir else None
+                self.sites.append(DataManager(i, self.topology, wait_for_graph, self.scheduler, self.names,
+                                              self.output, wal, self.prevention))
+        self.routing = RoutingTable(self.topology, self.sites)
+        # With the two-phase commit, the sites vote at the end of a transaction, see transaction.commit.
+        self.coordinator = TwoPhaseCommit(self.sites) if commit_protocol == 'two-phase' else None
+        if log_dir:
+            # Continue after the newest commit restored from the logs.
+            last_commit_time = max(site.last_commit_time() for site in self.sites)
+            if last_commit_time > 0:
+                self.timestamp = last_commit_time + 1
+
+    def close(self) -> None:
+        """Close the write-ahead logs of the sites, or stop the worker processes of
+        the sites if they run in their own processes, which close their logs.
+        """
+        if self.processes is not None:
+            self.processes.close()
+            self.processes = None
+        else:
+            for site in self.sites:
+                site.close()
 
     def process(self, s):
         """The main processing flow.
@@ -29,168 +99,286 @@ class TransactionManager:
         (4) Try to execute the operations.
         (5) Increase the timestamp.
         """
-        arguments = self.parser.parse(s)
-        if not arguments:
+        command = self.parser.parse(s)
+        if not command:
             return
+        self.tick(command)
+
+    def process_batch(self, commands) -> None:
+        """Process an iterable of already parsed commands.
+
+        Every command takes its own tick, exactly like calling `tick` with
+        each of them, so the output and the final state are the same. The
+        work of `tick` that doesn't change during the batch is done once:
+        the optional steps (two-phase commit, recorder, group commit) are
+        looked up before the loop, the deadlock check is only called when the
+        wait-for graph has new edges or the prevention policy chose victims,
+        and the tick banners are not built at all when the output is dropped.
+        Keep the two in step when changing the tick.
+        """
+        output = self.output
+        banners = not isinstance(output, NullSink)
+        has_new_edge = self.wait_for_graph.has_new_edge
+        prevention = self.prevention
+        coordinator, recorder, group_commit = self.coordinator, self.recorder, self.group_commit
+        process_command, execute_operations = self.process_command, self.execute_operations
+        for command in commands:
+            if not command:
+                continue
+            if prevention.victims if prevention is not None else has_new_edge():
+                if self.detect_deadlock():
+                    execute_operations()
+                    if banners:
+                        output.newline()
+            if banners:
+                output.emit('tick', '------- Time {time} -------', time=self.timestamp)
+            process_command(command)
+            if coordinator is not None:
+                self.send_decisions()
+            if recorder is not None:
+                recorder.record(self.timestamp, command)
+            execute_operations()
+            if group_commit is not None:
+                group_commit.sync()
+            self.timestamp += 1
+            if banners:
+                output.newline()
+
+    def process_file(self, path: str) -> None:
+        """Stream the commands of a file through `process_batch`.
+        """
+        self.process_batch(self.parser.parse_file(path))
+
+    def tick(self, command: Command) -> None:
+        """Process one parsed command in its own tick, see `process`.
+        """
         if self.detect_deadlock():
             self.execute_operations()
-            print()
-        print('------- Time {} -------'.format(self.timestamp))
-        self.process_command(arguments)
+            self.output.newline()
+        self.output.emit('tick', '------- Time {time} -------', time=self.timestamp)
+        self.process_command(command)
+        if self.coordinator is not None:
+            self.send_decisions()
+        if self.recorder is not None:
+            self.recorder.record(self.timestamp, command)
         self.execute_operations()
+        if self.group_commit is not None:
+            self.group_commit.sync()
         self.timestamp += 1
-        print()
+        self.output.newline()
 
-    def process_command(self, arguments: List[str]) -> None:
+    def process_command(self, command: Command) -> None:
         """Execute different functions according to the given command.
         """
-        cmd = arguments[0]
+        opcode = command.opcode
 
-        if cmd == 'begin':
-            assert len(arguments) == 2
-            self.begin(arguments)
+        if opcode == Opcode.W:
+            self.add_write_operation(command.tid, command.vid, command.value)
 
-        elif cmd == 'beginRO':
-            assert len(arguments) == 2
-            self.begin_ro(arguments)
+        elif opcode == Opcode.R:
+            self.add_read_operation(command.tid, command.vid)
 
-        elif cmd == 'end':
-            assert len(arguments) == 2
-            self.end(arguments)
+        elif opcode == Opcode.BEGIN:
+            self.begin(command.tid)
 
-        elif cmd == 'W':
-            assert len(arguments) == 4
-            tid = arguments[1]
-            vid = arguments[2]
-            value = arguments[3]
-            self.add_write_operation(tid, vid, value)
+        elif opcode == Opcode.BEGIN_RO:
+            self.begin_ro(command.tid)
 
-        elif cmd == 'R':
-            assert len(arguments) == 3
-            tid = arguments[1]
-            vid = arguments[2]
-            self.add_read_operation(tid, vid)
+        elif opcode == Opcode.END:
+            self.end(command.tid)
 
-        elif cmd == 'dump':
-            assert len(arguments) == 1
+        elif opcode == Opcode.DUMP:
             self.dump()
 
-        elif cmd == 'fail':
-            assert len(arguments) == 2
-            self.fail(arguments)
+        elif opcode == Opcode.FAIL:
+            self.fail(command.value)
 
         else:
-            assert len(arguments) == 2
-            self.recover(arguments)
+            self.recover(command.value)
 
     def execute_operations(self):
-        """Try to execute all the operations in queue.
+        """Try to execute the operations that have been woken up.
 
         Side Effect:
-            If certain operation is executed successfully, then remove it from queue.
+            If certain operation is executed successfully, then remove it from the scheduler.
+            Otherwise, park it on the lock managers of its variable until they change.
         """
-        for operation in list(self.operations):
+        if not self.scheduler.has_ready_operations():
+            return
+        for operation in self.scheduler.ready_operations():
             tid = operation.tid
             vid = operation.vid
 
+            trans = self.transactions[tid]
             if operation.operation_type == OperationType.R:
-                is_success = self.snapshot_read(tid, vid) if self.transactions[tid].is_ro else self.read(tid, vid)
+                if trans.is_ro:
+                    is_success = self.snapshot_read(tid, vid)
+                elif trans.is_snapshot:
+                    is_success = self.snapshot_isolation_read(tid, vid)
+                else:
+                    is_success = self.read(tid, vid)
+            elif trans.is_snapshot:
+                is_success = self.snapshot_isolation_write(tid, vid, operation.value)
             else:
                 is_success = self.write(tid, vid, operation.value)
 
             if is_success:
-                self.operations.remove(operation)
+                self.scheduler.complete(operation)
+            else:
+                self.scheduler.park(operation, [site.lock_table[vid] for site in self.routing.get(vid).sites])
 
-    def begin(self, arguments):
+    def begin(self, tid: int):
         """Initialize a transaction in the transaction manager.
 
         Side Effect:
             A normal transaction object will be created in the transaction table,
             whose key is the corresponding transaction id.
         """
-        tid = arguments[1]
         if tid in self.transactions:
-            raise TransactionError("{} has already begun.".format(tid))
-        transaction = Transaction(tid, self.timestamp, False)
+            raise TransactionError("{} has already begun.".format(self.names.tid_name(tid)))
+        self.deadlock_victims.discard(tid)
+        transaction = Transaction(tid, self.timestamp, False, self.is_snapshot_isolation)
         self.transactions[tid] = transaction
-        print('Transaction {} begins'.format(tid))
+        if transaction.is_snapshot:
+            self.snapshot_timestamps[tid] = self.timestamp
+        self.output.emit('begin', 'Transaction {tid} begins', tid=self.names.tid_name(tid))
 
-    def begin_ro(self, arguments):
+    def begin_ro(self, tid: int):
         """Initialize a read-only transaction in the transaction manager.
 
         Side Effect:
             A read-only transaction object will be created in the transaction table,
             whose key is the corresponding transaction id.
         """
-        tid = arguments[1]
         if tid in self.transactions:
-            raise TransactionError("{} has already begun.".format(tid))
+            raise TransactionError("{} has already begun.".format(self.names.tid_name(tid)))
+        self.deadlock_victims.discard(tid)
         transaction = Transaction(tid, self.timestamp, True)
         self.transactions[tid] = transaction
-        print('Read-only transaction {} begins'.format(tid))
+        self.snapshot_timestamps[tid] = self.timestamp
+        self.output.emit('begin_ro', 'Read-only transaction {tid} begins', tid=self.names.tid_name(tid))
 
-    def end(self, arguments):
+    def end(self, tid: int):
         """Decide whether to commit or abort the given transaction.
         """
-        tid = arguments[1]
         trans: Transaction = self.transactions.get(tid)
         if not trans:
-            raise "Transaction {} doesn't exist.".format(tid)
-        if trans.is_abort:
-            self.abort(tid, True)
+            if self.skip_deadlock_victim(tid):
+                self.deadlock_victims.discard(tid)
+                return
+            raise TransactionError("Transaction {} doesn't exist.".format(self.names.tid_name(tid)))
+        if trans.is_abort or (self.coordinator is not None and not self.coordinator.prepare(trans)):
+            self.abort(tid, 'Site Failed')
+        elif trans.is_snapshot and self.has_write_conflict(trans):
+            self.abort(tid, 'Write Conflict')
         else:
+            if trans.writes:
+                self.install_writes(trans, self.timestamp)
             self.commit(tid, self.timestamp)
 
+    def has_write_conflict(self, trans: Transaction) -> bool:
+        """Check if a variable written by a snapshot transaction was written by another one that committed
+        after it began, in which case the first committer wins and this one has to abort.
+        """
+        write_times = self.write_times
+        return any(write_times.get(vid, -1) > trans.timestamp for vid in trans.writes)
+
+    def install_writes(self, trans: Transaction, commit_time: int) -> None:
+        """Write the values of a committing snapshot transaction to the sites, which commit them with it.
+
+        No other transaction holds a lock under snapshot isolation, so the
+        writes get the write locks right away.
+        """
+        tid = trans.tid
+        for vid, (value, sids) in trans.writes.items():
+            for sid in sids:
+                self.sites[sid - 1].write(tid, vid, value)
+            self.write_times[vid] = commit_time
+
     def snapshot_read(self, tid, vid):
         """Give the read-only transaction a snapshot value (if possible).
         """
         trans: Transaction = self.transactions.get(tid)
         if not trans:
-            raise TransactionError("Transaction {} doesn't exist.".format(tid))
+            raise TransactionError("Transaction {} doesn't exist.".format(self.names.tid_name(tid)))
         timestamp = trans.timestamp
-        for site in self.sites:
-            if site.is_up and site.has_variable(vid):
-                result_value = site.snapshot_read(vid, timestamp)
-                if result_value.is_success:
-                    print('Read-only transaction {} reads {}.{}: {}'.format(
-                        tid, vid, site.sid, result_value.value))
-                    return True
-        print('Read-only transaction {} failed to read {}: no suitable site.'.format(tid, vid))
+        for site in self.routing.get(vid).up_sites:
+            result_value = site.snapshot_read(vid, timestamp)
+            if result_value.is_success:
+                self.output.emit('read', 'Read-only transaction {tid} reads {vid}.{sid}: {value}',
+                                 tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=site.sid,
+                                 value=result_value.value)
+                return True
+        self.output.emit('read_failed', 'Read-only transaction {tid} failed to read {vid}: no suitable site.',
+                         tid=self.names.tid_name(tid), vid=self.names.vid_name(vid))
+        return False
+
+    def snapshot_isolation_read(self, tid, vid):
+        """Read a variable for a snapshot transaction, from its own writes or from the snapshot taken when it
+        began, without locks.
+        """
+        trans: Transaction = self.transactions.get(tid)
+        if not trans:
+            raise TransactionError("Transaction {} hasn't begun, read operation fails.".format(self.names.tid_name(tid)))
+        write = trans.writes.get(vid)
+        if write is not None:
+            value, sids = write
+            self.output.emit('read', 'Transaction {tid} reads {vid}.{sid}: {value}',
+                             tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=sids[0], value=value)
+            return True
+        for site in self.routing.get(vid).up_sites:
+            result_value = site.snapshot_read(vid, trans.timestamp)
+            if result_value.is_success:
+                self.output.emit('read', 'Transaction {tid} reads {vid}.{sid}: {value}',
+                                 tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=site.sid,
+                                 value=result_value.value)
+                return True
+        self.output.emit('read_failed', 'Transaction {tid} failed to read {vid}: no suitable site.',
+                         tid=self.names.tid_name(tid), vid=self.names.vid_name(vid))
         return False
 
     def add_read_operation(self, tid, vid):
-        """Add a read operation to queue.
+        """Add a read operation to the scheduler.
 
         Side Effect:
-            A normal read operation object will be appended to the queue.
+            A normal read operation object will be appended to the transaction's operations.
         """
         trans = self.transactions.get(tid)
         if not trans:
-            raise TransactionError("Transaction {} doesn't exist, can't add read operation.".format(tid))
-        self.operations.append(ReadOperation(tid, vid))
+            if self.skip_deadlock_victim(tid):
+                return
+            raise TransactionError("Transaction {} doesn't exist, can't add read operation.".format(
+                self.names.tid_name(tid)))
+        self.scheduler.add(ReadOperation(tid, vid))
 
     def add_write_operation(self, tid, vid, value):
-        """Add a write operation to queue.
+        """Add a write operation to the scheduler.
 
         Side Effect:
-            A write operation object will be appended to the queue.
+            A write operation object will be appended to the transaction's operations.
         """
         trans = self.transactions.get(tid)
         if not trans:
-            raise TransactionError("Transaction {} doesn't exist, can't add write operation.".format(tid))
-        self.operations.append(WriteOperation(tid, vid, value))
+            if self.skip_deadlock_victim(tid):
+                return
+            raise TransactionError("Transaction {} doesn't exist, can't add write operation.".format(
+                self.names.tid_name(tid)))
+        self.scheduler.add(WriteOperation(tid, vid, value))
 
     def read(self, tid, vid):
         """Execute the read operation of normal transactions(not read-only).
         """
         trans: Transaction = self.transactions.get(tid)
         if not trans:
-            raise TransactionError("Transaction {} hasn't begun, read operation fails.".format(tid))
-        for site in [x for x in self.sites if (x.is_up and x.has_variable(vid))]:
+            raise TransactionError("Transaction {} hasn't begun, read operation fails.".format(self.names.tid_name(tid)))
+        for site in self.routing.get(vid).up_sites:
+            trans.lock_sites.add(site.sid)
             result_value = site.read(tid, vid)
             if result_value.is_success:
-                trans.visited_sites.append(site.sid)
-                print('Transaction {} reads {}.{}: {}'.format(tid, vid, site.sid, result_value.value))
+                trans.visited_sites.setdefault(site.sid, site.incarnation)
+                self.output.emit('read', 'Transaction {tid} reads {vid}.{sid}: {value}',
+                                 tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), sid=site.sid,
+                                 value=result_value.value)
                 return True
         return False
 
@@ -199,92 +387,238 @@ class TransactionManager:
         """
         trans = self.transactions.get(tid)
         if not trans:
-            raise TransactionError("Transaction {} doesn't exist, write operation fails.".format(tid))
+            raise TransactionError("Transaction {} doesn't exist, write operation fails.".format(self.names.tid_name(tid)))
         target_sites = []
-        for site in [x for x in self.sites if (x.has_variable(vid) and x.is_up)]:
+        for site in self.routing.get(vid).up_sites:
             # If current site is up and has the certain vid, then try to get its write lock.
             # The write operation can only be applied when have all the write locks of up sites.
+            trans.lock_sites.add(site.sid)
             write_lock = site.get_write_lock(tid, vid)
             if not write_lock:
-                print("{} waits due to write lock conflict. Current lock : {}.".format(
-                    tid, site.lock_table[vid].current_lock))
+                self.output.emit('write_wait', '{tid} waits due to write lock conflict. Current lock : {lock}.',
+                                 tid=self.names.tid_name(tid),
+                                 lock=self.names.lock_name(site.lock_table[vid].current_lock))
                 return False
             target_sites.append(int(site.sid))
 
         # If no site satisfies the writing condition, then fail to write.
         if not target_sites:
-            print()
+            self.output.newline()
             return False
         # Otherwise, write to all the up sites that contains the vid.
+        visited_sites = self.transactions[tid].visited_sites
         for target_sid in target_sites:
             target_site = self.sites[target_sid - 1]
             target_site.write(tid, vid, value)
-            self.transactions[tid].visited_sites.append(target_sid)
-        print("Transaction {} writes variable {} with value {} to sites {}.".format(tid, vid, value, target_sites))
+            visited_sites.setdefault(target_sid, target_site.incarnation)
+        self.output.emit('write', 'Transaction {tid} writes variable {vid} with value {value} to sites {sites}.',
+                         tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), value=value, sites=target_sites)
+        return True
+
+    def snapshot_isolation_write(self, tid, vid, value) -> bool:
+        """Keep the value written by a snapshot transaction until it commits, without locks.
+
+        The value is written to the sites that are up now, and the transaction
+        aborts at the end if one of them fails before, as with the locks.
+        """
+        trans: Transaction = self.transactions.get(tid)
+        if not trans:
+            raise TransactionError("Transaction {} doesn't exist, write operation fails.".format(self.names.tid_name(tid)))
+        target_sites = [site.sid for site in self.routing.get(vid).up_sites]
+        # If no site satisfies the writing condition, then fail to write.
+        if not target_sites:
+            self.output.newline()
+            return False
+        for target_sid in target_sites:
+            trans.visited_sites.setdefault(target_sid, self.sites[target_sid - 1].incarnation)
+        trans.writes[vid] = (value, target_sites)
+        self.output.emit('write', 'Transaction {tid} writes variable {vid} with value {value} to sites {sites}.',
+                         tid=self.names.tid_name(tid), vid=self.names.vid_name(vid), value=value, sites=target_sites)
         return True
 
     def dump(self):
         """Show the data of all sites.
         """
-        print("Dump all sites:")
+        self.output.emit('dump', 'Dump all sites:')
         for site in self.sites:
             site.dump()
 
-    def fail(self, arguments):
+    def fail(self, sid: int):
         """Fail a site explicitly.
         """
-        sid = int(arguments[1])
         # site id starts from 1, while the index of self.sites starts from 0.
-        site = self.sites[sid - 1]
+        site = self.get_site(sid)
         if not site.is_up:
             raise TransactionError("Site {} is already down.".format(sid))
-        site.fail(sid)
-        print("Site {} fails.".format(sid))
+        site.fail(self.timestamp)
+        self.routing.update_site(sid)
+        self.output.emit('fail', 'Site {sid} fails.', sid=sid)
+        if self.coordinator is not None:
+            # The sites the transactions visited vote against their commit instead.
+            return
         for trans in self.transactions.values():
             if trans.is_ro or trans.is_abort or (sid not in trans.visited_sites):
                 continue
             else:
                 trans.is_abort = True
 
-    def recover(self, arguments):
+    def recover(self, sid: int):
         """Recover a site explicitly.
         """
-        sid = int(arguments[1])
-        site = self.sites[sid - 1]
+        site = self.get_site(sid)
         if site.is_up:
-            print("Site {} is up, no need to recover.".format(sid))
+            self.output.emit('recover_skipped', 'Site {sid} is up, no need to recover.', sid=sid)
             return
         site.recover(self.timestamp)
-        print("Site {} recovers.".format(sid))
+        self.routing.update_site(sid)
+        self.output.emit('recover', 'Site {sid} recovers.', sid=sid)
 
-    def abort(self, tid: str, site_fail=False):
+    def get_site(self, sid: int):
+        if not 1 <= sid <= len(self.sites):
+            raise TransactionError("Site {} doesn't exist.".format(sid))
+        return self.sites[sid - 1]
+
+    def abort_transactions(self, tids, reason: str) -> bool:
+        """Abort the given transactions that still exist, like those of a client that
+        disconnected, and return whether there was any.
+        """
+        has_aborted = False
+        for tid in tids:
+            if tid in self.transactions:
+                self.abort(tid, reason)
+                has_aborted = True
+        if has_aborted and self.coordinator is not None:
+            self.send_decisions()
+        return has_aborted
+
+    def abort(self, tid: int, reason='Deadlock'):
         """Abort a transaction.
         """
-        for site in self.sites:
-            site.abort(tid)
+        if self.coordinator is not None:
+            self.coordinator.decide(self.transactions[tid])
+        else:
+            for site in self.sites:
+                site.abort(tid)
         del self.transactions[tid]
-        abort_reason = 'Site Failed' if site_fail else 'Deadlock'
-        print('{} aborts. [{}]'.format(tid, abort_reason))
+        self.end_snapshot(tid)
+        self.output.emit('abort', '{tid} aborts. [{reason}]', tid=self.names.tid_name(tid), reason=reason)
         # Delete all the operations invoked by the aborted transaction.
-        for operation in list(self.operations):
-            if operation.tid == tid:
-                self.operations.remove(operation)
+        self.scheduler.remove_transaction(tid)
 
     def commit(self, tid, commit_time):
         """Commit a transaction, and output its commit time.
         """
-        for site in self.sites:
-            site.commit(tid, commit_time)
+        watermark = self.version_watermark()
+        if self.coordinator is not None:
+            self.coordinator.decide(self.transactions[tid], commit_time, watermark)
+        else:
+            for site in self.sites:
+                site.commit(tid, commit_time, watermark)
         self.transactions.pop(tid)
-        print("{} commits at time {}.".format(tid, commit_time))
+        self.end_snapshot(tid)
+        self.output.emit('commit', '{tid} commits at time {time}.', tid=self.names.tid_name(tid), time=commit_time)
+
+    def version_watermark(self) -> int:
+        """
+        The oldest snapshot that may still be read, which is the begin time of the
+        oldest active read-only or snapshot transaction, or the current time if there's none.
+        Older versions of the variables can be garbage collected.
+        """
+        for timestamp in self.snapshot_timestamps.values():
+            return timestamp
+        return self.timestamp
+
+    def end_snapshot(self, tid) -> None:
+        """Forget an ended read-only or snapshot transaction, collect garbage if it was the oldest one.
+        """
+        if tid not in self.snapshot_timestamps:
+            return
+        is_oldest = next(iter(self.snapshot_timestamps)) == tid
+        del self.snapshot_timestamps[tid]
+        if is_oldest:
+            self.collect_garbage()
+
+    def collect_garbage(self) -> int:
+        """Drop the versions of all sites that can't be read anymore, return the number of dropped versions.
+        """
+        watermark = self.version_watermark()
+        return sum(site.collect_garbage(watermark) for site in self.sites)
+
+    def version_statistics(self) -> dict:
+        """Report the number of stored versions and their estimated memory use over all sites.
+        """
+        statistics = defaultdict(int)
+        for site in self.sites:
+            for key, value in site.version_statistics().items():
+                statistics[key] += value
+        return dict(statistics)
+
+    def send_decisions(self) -> None:
+        """Send the commit and abort decisions of the two-phase commit made since the last call to the sites.
+
+        The sites in worker processes apply them before the manager goes on, as
+        the released locks may wake operations and remove wait-for edges.
+        """
+        self.coordinator.flush()
+        if self.processes is not None:
+            self.processes.drain()
 
     def detect_deadlock(self) -> bool:
-        """Detect if there is a deadlock among existing transactions.
+        """Detect and solve all the deadlocks among existing transactions.
+
+        The wait-for graph is maintained by the lock managers, so the check
+        is skipped unless new edges were inserted since the last clean check.
+        The youngest transaction of every deadlock is aborted, which may grant
+        locks to other transactions and lead to new edges, so the check is
+        repeated until the graph is free of cycles.
+
+        If the deadlocks are prevented instead, the victims chosen by the
+        prevention policy since the last call are aborted.
         """
-        blocking_graph = generate_blocking_graph(self.sites)
-        victim = detect(self.transactions, blocking_graph)
-        if victim is not None:
-            print("Found deadlock, aborts the youngest transaction {}".format(victim))
-            self.abort(victim)
-            return True
-        return False
+        if self.prevention is not None:
+            return self.abort_prevention_victims()
+        has_deadlock = False
+        while self.wait_for_graph.has_new_edge():
+            victims = detect(self.transactions, self.wait_for_graph.graph,
+                             list(self.wait_for_graph.new_edge_waiters))
+            if not victims:
+                self.wait_for_graph.clear_new_edges()
+                break
+            for victim in victims:
+                self.output.emit('deadlock', 'Found deadlock, aborts the youngest transaction {tid}',
+                                 tid=self.names.tid_name(victim))
+                self.abort(victim)
+                self.deadlock_victims.add(victim)
+            if self.coordinator is not None:
+                self.send_decisions()
+            has_deadlock = True
+        return has_deadlock
+
+    def skip_deadlock_victim(self, tid: int) -> bool:
+        """Tell that a command of a transaction aborted to solve or prevent a deadlock is skipped,
+        return False if the transaction wasn't aborted for a deadlock.
+
+        The client of the transaction learns about the abort from the output only,
+        so its commands that were already sent still arrive.
+        """
+        if tid not in self.deadlock_victims:
+            return False
+        self.output.emit('skip', '{tid} has already aborted, skips the command.', tid=self.names.tid_name(tid))
+        return True
+
+    def abort_prevention_victims(self) -> bool:
+        """Abort the transactions the deadlock prevention policy chose, return whether there was any.
+        """
+        has_victim = False
+        for victim in self.prevention.take_victims():
+            if victim not in self.transactions:
+                # The transaction ended before its turn.
+                continue
+            self.output.emit('prevention', 'Prevents a deadlock with {policy}, aborts the younger transaction {tid}',
+                             policy=self.prevention.policy, tid=self.names.tid_name(victim))
+            self.abort(victim, 'Deadlock Prevention')
+            self.deadlock_victims.add(victim)
+            has_victim = True
+        if has_victim and self.coordinator is not None:
+            self.send_decisions()
+        return has_victim
@@ -0,0 +1,228 @@
+import json
+import time
+from collections import Counter
+from functools import wraps
+
+from transaction.manager import TransactionManager
+
+# The methods that are timed, on the transaction manager and on every site.
+TIMED_MANAGER_METHODS = ('detect_deadlock', 'execute_operations', 'commit', 'abort')
+TIMED_SITE_METHODS = ('read', 'get_write_lock', 'commit', 'abort', 'prepare', 'decide', 'update_lock_table')
+
+
+class Timer:
+    """The number of calls of a method and the time spent in them.
+
+    The timed methods call each other, a site commit updates its lock table
+    and the manager commit calls the site commits. `seconds` is the self time,
+    without the time spent in the nested timed calls, so the timers can be
+    summed. `inclusive_seconds` and `max_seconds` count the whole calls.
+    """
+    __slots__ = ('calls', 'seconds', 'inclusive_seconds', 'max_seconds')
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.seconds = 0.0
+        self.inclusive_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'inclusive_seconds': self.inclusive_seconds,
+            'mean_us': self.seconds / self.calls * 1e6 if self.calls else 0,
+            'max_us': self.max_seconds * 1e6,
+        }
+
+
+class Metrics:
+    """Counters, timers and gauges of a transaction manager and its sites.
+
+    Nothing is measured unless a manager is instrumented: the timed methods
+    are wrapped on the instances only, so a manager without metrics runs the
+    plain methods. The gauges (queued locks, wait-for graph, versions) are
+    read from the engine when a snapshot is taken, and the lock wait time is
+    the number of ticks from the issue of an operation to its completion.
+
+    If a stream is given, a snapshot is written to it as a JSON line every
+    `interval` ticks, and when the metrics are closed.
+    """
+    def __init__(self, manager: TransactionManager, stream=None, interval: int = 0, name: str = None) -> None:
+        self.manager = manager
+        self.stream = stream
+        self.interval = interval
+        self.name = name
+        self.timers = {}  # method name -> Timer
+        self.nested_seconds = []  # time spent in the nested timed calls, for every timed call in progress
+        self.lock_waits = Counter()  # ticks waited -> number of operations
+        self.issue_times = {}  # operation -> tick it was issued, while it's not completed
+
+        for method_name in TIMED_MANAGER_METHODS:
+            self.wrap(manager, 'TransactionManager', method_name)
+        for site in manager.sites:
+            for method_name in TIMED_SITE_METHODS:
+                self.wrap(site, 'DataManager', method_name)
+        self.wrap_scheduler(manager.scheduler)
+        if stream is not None and interval > 0:
+            self.wrap_tick(manager)
+        manager.metrics = self
+
+    def wrap(self, instance, class_name: str, method_name: str) -> None:
+        """Replace the method of the instance by a timed one, the timer is shared by all the instances.
+        """
+        name = '{}.{}'.format(class_name, method_name)
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        method = getattr(instance, method_name)
+        perf_counter = time.perf_counter
+        nested_seconds = self.nested_seconds
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            nested_seconds.append(0.0)
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                nested = nested_seconds.pop()
+                if nested_seconds:
+                    nested_seconds[-1] += elapsed
+                timer.calls += 1
+                timer.seconds += elapsed - nested
+                timer.inclusive_seconds += elapsed
+                if elapsed > timer.max_seconds:
+                    timer.max_seconds = elapsed
+
+        setattr(instance, method_name, timed)
+
+    def wrap_scheduler(self, scheduler) -> None:
+        """Note when the operations are issued and completed, to measure how long they wait for their locks.
+        """
+        manager = self.manager
+        issue_times = self.issue_times
+        lock_waits = self.lock_waits
+        add, complete, remove_transaction = scheduler.add, scheduler.complete, scheduler.remove_transaction
+
+        def timed_add(operation) -> None:
+            issue_times[operation] = manager.timestamp
+            add(operation)
+
+        def timed_complete(operation) -> None:
+            issue_time = issue_times.pop(operation, None)
+            if issue_time is not None:
+                lock_waits[manager.timestamp - issue_time] += 1
+            complete(operation)
+
+        def timed_remove_transaction(tid) -> None:
+            for operation in scheduler.pending.get(tid, ()):
+                issue_times.pop(operation, None)
+            remove_transaction(tid)
+
+        scheduler.add = timed_add
+        scheduler.complete = timed_complete
+        scheduler.remove_transaction = timed_remove_transaction
+
+    def wrap_tick(self, manager: TransactionManager) -> None:
+        """Dump a snapshot every `interval` ticks, whether the commands come one by one or in a batch.
+        """
+        tick, process_batch = manager.tick, manager.process_batch
+        interval = self.interval
+        dumped_time = None
+
+        def dump_on_interval() -> None:
+            nonlocal dumped_time
+            if manager.timestamp % interval == 0 and manager.timestamp != dumped_time:
+                dumped_time = manager.timestamp
+                self.dump()
+
+        @wraps(tick)
+        def dumping_tick(command) -> None:
+            tick(command)
+            dump_on_interval()
+
+        def dumping_commands(commands):
+            # The next command is only pulled once the tick of the previous one is over.
+            for command in commands:
+                yield command
+                dump_on_interval()
+
+        @wraps(process_batch)
+        def dumping_batch(commands) -> None:
+            process_batch(dumping_commands(commands))
+
+        manager.tick = dumping_tick
+        manager.process_batch = dumping_batch
+
+    def snapshot(self) -> dict:
+        """Return the current values of all the metrics.
+        """
+        manager = self.manager
+        queued_locks = Counter()
+        for site in manager.sites:
+            for vid, lock_manager in site.lock_table.items():
+                if len(lock_manager.lock_queue) > 0:
+                    queued_locks[manager.names.vid_name(vid)] += len(lock_manager.lock_queue)
+        version_lengths = [len(v.commit_value_list) for site in manager.sites for v in site.data.values()]
+        graph = manager.wait_for_graph.graph
+
+        return {
+            'name': self.name,
+            'time': manager.timestamp,
+            'timers': {name: timer.to_dict() for name, timer in self.timers.items()},
+            'gauges': {
+                'active_transactions': len(manager.transactions),
+                'waiting_operations': sum(len(queue) for queue in manager.scheduler.pending.values()),
+                'queued_locks': {
+                    'total': sum(queued_locks.values()),
+                    'max': max(queued_locks.values(), default=0),
+                    'by_variable': dict(queued_locks.most_common()),
+                },
+                'blocking_graph': {
+                    'transactions': len(graph),
+                    'edges': sum(len(holders) for holders in graph.values()),
+                },
+                'versions': {
+                    'total': sum(version_lengths),
+                    'max': max(version_lengths, default=0),
+                    'mean': sum(version_lengths) / len(version_lengths) if version_lengths else 0,
+                },
+            },
+            'lock_wait_ticks': self.lock_wait_statistics(),
+        }
+
+    def lock_wait_statistics(self) -> dict:
+        """Summarize the number of ticks the completed operations waited.
+        """
+        count = sum(self.lock_waits.values())
+        statistics = {'count': count, 'mean': 0, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+        if count == 0:
+            return statistics
+        statistics['mean'] = sum(ticks * n for ticks, n in self.lock_waits.items()) / count
+        waits = sorted(self.lock_waits.items())
+        for key, p in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+            # The quantile is the first value whose cumulative count reaches it.
+            rank = min(count - 1, int(p * count))
+            seen = 0
+            for ticks, n in waits:
+                seen += n
+                if seen > rank:
+                    statistics[key] = ticks
+                    break
+        statistics['max'] = waits[-1][0]
+        return statistics
+
+    def dump(self) -> None:
+        """Write a snapshot to the stream as a JSON line.
+        """
+        if self.stream is not None:
+            self.stream.write(json.dumps(self.snapshot()) + '\n')
+            self.stream.flush()
+
+    def close(self) -> None:
+        """Write the last snapshot, and stop being attached to the manager.
+        """
+        self.dump()
+        self.manager.metrics = None
@@ -7,18 +7,27 @@ class OperationType(Enum):
 
 
 class Operation:
-    def __init__(self, operation_type: OperationType, tid: str, vid: str):
+    __slots__ = ('operation_type', 'tid', 'vid', 'seq', 'is_ready', 'parked_on')
+
+    def __init__(self, operation_type: OperationType, tid: int, vid: int):
         self.operation_type = operation_type
         self.tid = tid
         self.vid = vid
+        self.seq = None  # the order in which the operation was issued
+        self.is_ready = False  # whether the operation is waiting to be executed
+        self.parked_on = ()  # lock managers the operation is parked on
 
 
 class ReadOperation(Operation):
-    def __init__(self, tid: str, vid: str):
+    __slots__ = ()
+
+    def __init__(self, tid: int, vid: int):
         super(ReadOperation, self).__init__(OperationType.R, tid, vid)
 
 
 class WriteOperation(Operation):
-    def __init__(self, tid: str, vid: str, value):
+    __slots__ = ('value',)
+
+    def __init__(self, tid: int, vid: int, value):
         super(WriteOperation, self).__init__(OperationType.W, tid, vid)
         self.value = value
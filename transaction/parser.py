@@ -1,33 +1,174 @@
 import re
+from collections import namedtuple
+from functools import partial
+from enum import Enum
 
+from data.names import NameTable
 from errors import ParseError
 
 
+class Opcode(Enum):
+    BEGIN = 'begin'
+    BEGIN_RO = 'beginRO'
+    END = 'end'
+    W = 'W'
+    R = 'R'
+    DUMP = 'dump'
+    FAIL = 'fail'
+    RECOVER = 'recover'
+
+
+# A parsed command. The transaction and the variable are integer ids, the value
+# is the written value, or the site id for `fail` and `recover`. Unused fields are None.
+Command = namedtuple('Command', ['opcode', 'tid', 'vid', 'value'])
+
+# The arguments of each command, in order.
+TID, VID, VALUE, SITE = 'transaction', 'variable', 'value', 'site'
+GRAMMAR = {
+    'begin': (Opcode.BEGIN, (TID,)),
+    'beginRO': (Opcode.BEGIN_RO, (TID,)),
+    'end': (Opcode.END, (TID,)),
+    'W': (Opcode.W, (TID, VID, VALUE)),
+    'R': (Opcode.R, (TID, VID)),
+    'dump': (Opcode.DUMP, ()),
+    'fail': (Opcode.FAIL, (SITE,)),
+    'recover': (Opcode.RECOVER, (SITE,)),
+}
+ARGUMENT = re.compile(r'[^\s,]+')
+
+# A well-formed line in one match, `lastindex` tells which command it is:
+# 3 for W, 5 for R, 7 for begin, beginRO and end, 9 for fail and recover, 10 for dump.
+FAST_LINE = re.compile(r'\s*(?:'
+                       r'W\s*\(\s*(\w+)[\s,]+x(\d+)[\s,]+(-?\d+)'
+                       r'|R\s*\(\s*(\w+)[\s,]+x(\d+)'
+                       r'|(begin|beginRO|end)\s*\(\s*(\w+)'
+                       r'|(fail|recover)\s*\(\s*(\d+)'
+                       r'|(dump)\s*\('
+                       r')\s*\)\s*(?://.*)?$')
+OPCODES = {name: opcode for name, (opcode, _) in GRAMMAR.items()}
+# Build a command without the keyword handling of `Command.__new__`, it is the hot path of parsing.
+new_command = partial(tuple.__new__, Command)
+
+
 class Parser:
-    def __init__(self):
-        self.commands = {
-            'begin', 'end', 'W', 'R',
-            'dump', 'beginRO', 'fail', 'recover'
-        }
+    def __init__(self, names: NameTable = None):
+        self.commands = set(GRAMMAR)
         self.is_hint = False
+        self.line_number = 0  # number of the last parsed line, used in the error messages
+        self.names = names if names is not None else NameTable()  # can be shared by the parsers of one manager
 
     def parse(self, line: str):
-        """Parse the given input.
+        """Parse the given input line into a `Command`.
 
         According to the format of the test files, the parser should
         also identify the comments and annotations. The `//` and the `===`
-        should be the identifiers.
+        should be the identifiers. None is returned for the lines without
+        a command.
+
+        The transaction and variable names are translated to integer ids
+        here, and site ids and values are converted to integers.
         """
-        if self.is_hint:
-            return
-        line = line.split('//')[0].strip()
-        if line != '':
-            if line.startswith('==='):
-                self.is_hint = True
+        for command in self.parse_lines((line,)):
+            return command
+
+    def parse_lines(self, lines):
+        """Yield the commands of an iterable of lines, skipping the lines without a command.
+
+        Well-formed lines are parsed with a single match of a precompiled
+        pattern. The others, such as blank lines, comments and errors, go
+        through `parse_checked`.
+        """
+        match = FAST_LINE.match
+        tids = self.names.tids
+        for line in lines:
+            self.line_number += 1
+            if self.is_hint:
                 return
-            res = re.findall(r'\w+', line)
-            cmd = res[0]
-            if cmd not in self.commands:
-                raise ParseError(
-                    "Unknown command {}, the valid commands are {}, please check".format(cmd, self.commands))
-            return res
+            m = match(line)
+            if m is None:
+                command = self.parse_checked(line)
+                if command is not None:
+                    yield command
+                continue
+            group = m.lastindex
+            if group == 9:
+                name, sid = m.group(8, 9)
+                yield new_command((OPCODES[name], None, None, int(sid)))
+                continue
+            if group == 10:
+                yield new_command((Opcode.DUMP, None, None, None))
+                continue
+            if group == 3:
+                opcode, (name, vid, value) = Opcode.W, m.group(1, 2, 3)
+            elif group == 5:
+                opcode, (name, vid), value = Opcode.R, m.group(4, 5), None
+            else:
+                (opcode, name), vid, value = m.group(6, 7), None, None
+                opcode = OPCODES[opcode]
+            tid = tids.get(name)
+            if tid is None:
+                tid = self.names.tid(name)
+            yield new_command((opcode, tid, None if vid is None else int(vid), None if value is None else int(value)))
+
+    def parse_checked(self, line: str):
+        """Parse the line by splitting it step by step, so that errors report their line and column.
+        """
+        comment = line.find('//')
+        if comment >= 0:
+            line = line[:comment]
+        line = line.rstrip()
+        if not line:
+            return
+        start = len(line) - len(line.lstrip())
+        if line.startswith('===', start):
+            self.is_hint = True
+            return
+
+        left = line.find('(')
+        if left < 0:
+            self.error('Expected "(" after the command', len(line))
+        right = line.find(')', left)
+        if right < 0:
+            self.error('Expected ")" at the end of the command', len(line))
+        if right != len(line) - 1:
+            self.error('Unexpected text after ")"', right + 1)
+        name = line[start:left].rstrip()
+        if name not in GRAMMAR:
+            self.error('Unknown command {}, the valid commands are {}'.format(name, self.commands), start)
+        opcode, kinds = GRAMMAR[name]
+
+        # Arguments are separated by commas or spaces, as `W(T1 x1, 5)` was always accepted.
+        tokens = ARGUMENT.findall(line, left + 1, right)
+        if len(tokens) != len(kinds):
+            self.error('{} expects {} argument(s): {}'.format(name, len(kinds), ', '.join(kinds)), left + 1)
+        tid = vid = value = None
+        column = left + 1
+        for kind, token in zip(kinds, tokens):
+            token_column = column = line.index(token, column)
+            column += len(token)
+            if kind == TID:
+                if not token.replace('_', '').isalnum():
+                    self.error('Invalid transaction name "{}"'.format(token), token_column)
+                tid = self.names.tid(token)
+            elif kind == VID:
+                if len(token) < 2 or token[0] != 'x' or not token[1:].isdigit():
+                    self.error('Invalid variable "{}", variables should be named x1, x2, ...'.format(token),
+                               token_column)
+                vid = int(token[1:])
+            else:
+                try:
+                    value = int(token)
+                except ValueError:
+                    self.error('Invalid {} "{}", it should be an integer'.format(kind, token), token_column)
+        return Command(opcode, tid, vid, value)
+
+    def error(self, message: str, index: int) -> None:
+        """Raise a parse error at the given index of the current line.
+        """
+        raise ParseError(message, self.line_number, index + 1)
+
+    def parse_file(self, path: str, buffer_size: int = 1 << 20):
+        """Stream the commands of a file, which is read through a large buffer.
+        """
+        with open(path, 'r', buffering=buffer_size) as f:
+            yield from self.parse_lines(f)
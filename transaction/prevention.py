@@ -0,0 +1,48 @@
+from typing import Iterable
+
+# The ways the deadlocks are handled: detected in the wait-for graph, or prevented with the timestamps.
+DEADLOCK_POLICIES = ('detect', 'wait-die', 'wound-wait')
+
+
+class DeadlockPrevention:
+    """Prevent the deadlocks with the timestamps of the transactions, instead of detecting them.
+
+    Before a lock manager queues a blocked lock, it asks whether the requester
+    may wait for the transactions holding or queuing the conflicting locks:
+    (1) wait-die: an older requester waits, a younger one dies.
+    (2) wound-wait: an older requester wounds the younger transactions and
+        waits for them to abort, a younger one waits.
+    Every transaction only waits for younger ones with wait-die, and for older
+    ones with wound-wait, so no cycle of waits can form and no wait-for graph
+    is needed. The lock managers ask again every time a queued transaction
+    retries, as the transactions it waits for may have changed.
+
+    The victims are aborted by the transaction manager at the start of the
+    next tick, where the deadlocks are detected otherwise.
+    """
+    def __init__(self, policy: str, transactions: dict) -> None:
+        self.policy = policy
+        self.is_wound_wait = policy == 'wound-wait'
+        self.transactions = transactions  # tid -> Transaction of the transaction manager
+        self.victims = {}  # tids to abort at the start of the next tick, used as an ordered set
+
+    def can_wait(self, tid: int, holders: Iterable[int]) -> bool:
+        """Decide whether a transaction may wait for the given ones, and mark the transactions to abort.
+        """
+        transactions = self.transactions
+        timestamp = transactions[tid].timestamp
+        if self.is_wound_wait:
+            for holder in holders:
+                if transactions[holder].timestamp > timestamp:
+                    self.victims[holder] = None
+            return True
+        for holder in holders:
+            if transactions[holder].timestamp < timestamp:
+                self.victims[tid] = None
+                return False
+        return True
+
+    def take_victims(self) -> list:
+        victims = list(self.victims)
+        self.victims.clear()
+        return victims
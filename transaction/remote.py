@@ -0,0 +1,287 @@
+import multiprocessing
+
+from data.manager import DataManager, LazyTable
+from data.names import NameTable
+from data.topology import Topology
+from data.wal import GroupCommit
+from data.worker import run_site
+from output import Sink
+
+
+class LockSpot:
+    """Where the operations waiting for a variable of a remote site are parked.
+
+    The locks themselves are kept by the worker process. Only the current lock
+    reported by the last write lock request is known here, for the waiting
+    message of the transaction manager.
+    """
+    __slots__ = ('vid', 'waiting_operations', 'current_lock')
+
+    def __init__(self, vid: int) -> None:
+        self.vid = vid
+        self.waiting_operations = set()
+        self.current_lock = None
+
+
+class DrainingSink(Sink):
+    """The sink of a transaction manager whose sites run in worker processes.
+
+    Before anything is output, the pending requests are sent to the sites and
+    the effects of their replies are applied, so the output keeps the order
+    it has when the sites run in the same process.
+    """
+    def __init__(self, sink: Sink, processes) -> None:
+        self.sink = sink
+        self.processes = processes
+
+    def emit(self, event: str, template: str, **fields) -> None:
+        self.processes.drain()
+        self.sink.emit(event, template, **fields)
+
+    def newline(self) -> None:
+        self.processes.drain()
+        self.sink.newline()
+
+    def flush(self) -> None:
+        self.processes.drain()
+        self.sink.flush()
+
+    def close(self) -> None:
+        self.processes.drain()
+        self.sink.close()
+
+
+class SiteProcesses:
+    """Run the sites of a transaction manager in worker processes, see `data.worker`.
+
+    The requests whose results the transaction manager doesn't need right away
+    (writes, commits, aborts, dumps and log syncs) are kept by each site, and
+    sent in a single message per site when the manager needs a result or
+    outputs something. Reads and lock requests, whose results decide what the
+    manager does next, are sent together with the pending requests of all the
+    sites. Every request has a sequence number, and the effects of the replies
+    (output, wait-for edges, woken operations and dirty logs) are applied in
+    that order, so the engine behaves exactly as with the sites in process.
+
+    A failed site stops its worker, and its stable state is kept in the
+    manager's process until it recovers in a new worker.
+    """
+    def __init__(self, topology: Topology, names: NameTable, output: Sink, wait_for_graph, scheduler,
+                 group_commit: GroupCommit = None, log_dir: str = None) -> None:
+        self.topology = topology
+        self.names = names
+        self.output = output  # where the effects of the sites are output
+        self.sink = DrainingSink(output, self)  # where the transaction manager and the down sites output
+        self.wait_for_graph = wait_for_graph
+        self.scheduler = scheduler
+        self.group_commit = group_commit
+        self.log_dir = log_dir
+        self.next_seq = 0
+        self.pending_sites = {}  # sites with requests that are not sent yet, used as an ordered set
+        self.sites = [RemoteSite(sid, self) for sid in topology.site_ids()]
+
+    def post(self, site, method_name: str, args: tuple) -> int:
+        """Keep a request to be sent with the next batch of the site, return its sequence number.
+        """
+        seq = self.next_seq
+        self.next_seq += 1
+        site.pending.append((seq, method_name, args))
+        self.pending_sites[site] = None
+        return seq
+
+    def drain(self, seq: int = None):
+        """Send the pending requests of all the sites and apply the effects of the replies.
+
+        Return the result of the request with the given sequence number.
+        """
+        if not self.pending_sites:
+            return None
+        sites = list(self.pending_sites)
+        self.pending_sites.clear()
+        # All the batches are sent before any reply is read, so the workers run them in parallel.
+        for site in sites:
+            site.send_pending()
+        replies = []
+        for site in sites:
+            replies.extend((reply, site) for reply in site.connection.recv())
+        replies.sort(key=lambda x: x[0][0])
+
+        result = None
+        error = None
+        for (request_seq, is_error, value, effects), site in replies:
+            self.apply(site, effects)
+            if is_error:
+                error_type, message = value
+                value = error_type(message)
+                if error is None or request_seq == seq:
+                    error = value
+            if request_seq == seq:
+                result = value
+        if error is not None:
+            raise error
+        return result
+
+    def apply(self, site, effects: list) -> None:
+        """Do what the site did in its worker process, as if it ran in this one.
+        """
+        for effect in effects:
+            kind = effect[0]
+            if kind == 'emit':
+                self.output.emit(effect[1], effect[2], **effect[3])
+            elif kind == 'add_edge':
+                self.wait_for_graph.add_edge(effect[1], effect[2])
+            elif kind == 'remove_edge':
+                self.wait_for_graph.remove_edge(effect[1], effect[2])
+            elif kind == 'wake':
+                spot = site.lock_table.get(effect[1])
+                if spot is not None:
+                    for operation in list(spot.waiting_operations):
+                        self.scheduler.wake(operation)
+            elif kind == 'mark':
+                self.group_commit.mark(site)
+            else:
+                self.output.newline()
+
+    def close(self) -> None:
+        """Send the pending requests, then stop the workers of the sites that are up.
+        """
+        self.drain()
+        for site in self.sites:
+            if site.is_up:
+                site.stop()
+
+
+class RemoteSite:
+    """A site whose data and lock tables are in a worker process.
+
+    It has the methods of `DataManager` that the transaction manager calls.
+    When the site is down, its worker is stopped, and the calls go to a
+    `DataManager` holding the stable state of the site in this process.
+    """
+    def __init__(self, sid: int, processes: SiteProcesses) -> None:
+        self.sid = sid
+        self.processes = processes
+        self.is_up = True
+        self.lock_table = LazyTable(LockSpot)  # vid -> where the operations waiting for the variable are parked
+        self.pending = []  # (seq, method name, args) to be sent with the next batch
+        self.down_site = None  # the stable state of the site while it is down
+        self.connection = None
+        self.process = None
+        self.known_names = 0  # number of transaction names the worker knows
+        self.incarnation = 0  # number of failures of the site, as counted by the worker
+        self.start()
+
+    def start(self, state: tuple = None) -> None:
+        self.connection, connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=run_site, args=(connection, self.sid, self.processes.topology, self.processes.log_dir, state),
+            daemon=True)
+        self.process.start()
+        connection.close()
+        self.known_names = 0
+
+    def stop(self) -> tuple:
+        """Stop the worker, return the stable state of the site.
+        """
+        self.connection.send(([], []))
+        state = self.connection.recv()
+        self.process.join()
+        self.connection.close()
+        self.connection = None
+        self.process = None
+        return state
+
+    def send_pending(self) -> None:
+        tid_names = self.processes.names.tid_names
+        self.connection.send((tid_names[self.known_names:], self.pending))
+        self.known_names = len(tid_names)
+        self.pending = []
+
+    def call(self, method_name: str, *args):
+        """Run a method of the site and return its result, the pending requests of all sites are sent first.
+        """
+        if not self.is_up:
+            return getattr(self.down_site, method_name)(*args)
+        return self.processes.drain(self.processes.post(self, method_name, args))
+
+    def post(self, method_name: str, *args) -> None:
+        """Run a method of the site whose result isn't needed, in the next batch.
+        """
+        if not self.is_up:
+            getattr(self.down_site, method_name)(*args)
+        else:
+            self.processes.post(self, method_name, args)
+
+    def wake_waiting_operations(self) -> None:
+        for spot in self.lock_table.values():
+            for operation in list(spot.waiting_operations):
+                self.processes.scheduler.wake(operation)
+
+    def snapshot_read(self, vid: int, timestamp: int):
+        return self.call('snapshot_read', vid, timestamp)
+
+    def read(self, tid: int, vid: int):
+        return self.call('read', tid, vid)
+
+    def get_write_lock(self, tid: int, vid: int) -> bool:
+        is_granted, self.lock_table[vid].current_lock = self.call('request_write_lock', tid, vid)
+        return is_granted
+
+    def write(self, tid: int, vid: int, value) -> None:
+        self.post('write', tid, vid, value)
+
+    def dump(self) -> None:
+        self.post('dump')
+
+    def commit(self, tid: int, commit_time: int, watermark: int = None) -> None:
+        self.post('commit', tid, commit_time, watermark)
+
+    def abort(self, tid: int) -> None:
+        self.post('abort', tid)
+
+    def prepare(self, tid: int, incarnation: int) -> bool:
+        return self.call('prepare', tid, incarnation)
+
+    def decide(self, decisions: list) -> None:
+        self.post('decide', decisions)
+
+    def flush(self) -> None:
+        """Sync the log of the site, called by the group commit.
+        """
+        self.post('flush_log')
+
+    def committed_values(self) -> dict:
+        return self.call('committed_values')
+
+    def collect_garbage(self, watermark: int) -> int:
+        return self.call('collect_garbage', watermark)
+
+    def version_statistics(self) -> dict:
+        return self.call('version_statistics')
+
+    def last_commit_time(self) -> int:
+        return self.call('last_commit_time')
+
+    def generate_blocking_graph(self):
+        return self.call('generate_blocking_graph')
+
+    def fail(self, timestamp: int) -> None:
+        """Fail the site in its worker, then stop the worker and keep the stable state of the site.
+        """
+        self.call('fail', timestamp)
+        self.down_site = DataManager(self.sid, self.processes.topology, names=self.processes.names,
+                                     output=self.processes.sink)
+        self.down_site.load_stable_state(self.stop())
+        self.down_site.is_up = False
+        self.is_up = False
+        self.incarnation += 1
+        self.wake_waiting_operations()
+
+    def recover(self, timestamp: int) -> None:
+        """Start a new worker with the stable state of the site, and recover the site in it.
+        """
+        self.start(self.down_site.stable_state())
+        self.down_site = None
+        self.is_up = True
+        self.call('recover', timestamp)
+        self.wake_waiting_operations()
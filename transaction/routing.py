@@ -0,0 +1,58 @@
+from typing import List
+
+from data.manager import DataManager
+from data.topology import Topology
+
+
+class Route:
+    """The sites holding a group of variables.
+
+    Variables that are held by the same sites share the same route, and
+    `up_sites` is kept up to date when one of these sites fails or recovers.
+    """
+
+    def __init__(self, sites: tuple) -> None:
+        self.sites = sites  # all the sites holding the variables, in site id order
+        self.up_sites = tuple(site for site in sites if site.is_up)
+
+    def update(self) -> None:
+        self.up_sites = tuple(site for site in self.sites if site.is_up)
+
+
+class RoutingTable:
+    """Map each variable to the sites holding it.
+
+    The route of a variable is built the first time it is asked for and then
+    kept, so finding the replicas of a variable doesn't need to ask every
+    site, and the variables that are never accessed cost nothing at startup.
+    Variables held by the same sites share their route, found by the tuple of
+    their site ids.
+    """
+
+    def __init__(self, topology: Topology, sites: List[DataManager]) -> None:
+        self.topology = topology
+        self.sites = sites
+        self.routes = [None] * (topology.variable_count + 1)  # vid -> route, variables start from 1
+        self.routes_by_sids = {}  # tuple of sids -> route
+        self.site_routes = {site.sid: [] for site in sites}  # sid -> routes that contain the site
+        self.no_route = Route(())
+
+    def get(self, vid: int) -> Route:
+        if not 0 < vid < len(self.routes):
+            return self.no_route
+        route = self.routes[vid]
+        if route is None:
+            sids = self.topology.replication.sites_of(vid)
+            route = self.routes_by_sids.get(sids)
+            if route is None:
+                route = self.routes_by_sids[sids] = Route(tuple(self.sites[sid - 1] for sid in sids))
+                for sid in sids:
+                    self.site_routes[sid].append(route)
+            self.routes[vid] = route
+        return route
+
+    def update_site(self, sid: int) -> None:
+        """Update the up sites of all the routes containing the site, after it fails or recovers.
+        """
+        for route in self.site_routes[sid]:
+            route.update()
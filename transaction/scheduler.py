@@ -0,0 +1,92 @@
+import heapq
+from collections import deque
+
+
+class OperationScheduler:
+    """Schedule the operations waiting to be executed.
+
+    Instead of retrying every operation on every tick, a blocked operation is
+    parked on the lock managers of the variable it waits for, and is only woken
+    up when one of them changes (a lock is released or granted, the site fails
+    or recovers, or a committed write makes the variable readable again).
+
+    Woken operations are executed in the order they were issued, and only the
+    oldest operation of every transaction is scheduled, the following ones wait
+    until it is done, so that each transaction keeps its FIFO order.
+    """
+
+    def __init__(self):
+        self.pending = {}  # tid -> deque of operations, the first one is being scheduled
+        self.ready = []  # heap of (seq, operation) to be executed in the current pass
+        self.deferred = []  # heap of operations woken up after their turn of the current pass
+        self.cursor = -1  # seq of the operation being executed, -1 if not executing
+        self.next_seq = 0
+
+    def add(self, operation) -> None:
+        """Add a new operation, it is woken up if its transaction has nothing else to do.
+        """
+        operation.seq = self.next_seq
+        self.next_seq += 1
+        queue = self.pending.setdefault(operation.tid, deque())
+        queue.append(operation)
+        if len(queue) == 1:
+            self.wake(operation)
+
+    def wake(self, operation) -> None:
+        """Make the operation ready to be executed.
+
+        If the current pass has already gone past the operation, then it is
+        executed in the next pass, just like when retrying the whole queue.
+        """
+        self.unpark(operation)
+        if operation.is_ready:
+            return
+        operation.is_ready = True
+        heap = self.ready if operation.seq > self.cursor else self.deferred
+        heapq.heappush(heap, (operation.seq, operation))
+
+    def park(self, operation, lock_managers) -> None:
+        """Park a blocked operation until one of the given lock managers changes.
+        """
+        for lock_manager in lock_managers:
+            lock_manager.waiting_operations.add(operation)
+        operation.parked_on = lock_managers
+
+    def unpark(self, operation) -> None:
+        for lock_manager in operation.parked_on:
+            lock_manager.waiting_operations.discard(operation)
+        operation.parked_on = ()
+
+    def has_ready_operations(self) -> bool:
+        return len(self.ready) > 0 or len(self.deferred) > 0
+
+    def ready_operations(self):
+        """Yield the woken operations in the order they were issued.
+        """
+        while self.ready:
+            seq, operation = heapq.heappop(self.ready)
+            if not operation.is_ready:
+                # The transaction has been aborted.
+                continue
+            operation.is_ready = False
+            self.cursor = seq
+            yield operation
+        self.cursor = -1
+        self.ready, self.deferred = self.deferred, []
+
+    def complete(self, operation) -> None:
+        """Remove a successful operation, and wake up the next one of its transaction.
+        """
+        queue = self.pending[operation.tid]
+        queue.popleft()
+        if queue:
+            self.wake(queue[0])
+        else:
+            del self.pending[operation.tid]
+
+    def remove_transaction(self, tid) -> None:
+        """Drop all the operations of the given transaction.
+        """
+        for operation in self.pending.pop(tid, ()):
+            self.unpark(operation)
+            operation.is_ready = False
@@ -0,0 +1,169 @@
+import struct
+import time
+from collections import namedtuple
+
+from data.topology import REPLICATION_STRATEGIES, Topology
+from errors import TransactionError
+from output import NullSink
+from transaction.commit import COMMIT_PROTOCOLS
+from transaction.manager import ISOLATION_LEVELS, TransactionManager
+from transaction.parser import Command, Opcode
+from transaction.prevention import DEADLOCK_POLICIES
+
+MAGIC = b'RCTR2'
+# site count, variable count, replication strategy, replication factor,
+# isolation, deadlock handling and commit protocol of the recorded run
+HEADER = struct.Struct('<IIBIBBB')
+# The first version of the traces didn't record the engine modes, the defaults were used.
+FIRST_MAGIC = b'RCTR1'
+FIRST_HEADER = struct.Struct('<IIBI')
+TAG = struct.Struct('<B')
+COMMAND = struct.Struct('<BIiiq')  # opcode, tick, tid, vid, value; -1 stands for no tid or vid
+NAME = struct.Struct('<H')  # length of the utf-8 name that follows
+STATE = struct.Struct('<I')  # number of (sid, vid, value) values that follow
+VALUE = struct.Struct('<IIq')
+
+# Tags of the records that are not commands, after the opcodes.
+NAME_TAG = 0xFE
+STATE_TAG = 0xFF
+# Commands without a value have this bit set in their opcode.
+NO_VALUE = 0x80
+
+OPCODES = list(Opcode)
+OPCODE_INDEXES = {opcode: i for i, opcode in enumerate(OPCODES)}
+
+ReplayResult = namedtuple('ReplayResult', ['commands', 'seconds', 'mismatches'])
+# The engine modes of a recorded run, which change its outcome.
+EngineModes = namedtuple('EngineModes', ['isolation', 'deadlock', 'commit_protocol'])
+
+
+class TraceRecorder:
+    """Record the accepted commands of a transaction manager into a compact binary trace.
+
+    The trace starts with the topology and the engine modes of the manager
+    (isolation, deadlock handling and commit protocol), then has one
+    fixed-size record per command with its tick, and the name of each
+    transaction before its first command. `finish` appends the final committed values of all the sites,
+    which the replayer checks. Values are stored as 64-bit integers.
+    """
+    def __init__(self, path: str, manager: TransactionManager) -> None:
+        self.file = open(path, 'wb', buffering=1 << 16)
+        self.names = manager.names
+        topology = manager.topology
+        self.trace_tids = {}  # tid of the manager -> tid in the trace, given in the order of appearance
+        self.file.write(MAGIC)
+        self.file.write(HEADER.pack(topology.site_count, topology.variable_count,
+                                    REPLICATION_STRATEGIES.index(topology.replication_name),
+                                    topology.replication_factor, ISOLATION_LEVELS.index(manager.isolation),
+                                    DEADLOCK_POLICIES.index(manager.deadlock),
+                                    COMMIT_PROTOCOLS.index(manager.commit_protocol)))
+        manager.recorder = self
+
+    def record(self, tick: int, command: Command) -> None:
+        tid = -1
+        if command.tid is not None:
+            tid = self.trace_tids.get(command.tid)
+            if tid is None:
+                tid = self.trace_tids[command.tid] = len(self.trace_tids)
+                name = self.names.tid_name(command.tid).encode()
+                self.file.write(TAG.pack(NAME_TAG) + NAME.pack(len(name)) + name)
+        opcode = OPCODE_INDEXES[command.opcode]
+        if command.value is None:
+            opcode |= NO_VALUE
+        self.file.write(COMMAND.pack(opcode, tick, tid, -1 if command.vid is None else command.vid,
+                                     0 if command.value is None else command.value))
+
+    def finish(self, manager: TransactionManager) -> None:
+        """Append the final committed values of the sites, close the trace and stop recording the manager.
+        """
+        values = [(site.sid, vid, value) for site in manager.sites for vid, value in site.committed_values().items()]
+        self.file.write(TAG.pack(STATE_TAG) + STATE.pack(len(values)))
+        self.file.write(b''.join(VALUE.pack(*x) for x in values))
+        self.file.close()
+        manager.recorder = None
+
+
+def read_trace(path: str):
+    """Read a trace, return its topology, its engine modes, the transaction names, the (tick, command) list
+    and the final state.
+
+    The final state maps (sid, vid) to the committed value, it is None if the recording wasn't finished.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        offset = len(MAGIC)
+        site_count, variable_count, replication, replication_factor, isolation, deadlock, commit_protocol = \
+            HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        modes = EngineModes(ISOLATION_LEVELS[isolation], DEADLOCK_POLICIES[deadlock], COMMIT_PROTOCOLS[commit_protocol])
+    elif data.startswith(FIRST_MAGIC):
+        offset = len(FIRST_MAGIC)
+        site_count, variable_count, replication, replication_factor = FIRST_HEADER.unpack_from(data, offset)
+        offset += FIRST_HEADER.size
+        modes = EngineModes(ISOLATION_LEVELS[0], DEADLOCK_POLICIES[0], COMMIT_PROTOCOLS[0])
+    else:
+        raise TransactionError("{} is not a trace file.".format(path))
+    topology = Topology(site_count, variable_count, REPLICATION_STRATEGIES[replication], replication_factor)
+
+    names = []
+    commands = []
+    state = None
+    while offset < len(data):
+        tag = data[offset]
+        if tag == NAME_TAG:
+            length, = NAME.unpack_from(data, offset + TAG.size)
+            offset += TAG.size + NAME.size
+            names.append(data[offset:offset + length].decode())
+            offset += length
+        elif tag == STATE_TAG:
+            count, = STATE.unpack_from(data, offset + TAG.size)
+            offset += TAG.size + STATE.size
+            state = {(sid, vid): value for sid, vid, value in
+                     VALUE.iter_unpack(data[offset:offset + count * VALUE.size])}
+            offset += count * VALUE.size
+        else:
+            opcode, tick, tid, vid, value = COMMAND.unpack_from(data, offset)
+            offset += COMMAND.size
+            commands.append((tick, Command(OPCODES[opcode & ~NO_VALUE],
+                                           None if tid < 0 else tid,
+                                           None if vid < 0 else vid,
+                                           None if opcode & NO_VALUE else value)))
+    return topology, modes, names, commands, state
+
+
+def replay(path: str, manager: TransactionManager = None, isolation: str = None,
+           deadlock: str = None) -> ReplayResult:
+    """Feed a trace through a new transaction manager with the output dropped, and check its final state.
+
+    The commands go through `process_batch`, the same path as the recorded run,
+    with the isolation, the deadlock handling and the commit protocol of the
+    recorded run, unless another isolation or deadlock handling is given.
+    Return the number of commands, the time taken by them, and the mismatches
+    between the final committed values and the recorded ones.
+    """
+    topology, modes, names, commands, state = read_trace(path)
+    if manager is None:
+        manager = TransactionManager(topology, NullSink(), commit_protocol=modes.commit_protocol,
+                                     isolation=isolation or modes.isolation, deadlock=deadlock or modes.deadlock)
+    # The trace tids are given in the order of appearance, so interning the names in order gives the same ids.
+    for name in names:
+        manager.names.tid(name)
+    if commands:
+        manager.timestamp = commands[0][0]
+    mismatches = []
+
+    start = time.perf_counter()
+    manager.process_batch(command for _, command in commands)
+    seconds = time.perf_counter() - start
+
+    if commands and manager.timestamp != commands[-1][0] + 1:
+        mismatches.append('The replay ended at tick {}, the recording at tick {}.'.format(
+            manager.timestamp - 1, commands[-1][0]))
+    if state is not None:
+        for site in manager.sites:
+            for vid, value in site.committed_values().items():
+                expected = state.get((site.sid, vid))
+                if expected != value:
+                    mismatches.append('x{}.{} is {}, recorded {}'.format(vid, site.sid, value, expected))
+    return ReplayResult(len(commands), seconds, mismatches)
@@ -1,7 +1,12 @@
 class Transaction:
-    def __init__(self, tid: str, t: int, is_ro: bool):
+    __slots__ = ('tid', 'timestamp', 'is_ro', 'is_snapshot', 'is_abort', 'visited_sites', 'lock_sites', 'writes')
+
+    def __init__(self, tid: int, t: int, is_ro: bool, is_snapshot: bool = False):
         self.tid = tid
         self.timestamp = t
         self.is_ro = is_ro
+        self.is_snapshot = is_snapshot  # reads the snapshot taken when it began and writes at commit, no locks
         self.is_abort = False
-        self.visited_sites = []
+        self.visited_sites = {}  # sid -> incarnation of the site when the transaction first read or wrote it
+        self.lock_sites = set()  # sids of the sites the transaction asked for a lock, granted or queued
+        self.writes = {}  # vid -> (value, sids) written by a snapshot transaction, sent to the sites at commit